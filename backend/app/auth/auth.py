@@ -1,41 +1,34 @@
 import hashlib
 import hmac
 import secrets
-import time
 from typing import Optional, Any
 from urllib.parse import quote
 
-import bcrypt
-from fastapi import HTTPException, status, Cookie
-
-from app.config import SESSION_COOKIE_NAME, TELEGRAM_BOT_TOKEN
+from fastapi import HTTPException, status, Cookie, Header
+
+from app.config import METRICS_TOKEN, SESSION_COOKIE_NAME, TELEGRAM_BOT_TOKEN
+from app.auth.passwords import (  # noqa: F401 — реэкспорт
+    UNUSABLE_PASSWORD,
+    hash_password,
+    hash_password_async,
+    verify_password,
+    verify_password_async,
+)
+from app.auth.sessions import session_store
 from app.database.models import User
 from app.services.database_service import db_service
 
-# In-memory session store (for production use Redis)
-_sessions: dict[str, int] = {}  # session_id -> user_id
-
-
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-
-
-def verify_password(plain: str, hashed: str) -> bool:
-    return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
-
 
-def create_session(user_id: int) -> str:
-    sid = secrets.token_urlsafe(32)
-    _sessions[sid] = user_id
-    return sid
+async def create_session(user_id: int) -> str:
+    return await session_store.create(user_id)
 
 
-def get_user_id_from_session(session_id: str) -> Optional[int]:
-    return _sessions.get(session_id)
+async def get_user_id_from_session(session_id: str) -> Optional[int]:
+    return await session_store.get(session_id)
 
 
-def delete_session(session_id: str) -> None:
-    _sessions.pop(session_id, None)
+async def delete_session(session_id: str) -> None:
+    await session_store.delete(session_id)
 
 
 def verify_telegram_auth(data: dict[str, Any], bot_token: str) -> bool:
@@ -81,24 +74,49 @@ def verify_telegram_auth(data: dict[str, Any], bot_token: str) -> bool:
     return is_valid
 
 
-async def get_current_user(
-    session_id: Optional[str] = Cookie(None, alias=SESSION_COOKIE_NAME)
-) -> User:
+async def _resolve_user(session_id: Optional[str], fresh: bool) -> User:
     if not session_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated"
         )
-    user_id = get_user_id_from_session(session_id)
+    user_id = await get_user_id_from_session(session_id)
     if not user_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired session"
         )
-    user = await db_service.get_user_by_id(user_id)
+    user = await db_service.get_user_by_id(user_id, fresh=fresh)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
     return user
+
+
+async def get_current_user(
+    session_id: Optional[str] = Cookie(None, alias=SESSION_COOKIE_NAME)
+) -> User:
+    """Пользователь из кэша (см. user_cache) — для чтения профиля и статусов.
+
+    Гарантия свежести: записи этого процесса через DatabaseService видны сразу
+    (кэш сбрасывается после коммита, более старые чтения отбрасываются по updated_at);
+    изменения из других процессов — воркеров uvicorn, python -m app.jobs — могут
+    быть не видны до USER_CACHE_TTL_SECONDS (в такой конфигурации кэш по умолчанию
+    выключен). Если решение зависит от актуального состояния — get_current_user_fresh.
+    """
+    return await _resolve_user(session_id, fresh=False)
+
+
+async def get_current_user_fresh(
+    session_id: Optional[str] = Cookie(None, alias=SESSION_COOKIE_NAME)
+) -> User:
+    """Пользователь, прочитанный из БД в этом запросе — для обработчиков, которые меняют состояние теста"""
+    return await _resolve_user(session_id, fresh=True)
+
+
+async def require_metrics_token(x_metrics_token: Optional[str] = Header(None)) -> None:
+    """Доступ к служебным метрикам: заголовок X-Metrics-Token = METRICS_TOKEN (не задан — доступа нет)"""
+    if not METRICS_TOKEN or not x_metrics_token or not secrets.compare_digest(x_metrics_token, METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
@@ -0,0 +1,99 @@
+"""
+Хэширование паролей (bcrypt) вне event loop.
+
+bcrypt намеренно медленный (десятки мс на вызов) и отпускает GIL, поэтому async-варианты
+выполняют его в отдельном ограниченном пуле потоков: всплеск логинов занимает
+PASSWORD_HASH_WORKERS потоков, а не блокирует остальные запросы.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from app.config import PASSWORD_HASH_WORKERS
+
+# Хэш, с которым невозможно войти по паролю (пользователи Telegram)
+UNUSABLE_PASSWORD = "!"
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def verify_password(plain: str, hashed: str) -> bool:
+    if not hashed or not hashed.startswith("$2"):
+        return False
+    return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
+
+
+class HashPoolMetrics:
+    """Очередь и время ожидания пула bcrypt"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.wait_seconds_total = 0.0
+        self.run_seconds_total = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self.submitted - self.completed - self.running
+
+    def snapshot(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_wait_ms": round(self.wait_seconds_total / done * 1000, 2),
+            "avg_run_ms": round(self.run_seconds_total / done * 1000, 2),
+        }
+
+
+hash_pool_metrics = HashPoolMetrics()
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+async def _run_in_pool(fn, *args):
+    metrics = hash_pool_metrics
+    submitted_at = time.perf_counter()
+
+    def job():
+        started_at = time.perf_counter()
+        with metrics.lock:
+            metrics.running += 1
+            metrics.wait_seconds_total += started_at - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with metrics.lock:
+                metrics.running -= 1
+                metrics.completed += 1
+                metrics.run_seconds_total += time.perf_counter() - started_at
+
+    with metrics.lock:
+        metrics.submitted += 1
+        metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queue_depth)
+    return await asyncio.get_running_loop().run_in_executor(_executor, job)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    if not hashed or not hashed.startswith("$2"):
+        return False
+    return await _run_in_pool(verify_password, plain, hashed)
+
+
+def shutdown_hash_pool():
+    _executor.shutdown(wait=False, cancel_futures=True)
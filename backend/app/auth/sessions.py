@@ -0,0 +1,205 @@
+"""
+Хранилища сессий авторизации (session_id из cookie -> user_id).
+
+- memory — TTL + LRU в памяти процесса (один uvicorn-воркер, сессии теряются при рестарте)
+- sqlite — таблица auth_sessions в основной БД (несколько воркеров, переживает рестарт)
+- redis  — любой сервер с протоколом Redis (GET/SET EX/EXPIRE/DEL); клиент можно подменить фейком
+
+Срок жизни скользящий: каждое обращение продлевает сессию на SESSION_TTL_SECONDS.
+"""
+import secrets
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+
+from app.config import (
+    SESSION_STORE,
+    SESSION_TTL_SECONDS,
+    SESSION_MAX_ENTRIES,
+    SESSION_TOUCH_INTERVAL_SECONDS,
+    REDIS_URL,
+)
+from app.database.models import AuthSession
+from app.database.unit_of_work import session_scope, commit
+
+
+class SessionStore(ABC):
+    """Интерфейс хранилища сессий"""
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+
+    async def create(self, user_id: int) -> str:
+        session_id = secrets.token_urlsafe(32)
+        await self.set(session_id, user_id)
+        return session_id
+
+    @abstractmethod
+    async def set(self, session_id: str, user_id: int) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[int]:
+        """user_id активной сессии (с продлением срока) или None"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    async def evict_expired(self) -> int:
+        """Удалить истёкшие сессии, вернуть их количество"""
+        return 0
+
+    async def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """TTL + LRU в памяти процесса"""
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, max_entries: int = SESSION_MAX_ENTRIES):
+        super().__init__(ttl_seconds)
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple[int, float]]" = OrderedDict()  # sid -> (user_id, expires_at)
+
+    async def set(self, session_id: str, user_id: int) -> None:
+        self._data[session_id] = (user_id, time.monotonic() + self.ttl_seconds)
+        self._data.move_to_end(session_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[int]:
+        item = self._data.get(session_id)
+        if item is None:
+            return None
+        user_id, expires_at = item
+        now = time.monotonic()
+        if expires_at <= now:
+            self._data.pop(session_id, None)
+            return None
+        self._data[session_id] = (user_id, now + self.ttl_seconds)
+        self._data.move_to_end(session_id)
+        return user_id
+
+    async def delete(self, session_id: str) -> None:
+        self._data.pop(session_id, None)
+
+    async def evict_expired(self) -> int:
+        now = time.monotonic()
+        expired = [sid for sid, (_, expires_at) in self._data.items() if expires_at <= now]
+        for sid in expired:
+            del self._data[sid]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Таблица auth_sessions; срок продлевается не чаще раза в SESSION_TOUCH_INTERVAL_SECONDS"""
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS,
+                 touch_interval_seconds: int = SESSION_TOUCH_INTERVAL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.touch_interval = timedelta(seconds=touch_interval_seconds)
+
+    async def set(self, session_id: str, user_id: int) -> None:
+        now = datetime.utcnow()
+        async with session_scope() as session:
+            session.add(AuthSession(
+                session_id=session_id,
+                user_id=user_id,
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl_seconds),
+            ))
+            await commit(session)
+
+    async def get(self, session_id: str) -> Optional[int]:
+        now = datetime.utcnow()
+        async with session_scope() as session:
+            result = await session.execute(
+                select(AuthSession.user_id, AuthSession.expires_at).where(AuthSession.session_id == session_id)
+            )
+            row = result.one_or_none()
+            if row is None or row.expires_at <= now:
+                return None
+            new_expires_at = now + timedelta(seconds=self.ttl_seconds)
+            if new_expires_at - row.expires_at >= self.touch_interval:
+                await session.execute(
+                    update(AuthSession)
+                    .where(AuthSession.session_id == session_id)
+                    .values(expires_at=new_expires_at)
+                )
+                await commit(session)
+            return row.user_id
+
+    async def delete(self, session_id: str) -> None:
+        async with session_scope() as session:
+            await session.execute(delete(AuthSession).where(AuthSession.session_id == session_id))
+            await commit(session)
+
+    async def evict_expired(self) -> int:
+        async with session_scope() as session:
+            result = await session.execute(delete(AuthSession).where(AuthSession.expires_at <= datetime.utcnow()))
+            await commit(session)
+            return result.rowcount or 0
+
+
+class RedisSessionStore(SessionStore):
+    """Хранилище с протоколом Redis: истечение — через TTL ключа на стороне сервера.
+
+    client — объект с API redis.asyncio.Redis (get/set(ex=)/expire/delete/aclose);
+    в тестах подходит fakeredis.aioredis.FakeRedis.
+    """
+
+    def __init__(self, client, ttl_seconds: int = SESSION_TTL_SECONDS, prefix: str = "prizma:session:"):
+        super().__init__(ttl_seconds)
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisSessionStore":
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE=redis требует пакет redis (pip install redis)") from e
+        return cls(redis_asyncio.from_url(url, decode_responses=True), **kwargs)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    async def set(self, session_id: str, user_id: int) -> None:
+        await self.client.set(self._key(session_id), str(user_id), ex=self.ttl_seconds)
+
+    async def get(self, session_id: str) -> Optional[int]:
+        key = self._key(session_id)
+        value = await self.client.get(key)
+        if value is None:
+            return None
+        await self.client.expire(key, self.ttl_seconds)
+        return int(value)
+
+    async def delete(self, session_id: str) -> None:
+        await self.client.delete(self._key(session_id))
+
+    async def close(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close:
+            await close()
+
+
+def build_session_store(kind: str = SESSION_STORE) -> SessionStore:
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    if kind == "redis":
+        return RedisSessionStore.from_url(REDIS_URL)
+    raise ValueError(f"Неизвестный SESSION_STORE: {kind}")
+
+
+session_store = build_session_store()
@@ -11,9 +11,37 @@ DATABASE_DIR.mkdir(exist_ok=True)
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite+aiosqlite:///{DATABASE_DIR}/prizma.db")
 SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
 
+# Пул соединений БД: "queue" — держать соединения открытыми, "null" — новое соединение на каждую сессию
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").strip().lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# PRAGMA для SQLite, выставляются на каждое новое соединение
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").strip().upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # < 0 — размер в KiB
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
 # Auth
 SECRET_KEY = os.getenv("SECRET_KEY", "change-me-in-production-use-long-random-string")
 SESSION_COOKIE_NAME = "prizma_session"
+# Служебные метрики (GET /api/metrics/db, /reports, /llm): заголовок X-Metrics-Token; пусто — закрыты
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+# Хранилище сессий: memory (один воркер), sqlite (таблица в основной БД), redis (REDIS_URL)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").strip().lower()
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(86400 * 30)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+SESSION_TOUCH_INTERVAL_SECONDS = int(os.getenv("SESSION_TOUCH_INTERVAL_SECONDS", "300"))
+SESSION_EVICT_INTERVAL_SECONDS = int(os.getenv("SESSION_EVICT_INTERVAL_SECONDS", "600"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Бот Telegram (polling), таймеры спецпредложений и очистка сессий — один экземпляр на приложение:
+# в процессе API только при одном воркере, иначе их запускает python -m app.jobs
+BACKGROUND_TASKS_IN_PROCESS = os.getenv("BACKGROUND_TASKS_IN_PROCESS", str(WEB_WORKERS == 1)).lower() == "true"
+# Потоки для bcrypt (хэширование/проверка паролей вне event loop)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 
 # Frontend (редиректы после оплаты)
@@ -60,6 +88,37 @@ SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 PERPLEXITY_MODEL = os.getenv("PERPLEXITY_MODEL", "sonar-pro")
 PERPLEXITY_ENABLED = os.getenv("PERPLEXITY_ENABLED", "false").lower() == "true"
+# Одновременных запросов к Perplexity на всё приложение (бесплатные отчёты получают слот первыми)
+PERPLEXITY_MAX_CONCURRENT_REQUESTS = int(os.getenv("PERPLEXITY_MAX_CONCURRENT_REQUESTS", "4"))
+# Потоковые ответы (SSE): страница отчёта сохраняется, как только дописана
+PERPLEXITY_STREAM = os.getenv("PERPLEXITY_STREAM", "true").lower() == "true"
+# Квота Perplexity на всё приложение: запросов и токенов в минуту (0 — без ограничения)
+PERPLEXITY_RPM = int(os.getenv("PERPLEXITY_RPM", "50"))
+PERPLEXITY_TPM = int(os.getenv("PERPLEXITY_TPM", "0"))
+# Сколько процессов генерируют отчёты (воркер в API + процессы python -m app.jobs): квота и лимит
+# одновременных запросов делятся между ними поровну. python -m app.jobs без явного значения не стартует
+REPORT_WORKER_PROCESSES = int(os.getenv("REPORT_WORKER_PROCESSES", "1"))
+REPORT_WORKER_PROCESSES_DECLARED = "REPORT_WORKER_PROCESSES" in os.environ
+# Сколько разделов премиум-отчёта генерируется одновременно (1 — последовательно)
+PERPLEXITY_SECTION_CONCURRENCY = int(os.getenv("PERPLEXITY_SECTION_CONCURRENCY", "3"))
+# Бюджет контекста запроса страницы (≈токены, 0 — без сжатия): сверх него старые страницы
+# раздела заменяются сводкой тем; последние PERPLEXITY_COMPACT_KEEP_PAGES остаются целиком
+PERPLEXITY_CONTEXT_BUDGET_TOKENS = int(os.getenv("PERPLEXITY_CONTEXT_BUDGET_TOKENS", "30000"))
+PERPLEXITY_COMPACT_KEEP_PAGES = int(os.getenv("PERPLEXITY_COMPACT_KEEP_PAGES", "2"))
+# Общий пул HTTP-соединений к Perplexity (keep-alive между запросами и задачами)
+PERPLEXITY_HTTP2 = os.getenv("PERPLEXITY_HTTP2", "false").lower() == "true"
+PERPLEXITY_MAX_CONNECTIONS = int(os.getenv("PERPLEXITY_MAX_CONNECTIONS", "10"))
+PERPLEXITY_MAX_KEEPALIVE = int(os.getenv("PERPLEXITY_MAX_KEEPALIVE", "5"))
+PERPLEXITY_KEEPALIVE_EXPIRY = float(os.getenv("PERPLEXITY_KEEPALIVE_EXPIRY", "60"))
+PERPLEXITY_CONNECT_TIMEOUT = float(os.getenv("PERPLEXITY_CONNECT_TIMEOUT", "10"))
+PERPLEXITY_READ_TIMEOUT = float(os.getenv("PERPLEXITY_READ_TIMEOUT", "120"))
+# Кэш ответов LLM по содержимому запроса (dev/staging: повторные прогоны без расхода квоты)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", str(DATABASE_DIR / "llm_cache.db")))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(86400 * 7)))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+# Процессы сборки PDF (reportlab/PyPDF2 вне event loop); 0 — в потоке процесса API/воркера
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
 
 # Robokassa (optional for dev)
 ROBOKASSA_LOGIN = os.getenv("ROBOKASSA_LOGIN", "")
@@ -67,6 +126,31 @@ ROBOKASSA_PASSWORD_1 = os.getenv("ROBOKASSA_PASSWORD_1", "")
 ROBOKASSA_PASSWORD_2 = os.getenv("ROBOKASSA_PASSWORD_2", "")
 ROBOKASSA_TEST = os.getenv("ROBOKASSA_TEST", "1") == "1"
 
+# Очередь генерации отчётов (app/jobs): воркеры в процессе API и/или отдельно — python -m app.jobs
+# (по умолчанию в API только при WEB_WORKERS=1)
+REPORT_WORKER_IN_PROCESS = os.getenv("REPORT_WORKER_IN_PROCESS", str(WEB_WORKERS == 1)).lower() == "true"
+# Кэш пользователей для get_current_user (на процесс); 0 — выключен. Сброс кэша виден только
+# в своём процессе, поэтому по умолчанию он включён, лишь когда пользователей меняет только API:
+# один воркер uvicorn, воркер отчётов и фоновые задачи внутри него
+USER_CACHE_TTL_SECONDS = float(os.getenv(
+    "USER_CACHE_TTL_SECONDS",
+    "30" if WEB_WORKERS == 1 and REPORT_WORKER_IN_PROCESS and BACKGROUND_TASKS_IN_PROCESS else "0",
+))
+# Как часто каждый процесс сверяет вопросы в БД с каталогом в памяти и перечитывает его после
+# перезаливки (python -m app.database.seed_data); 0 — не проверять (только перезапуск)
+QUESTION_CATALOG_CHECK_SECONDS = float(os.getenv("QUESTION_CATALOG_CHECK_SECONDS", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+REPORT_WORKER_CONCURRENCY = int(os.getenv("REPORT_WORKER_CONCURRENCY", "2"))
+REPORT_JOB_LEASE_SECONDS = int(os.getenv("REPORT_JOB_LEASE_SECONDS", "120"))
+REPORT_JOB_HEARTBEAT_SECONDS = int(os.getenv("REPORT_JOB_HEARTBEAT_SECONDS", "30"))
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv("REPORT_JOB_MAX_ATTEMPTS", "3"))
+REPORT_JOB_RETRY_BASE_SECONDS = int(os.getenv("REPORT_JOB_RETRY_BASE_SECONDS", "30"))
+REPORT_JOB_RETRY_MAX_SECONDS = int(os.getenv("REPORT_JOB_RETRY_MAX_SECONDS", "900"))
+REPORT_JOB_POLL_SECONDS = float(os.getenv("REPORT_JOB_POLL_SECONDS", "2"))
+# Планировщик: общий лимит выполняемых задач (по всем воркерам) и отдельный — для премиум-отчётов
+REPORT_MAX_RUNNING_JOBS = int(os.getenv("REPORT_MAX_RUNNING_JOBS", "4"))
+REPORT_MAX_RUNNING_PREMIUM = int(os.getenv("REPORT_MAX_RUNNING_PREMIUM", "2"))
+
 # Тесты
 FREE_QUESTIONS_LIMIT = int(os.getenv("FREE_QUESTIONS_LIMIT", "8"))
 PREMIUM_QUESTIONS_COUNT = int(os.getenv("PREMIUM_QUESTIONS_COUNT", "38"))
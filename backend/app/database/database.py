@@ -1,15 +1,178 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
-
-from app.config import DATABASE_URL, SQL_ECHO
-from app.database.models import Base
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
 
-engine = create_async_engine(
+from app.config import (
     DATABASE_URL,
-    echo=SQL_ECHO,
-    poolclass=NullPool
+    SQL_ECHO,
+    DB_POOL_MODE,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+    SQLITE_BUSY_TIMEOUT_MS,
 )
+from app.database.models import Base
+from app.database.migrations import run_migrations
+
+
+class PoolMetrics:
+    """Счётчики пула соединений: сколько соединений открыто, выдано и сколько ждали выдачи"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.timeouts = 0
+        self.acquire_count = 0
+        self.acquire_total_ms = 0.0
+        self.acquire_max_ms = 0.0
+
+    def record_acquire(self, elapsed_ms: float):
+        self.acquire_count += 1
+        self.acquire_total_ms += elapsed_ms
+        self.acquire_max_ms = max(self.acquire_max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        avg = self.acquire_total_ms / self.acquire_count if self.acquire_count else 0.0
+        return {
+            "mode": DB_POOL_MODE,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "timeouts": self.timeouts,
+            "acquire_avg_ms": round(avg, 3),
+            "acquire_max_ms": round(self.acquire_max_ms, 3),
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class RequestDbStats:
+    """Счётчики сессий и SQL-запросов в рамках одного HTTP-запроса"""
+
+    __slots__ = ("sessions", "statements")
+
+    def __init__(self):
+        self.sessions = 0
+        self.statements = 0
+
+
+request_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("request_db_stats", default=None)
+_request_totals = {"requests": 0, "sessions": 0, "statements": 0}
+
+
+def record_request_stats(stats: RequestDbStats):
+    _request_totals["requests"] += 1
+    _request_totals["sessions"] += stats.sessions
+    _request_totals["statements"] += stats.statements
+
+
+class _AcquireTimingMixin:
+    """Замер времени получения соединения из пула (ожидание + открытие нового)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.record_acquire((time.perf_counter() - started) * 1000)
+
+
+class _MeteredQueuePool(_AcquireTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class _MeteredNullPool(_AcquireTimingMixin, NullPool):
+    pass
+
+
+def _create_engine():
+    if DB_POOL_MODE == "null":
+        return create_async_engine(DATABASE_URL, echo=SQL_ECHO, poolclass=_MeteredNullPool)
+    if DB_POOL_MODE != "queue":
+        raise ValueError(f"Неизвестный DB_POOL_MODE: {DB_POOL_MODE}")
+    return create_async_engine(
+        DATABASE_URL,
+        echo=SQL_ECHO,
+        poolclass=_MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+
+
+engine = _create_engine()
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_metrics.connects += 1
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.checkouts += 1
+    pool_metrics.in_use += 1
+    pool_metrics.peak_in_use = max(pool_metrics.peak_in_use, pool_metrics.in_use)
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.checkins += 1
+    pool_metrics.in_use = max(0, pool_metrics.in_use - 1)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _on_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+def get_pool_metrics() -> dict:
+    """Метрики пула соединений и средние сессии/запросы на HTTP-запрос (для /api/metrics/db)"""
+    data = pool_metrics.snapshot()
+    data["status"] = engine.pool.status()
+    requests = _request_totals["requests"]
+    data["requests"] = {
+        **_request_totals,
+        "sessions_per_request": round(_request_totals["sessions"] / requests, 2) if requests else 0.0,
+        "statements_per_request": round(_request_totals["statements"] / requests, 2) if requests else 0.0,
+    }
+    return data
+
 
 async_session = sessionmaker(
     engine,
@@ -18,24 +181,13 @@ async_session = sessionmaker(
 )
 
 
-async def _run_migrations(conn):
-    """Миграция: добавление колонок для Telegram-авторизации"""
-    from sqlalchemy import text
-    result = await conn.execute(text("PRAGMA table_info(users)"))
-    existing = {row[1] for row in result.fetchall()}
-    for col, col_type in [
-        ("telegram_id", "BIGINT"),
-        ("telegram_username", "VARCHAR(100)"),
-        ("notification_6_hours_sent", "BOOLEAN DEFAULT 0"),
-        ("notification_1_hour_sent", "BOOLEAN DEFAULT 0"),
-        ("notification_10_minutes_sent", "BOOLEAN DEFAULT 0"),
-    ]:
-        if col not in existing:
-            await conn.execute(text(f"ALTER TABLE users ADD COLUMN {col} {col_type}"))
-
-
 async def init_db():
     """Инициализация базы данных"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-        await _run_migrations(conn)
+        await run_migrations(conn)
+
+
+async def close_db():
+    """Закрыть все соединения пула (при остановке приложения)"""
+    await engine.dispose()
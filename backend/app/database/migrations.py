@@ -0,0 +1,114 @@
+"""
+Версионные миграции схемы (SQLite).
+
+Каждая миграция применяется один раз; номера применённых версий хранятся
+в таблице schema_migrations, так что при обычном старте схема не инспектируется.
+Новые таблицы и индексы из models.py создаёт create_all — миграции нужны
+для уже существующих баз.
+"""
+from datetime import datetime
+from typing import Awaitable, Callable, List, NamedTuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database.models import ReportPage
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+async def _add_columns(conn: AsyncConnection, table: str, columns: List[tuple]):
+    result = await conn.execute(text(f"PRAGMA table_info({table})"))
+    existing = {row[1] for row in result.fetchall()}
+    for col, col_type in columns:
+        if col not in existing:
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}"))
+
+
+async def _execute_ddl(conn: AsyncConnection, indexes: List[str]):
+    for ddl in indexes:
+        await conn.execute(text(ddl))
+
+
+async def _m001_telegram_and_notification_columns(conn: AsyncConnection):
+    await _add_columns(conn, "users", [
+        ("telegram_id", "BIGINT"),
+        ("telegram_username", "VARCHAR(100)"),
+        ("notification_6_hours_sent", "BOOLEAN DEFAULT 0"),
+        ("notification_1_hour_sent", "BOOLEAN DEFAULT 0"),
+        ("notification_10_minutes_sent", "BOOLEAN DEFAULT 0"),
+    ])
+
+
+async def _m002_hot_path_indexes(conn: AsyncConnection):
+    await _execute_ddl(conn, [
+        "CREATE INDEX IF NOT EXISTS ix_answers_user_question ON answers (user_id, question_id)",
+        "CREATE INDEX IF NOT EXISTS ix_questions_active_version_order "
+        "ON questions (is_active, test_version, order_number)",
+    ])
+
+
+async def _m003_unique_answer_per_question(conn: AsyncConnection):
+    # Оставляем последний ответ на каждый (user_id, question_id) — так же работает upsert
+    await conn.execute(text(
+        "DELETE FROM answers WHERE id NOT IN (SELECT MAX(id) FROM answers GROUP BY user_id, question_id)"
+    ))
+    await _execute_ddl(conn, [
+        "DROP INDEX IF EXISTS ix_answers_user_question",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_answers_user_question ON answers (user_id, question_id)",
+    ])
+
+
+async def _m004_report_job_priority(conn: AsyncConnection):
+    await _add_columns(conn, "report_jobs", [("priority", "INTEGER NOT NULL DEFAULT 0")])
+    await conn.execute(text("UPDATE report_jobs SET priority = 10 WHERE report_type = 'premium'"))
+    await _execute_ddl(conn, [
+        "DROP INDEX IF EXISTS ix_report_jobs_status_run_after",
+        "CREATE INDEX IF NOT EXISTS ix_report_jobs_status_priority ON report_jobs (status, priority, run_after)",
+    ])
+
+
+async def _m005_report_pages_checkpoint_key(conn: AsyncConnection):
+    # Страницы по job_id заменены чекпоинтами по (пользователь, тип отчёта, хэш ответов);
+    # старые строки — кэш, их можно не переносить
+    result = await conn.execute(text("PRAGMA table_info(report_pages)"))
+    if "job_id" in {row[1] for row in result.fetchall()}:
+        await conn.execute(text("DROP TABLE report_pages"))
+        await conn.run_sync(ReportPage.__table__.create)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "users: колонки Telegram и флаги уведомлений", _m001_telegram_and_notification_columns),
+    Migration(2, "индексы answers(user_id, question_id), questions(is_active, test_version, order_number)",
+              _m002_hot_path_indexes),
+    Migration(3, "answers: дубли удалены, уникальный индекс (user_id, question_id)", _m003_unique_answer_per_question),
+    Migration(4, "report_jobs: приоритет задач", _m004_report_job_priority),
+    Migration(5, "report_pages: ключ по пользователю и хэшу ответов", _m005_report_pages_checkpoint_key),
+]
+
+
+async def run_migrations(conn: AsyncConnection) -> List[int]:
+    """Применить недостающие миграции, вернуть список применённых версий"""
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(255), applied_at DATETIME)"
+    ))
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    applied = {row[0] for row in result.fetchall()}
+    newly_applied = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        await migration.apply(conn)
+        await conn.execute(
+            text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+            {"v": migration.version, "d": migration.description, "t": datetime.utcnow()},
+        )
+        newly_applied.append(migration.version)
+        logger.info(f"Миграция {migration.version} применена: {migration.description}")
+    return newly_applied
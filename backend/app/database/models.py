@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey, Index, Enum as SQLEnum, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -26,6 +26,14 @@ class ReportGenerationStatus(Enum):
     FAILED = "FAILED"
 
 
+class JobStatus(Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -87,6 +95,17 @@ class User(Base):
     current_question = relationship("Question", foreign_keys=[current_question_id])
 
 
+class AuthSession(Base):
+    """Сессия авторизации (SESSION_STORE=sqlite)"""
+
+    __tablename__ = "auth_sessions"
+
+    session_id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
 class Question(Base):
     __tablename__ = "questions"
 
@@ -102,6 +121,10 @@ class Question(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     answers = relationship("Answer", back_populates="question")
 
+    __table_args__ = (
+        Index("ix_questions_active_version_order", "is_active", "test_version", "order_number"),
+    )
+
 
 class Answer(Base):
     __tablename__ = "answers"
@@ -120,6 +143,11 @@ class Answer(Base):
     user = relationship("User", back_populates="answers")
     question = relationship("Question", back_populates="answers")
 
+    __table_args__ = (
+        # Один ответ на вопрос: повторная отправка обновляет строку (upsert в save_answer)
+        Index("ux_answers_user_question", "user_id", "question_id", unique=True),
+    )
+
 
 class Payment(Base):
     __tablename__ = "payments"
@@ -165,3 +193,85 @@ class Report(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     generated_at = Column(DateTime, nullable=True)
     user = relationship("User")
+
+
+class ReportJob(Base):
+    """Задача генерации отчёта в очереди (app/jobs): аренда воркером, heartbeat, повторы"""
+
+    __tablename__ = "report_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    report_type = Column(String(20), nullable=False)
+    priority = Column(Integer, nullable=False, default=0)  # меньше — раньше (бесплатные перед премиум)
+    status = Column(SQLEnum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    result_path = Column(String(500), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_report_jobs_status_priority", "status", "priority", "run_after"),
+        # Не больше одной активной задачи на пользователя и тип отчёта
+        Index(
+            "ux_report_jobs_active", "user_id", "report_type", unique=True,
+            sqlite_where=text("status IN ('QUEUED', 'RUNNING')"),
+        ),
+    )
+
+
+class ReportPage(Base):
+    """Чекпоинт AI-анализа: готовая страница или ответ-подтверждение модели.
+
+    Ключ — пользователь, тип отчёта и хэш ответов: для тех же ответов страницы
+    не генерируются повторно (повтор задачи, новая задача на тот же отчёт).
+    """
+
+    __tablename__ = "report_pages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    report_type = Column(String(20), nullable=False)
+    answers_hash = Column(String(64), nullable=False)
+    # page3..page5 (free), page_01..page_63 (premium), initial — первичный анализ, section:<key> — раздел
+    page_key = Column(String(60), nullable=False)
+    section_key = Column(String(50), nullable=True)
+    page_num = Column(Integer, nullable=True)
+    global_page = Column(Integer, nullable=True)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_report_pages_checkpoint", "user_id", "report_type", "answers_hash", "page_key", unique=True),
+    )
+
+
+class LlmCall(Base):
+    """Вызов LLM: токены, длительность, повторы и итог (ok / cached / error)"""
+
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("report_jobs.id"), nullable=True, index=True)
+    user_id = Column(Integer, nullable=True)
+    report_type = Column(String(20), nullable=True)
+    model = Column(String(100), nullable=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    latency_ms = Column(Integer, nullable=False, default=0)  # весь вызов, с ожиданием квоты и повторами
+    queue_ms = Column(Integer, nullable=False, default=0)  # ожидание квоты и слота
+    retries = Column(Integer, nullable=False, default=0)
+    status = Column(String(20), nullable=False)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_llm_calls_created", "created_at"),
+    )
@@ -7,6 +7,7 @@ from pathlib import Path
 
 from sqlalchemy import delete
 
+from app.config import QUESTION_CATALOG_CHECK_SECONDS
 from app.database.database import init_db, async_session
 from app.database.models import Question, QuestionType
 
@@ -52,6 +53,11 @@ async def load_questions():
             current_order += 1
         await session.commit()
     print("Questions loaded:", len(all_questions))
+    # Каталог в памяти у запущенных API и app.jobs обновится сам при следующей проверке
+    if QUESTION_CATALOG_CHECK_SECONDS > 0:
+        print(f"Running API/app.jobs processes will reload questions within {QUESTION_CATALOG_CHECK_SECONDS:g} s")
+    else:
+        print("QUESTION_CATALOG_CHECK_SECONDS=0: restart API and app.jobs to pick up the new questions")
 
 
 async def main():
@@ -0,0 +1,138 @@
+"""
+Единица работы (unit of work) на HTTP-запрос.
+
+Все обращения DatabaseService внутри одного запроса идут через одну сессию,
+одно соединение и одну транзакцию, которая фиксируется после обработчика
+(до запуска BackgroundTasks). Вне запроса каждый метод открывает свою сессию.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.database import async_session, engine, RequestDbStats, request_stats, record_request_stats
+
+
+class UnitOfWork:
+    """Общая сессия и транзакция одного запроса"""
+
+    def __init__(self):
+        self.session: AsyncSession = async_session()
+        self.owner = asyncio.current_task()
+        self.active = True
+        self.stats: Optional[RequestDbStats] = None
+        self.after_close: List[Callable[[], None]] = []  # вызываются после commit/rollback
+
+    async def commit(self):
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("current_uow", default=None)
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    """UoW текущего запроса; задачи, порождённые через create_task, работают со своими сессиями"""
+    uow = _current_uow.get()
+    if uow is None or not uow.active or uow.owner is not asyncio.current_task():
+        return None
+    return uow
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """Открыть UoW: commit при успехе (и при HTTPException), rollback при прочих ошибках.
+    Сессию, которая после ошибки flush ждёт rollback, не фиксируем и при HTTPException"""
+    stats = RequestDbStats()
+    stats_token = request_stats.set(stats)
+    uow = UnitOfWork()
+    uow.stats = stats
+    stats.sessions += 1
+    token = _current_uow.set(uow)
+    try:
+        try:
+            yield uow
+        except HTTPException:
+            if uow.session.is_active:
+                await uow.commit()
+            else:
+                await uow.rollback()
+            raise
+        except BaseException:
+            await uow.rollback()
+            raise
+        else:
+            await uow.commit()
+    finally:
+        uow.active = False
+        _current_uow.reset(token)
+        await uow.session.close()
+        for callback in uow.after_close:
+            callback()
+        request_stats.reset(stats_token)
+        record_request_stats(stats)
+
+
+@asynccontextmanager
+async def session_scope():
+    """Сессия текущего UoW или новая короткая сессия"""
+    uow = current_unit_of_work()
+    if uow is not None:
+        yield uow.session
+        return
+    stats = request_stats.get()
+    if stats is not None:
+        stats.sessions += 1
+    async with async_session() as session:
+        yield session
+
+
+@asynccontextmanager
+async def savepoint(session: AsyncSession):
+    """Вставка, которая может нарушить уникальность: внутри UoW — в SAVEPOINT,
+    чтобы IntegrityError откатывал только её, а транзакция запроса оставалась рабочей"""
+    uow = current_unit_of_work()
+    if uow is None or uow.session is not session:
+        yield
+        return
+    if engine.dialect.name == "sqlite":
+        # pysqlite начинает транзакцию только перед DML; SAVEPOINT вне транзакции
+        # открыл бы её сам, и RELEASE зафиксировал бы вставку до конца запроса
+        conn = await session.connection()
+        raw = await conn.get_raw_connection()
+        if not raw.driver_connection.in_transaction:
+            await conn.exec_driver_sql("BEGIN")
+    async with session.begin_nested():
+        yield
+
+
+async def commit(session: AsyncSession):
+    """Внутри UoW только flush — фиксация в конце запроса; иначе обычный commit"""
+    uow = current_unit_of_work()
+    if uow is not None and uow.session is session:
+        await session.flush()
+    else:
+        await session.commit()
+
+
+class UnitOfWorkRoute(APIRoute):
+    """Маршрут, выполняющий обработчик и его зависимости внутри одного UoW"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            async with unit_of_work() as uow:
+                response = await handler(request)
+            response.headers["X-DB-Sessions"] = str(uow.stats.sessions)
+            response.headers["X-DB-Statements"] = str(uow.stats.statements)
+            return response
+
+        return route_handler
+
@@ -0,0 +1,80 @@
+"""
+Отдельный процесс-воркер очереди отчётов и фоновых задач приложения.
+
+Запуск из backend/: python -m app.jobs [--concurrency N] [--background | --no-background]
+(в API при этом можно выключить встроенный воркер: REPORT_WORKER_IN_PROCESS=false)
+
+--background — ещё и бот Telegram, таймеры спецпредложений и очистка сессий (app.jobs.background);
+по умолчанию включено, если API их не запускает (BACKGROUND_TASKS_IN_PROCESS=false, т.е. WEB_WORKERS > 1).
+Воркеров отчётов может быть несколько, фоновые задачи — только в одном процессе.
+
+Квота Perplexity делится между процессами-генераторами отчётов, поэтому REPORT_WORKER_PROCESSES
+(все такие процессы, включая воркер в API) должен быть задан явно — иначе процесс не стартует.
+"""
+import argparse
+import asyncio
+import signal
+import sys
+
+from loguru import logger
+
+from app.auth.sessions import session_store
+from app.config import (
+    BACKGROUND_TASKS_IN_PROCESS,
+    REPORT_WORKER_CONCURRENCY,
+    REPORT_WORKER_IN_PROCESS,
+    REPORT_WORKER_PROCESSES,
+    REPORT_WORKER_PROCESSES_DECLARED,
+)
+from app.database.database import init_db, close_db
+from app.jobs.background import start_background_tasks, stop_background_tasks
+from app.jobs.worker import ReportWorker
+from app.services.http_client import perplexity_http
+from app.services.llm_cache import llm_cache
+from app.services.pdf_render import pdf_render_pool
+from app.services.question_catalog import question_catalog
+
+
+def _check_worker_processes():
+    """Отдельный воркер делит квоту Perplexity с другими процессами — их число должно быть объявлено"""
+    if not REPORT_WORKER_PROCESSES_DECLARED:
+        sys.exit("Задайте REPORT_WORKER_PROCESSES — число процессов, генерирующих отчёты "
+                 "(python -m app.jobs и воркер в API): квота Perplexity делится между ними")
+    if REPORT_WORKER_IN_PROCESS and REPORT_WORKER_PROCESSES < 2:
+        sys.exit("REPORT_WORKER_IN_PROCESS=true: воркер в API — тоже процесс с долей квоты, "
+                 "REPORT_WORKER_PROCESSES должен быть не меньше 2")
+
+
+async def main(concurrency: int, background: bool):
+    await init_db()
+    await question_catalog.load()
+    worker = ReportWorker(concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    runner = asyncio.create_task(worker.run())
+    background_tasks = start_background_tasks() if background else []
+    await stop.wait()
+    logger.info("Остановка воркера отчётов...")
+    if background:
+        await stop_background_tasks(background_tasks)
+    await worker.stop()
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    await perplexity_http.aclose()
+    await llm_cache.close()
+    await session_store.close()
+    pdf_render_pool.shutdown()
+    await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воркер очереди генерации отчётов PRIZMA")
+    parser.add_argument("--concurrency", type=int, default=REPORT_WORKER_CONCURRENCY)
+    parser.add_argument("--background", action=argparse.BooleanOptionalAction,
+                        default=not BACKGROUND_TASKS_IN_PROCESS,
+                        help="бот Telegram, таймеры спецпредложений и очистка сессий в этом процессе")
+    args = parser.parse_args()
+    _check_worker_processes()
+    asyncio.run(main(args.concurrency, args.background))
@@ -0,0 +1,135 @@
+"""
+Фоновые задачи, которые должны работать в одном процессе на всё приложение:
+polling бота Telegram, проверка таймеров спецпредложений, очистка истёкших сессий.
+
+С одним воркером uvicorn их запускает API (BACKGROUND_TASKS_IN_PROCESS=true),
+с несколькими — отдельный процесс python -m app.jobs (иначе каждый воркер
+запустил бы свой polling и разослал бы уведомления по таймерам повторно).
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import List
+
+from loguru import logger
+
+from app.auth.sessions import session_store
+from app.config import SESSION_EVICT_INTERVAL_SECONDS
+from app.database.models import User
+from app.services.database_service import db_service
+
+
+async def check_and_send_timer_notifications(user: User, remaining_seconds: int):
+    """Проверить и отправить уведомления по таймеру спецпредложения (TG + email)"""
+    try:
+        if not user:
+            return
+        hours = int(remaining_seconds // 3600)
+        minutes = int((remaining_seconds % 3600) // 60)
+        logger.info(f"⏱️ Пользователь {user.id}: осталось {hours:02d}:{minutes:02d}:00, флаги: 6ч={getattr(user, 'notification_6_hours_sent', False)}, 1ч={getattr(user, 'notification_1_hour_sent', False)}, 10м={getattr(user, 'notification_10_minutes_sent', False)}")
+        from app.services.telegram_service import telegram_service
+        from app.services.email_service import email_service
+
+        from app.services.push_service import push_service
+        push_subs = await db_service.get_push_subscriptions(user.id)
+
+        def _push_any_sent(results: list) -> bool:
+            return any(results) if results else False
+
+        if 6 <= hours < 7 and not getattr(user, "notification_6_hours_sent", False):
+            logger.info(f"⏰ Отправляем уведомление за 6 часов до конца акции пользователю {user.id}")
+            tg_ok = await telegram_service.send_special_offer_6_hours_left(user.telegram_id) if user.telegram_id else False
+            email_ok = await email_service.send_special_offer_6_hours_left(user.email) if user.email else False
+            push_ok = _push_any_sent([
+                await push_service.send_special_offer_6_hours_left(s.endpoint, s.p256dh, s.auth)
+                for s in push_subs
+            ])
+            if tg_ok or email_ok or push_ok:
+                await db_service.update_user(user.id, {"notification_6_hours_sent": True})
+        elif 1 <= hours < 2 and not getattr(user, "notification_1_hour_sent", False):
+            logger.info(f"⏰ Отправляем уведомление за 1 час до конца акции пользователю {user.id}")
+            tg_ok = await telegram_service.send_special_offer_1_hour_left(user.telegram_id) if user.telegram_id else False
+            email_ok = await email_service.send_special_offer_1_hour_left(user.email) if user.email else False
+            push_ok = _push_any_sent([
+                await push_service.send_special_offer_1_hour_left(s.endpoint, s.p256dh, s.auth)
+                for s in push_subs
+            ])
+            if tg_ok or email_ok or push_ok:
+                await db_service.update_user(user.id, {"notification_1_hour_sent": True})
+        elif hours == 0 and 10 <= minutes < 20 and not getattr(user, "notification_10_minutes_sent", False):
+            logger.info(f"⏰ Отправляем уведомление за 10 минут до конца акции пользователю {user.id}")
+            tg_ok = await telegram_service.send_special_offer_10_minutes_left(user.telegram_id) if user.telegram_id else False
+            email_ok = await email_service.send_special_offer_10_minutes_left(user.email) if user.email else False
+            push_ok = _push_any_sent([
+                await push_service.send_special_offer_10_minutes_left(s.endpoint, s.p256dh, s.auth)
+                for s in push_subs
+            ])
+            if tg_ok or email_ok or push_ok:
+                await db_service.update_user(user.id, {"notification_10_minutes_sent": True})
+    except Exception as e:
+        logger.error(f"❌ Ошибка при проверке таймера для пользователя {user.id if user else '?'}: {e}")
+
+
+async def background_timer_checker():
+    """Фоновая проверка таймеров и отправка уведомлений (TG + email)"""
+    from sqlalchemy import select
+    from app.database.database import async_session
+    while True:
+        try:
+            logger.info("🔄 Запуск фоновой проверки таймеров спецпредложений...")
+            async with async_session() as session:
+                stmt = select(User).where(User.special_offer_started_at.isnot(None))
+                result = await session.execute(stmt)
+                users = result.scalars().all()
+                logger.info(f"📊 Найдено {len(users)} пользователей с активными таймерами")
+                for user in users:
+                    try:
+                        end = user.special_offer_started_at + timedelta(hours=12)
+                        remaining_time = max(0, (end - datetime.utcnow()).total_seconds())
+                        await check_and_send_timer_notifications(user, int(remaining_time))
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка при обработке пользователя {user.id}: {e}")
+            logger.info("✅ Фоновая проверка таймеров завершена")
+        except Exception as e:
+            logger.error(f"❌ Критическая ошибка в фоновой задаче таймеров: {e}")
+        await asyncio.sleep(300)  # 5 минут
+
+
+async def background_session_evictor():
+    """Периодическое удаление истёкших сессий авторизации"""
+    while True:
+        await asyncio.sleep(SESSION_EVICT_INTERVAL_SECONDS)
+        try:
+            evicted = await session_store.evict_expired()
+            if evicted:
+                logger.info(f"Удалено истёкших сессий: {evicted}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки сессий: {e}")
+
+
+def start_background_tasks() -> List[asyncio.Task]:
+    """Запустить таймеры, очистку сессий и polling бота в текущем event loop"""
+    tasks = [
+        asyncio.create_task(background_timer_checker()),
+        asyncio.create_task(background_session_evictor()),
+    ]
+    logger.info("Background timer checker started")
+    try:
+        from app.bot.bot_setup import start_polling
+        tasks.append(asyncio.create_task(start_polling()))
+        logger.info("Telegram bot polling started")
+    except Exception as e:
+        logger.warning(f"Telegram bot polling not started: {e}")
+    return tasks
+
+
+async def stop_background_tasks(tasks: List[asyncio.Task]):
+    """Остановить polling, закрыть сессию бота и отменить фоновые задачи"""
+    try:
+        from app.bot.bot_setup import stop_polling, close_bot
+        await stop_polling()
+        await close_bot()
+    except Exception as e:
+        logger.debug(f"Bot shutdown: {e}")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
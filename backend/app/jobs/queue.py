@@ -0,0 +1,371 @@
+"""
+Очередь задач генерации отчётов в основной БД (таблица report_jobs).
+
+Воркер забирает задачу одним UPDATE ... RETURNING (аренда на REPORT_JOB_LEASE_SECONDS),
+продлевает аренду heartbeat'ом. Задача с истёкшей арендой (воркер упал, рестарт)
+снова доступна другим воркерам. Ошибка — повтор с экспоненциальной задержкой,
+после REPORT_JOB_MAX_ATTEMPTS попыток — FAILED.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+
+from app.config import (
+    REPORT_MAX_RUNNING_JOBS,
+    REPORT_MAX_RUNNING_PREMIUM,
+    REPORT_JOB_LEASE_SECONDS,
+    REPORT_JOB_MAX_ATTEMPTS,
+    REPORT_JOB_RETRY_BASE_SECONDS,
+    REPORT_JOB_RETRY_MAX_SECONDS,
+)
+from app.database.models import JobStatus, ReportGenerationStatus, ReportJob
+from app.database.unit_of_work import session_scope, commit, current_unit_of_work
+from app.services.database_service import db_service
+from app.services.report_pages import PAGES_TOTAL, report_pages
+
+ACTIVE_STATUSES = (JobStatus.QUEUED, JobStatus.RUNNING)
+# Бесплатный отчёт короткий и пользователь ждёт его на экране — он идёт раньше премиум
+PRIORITIES = {"free": 0, "premium": 10}
+# Оценка длительности, пока нет завершённых задач
+DEFAULT_DURATION_SECONDS = {"free": 60.0, "premium": 1800.0}
+
+
+class ReportJobQueue:
+    def __init__(self, lease_seconds: int = REPORT_JOB_LEASE_SECONDS,
+                 max_attempts: int = REPORT_JOB_MAX_ATTEMPTS,
+                 max_running: int = REPORT_MAX_RUNNING_JOBS,
+                 max_running_premium: int = REPORT_MAX_RUNNING_PREMIUM):
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.max_running = max_running
+        self.max_running_premium = max_running_premium
+        self._wakeup: Optional[asyncio.Event] = None
+
+    # --- постановка и чтение ---
+
+    async def enqueue(self, user_id: int, report_type: str) -> ReportJob:
+        """Поставить задачу (если активной ещё нет) и выставить отчёту статус PROCESSING"""
+        stmt = sqlite_insert(ReportJob).values(
+            user_id=user_id,
+            report_type=report_type,
+            priority=PRIORITIES.get(report_type, 0),
+            status=JobStatus.QUEUED,
+            attempts=0,
+            max_attempts=self.max_attempts,
+            run_after=datetime.utcnow(),
+            created_at=datetime.utcnow(),
+        ).on_conflict_do_nothing(
+            index_elements=[ReportJob.user_id, ReportJob.report_type],
+            index_where=text("status IN ('QUEUED', 'RUNNING')"),
+        )
+        async with session_scope() as session:
+            await session.execute(stmt)
+            await commit(session)
+        await db_service.update_report_generation_status(user_id, report_type, ReportGenerationStatus.PROCESSING)
+        uow = current_unit_of_work()
+        if uow is not None:
+            uow.after_close.append(self.notify)
+        else:
+            self.notify()
+        return await self.active(user_id, report_type)
+
+    async def active(self, user_id: int, report_type: str) -> Optional[ReportJob]:
+        async with session_scope() as session:
+            result = await session.execute(
+                select(ReportJob).where(
+                    ReportJob.user_id == user_id,
+                    ReportJob.report_type == report_type,
+                    ReportJob.status.in_(ACTIVE_STATUSES),
+                )
+            )
+            return result.scalar_one_or_none()
+
+    async def latest(self, user_id: int, report_type: str) -> Optional[ReportJob]:
+        async with session_scope() as session:
+            result = await session.execute(
+                select(ReportJob)
+                .where(ReportJob.user_id == user_id, ReportJob.report_type == report_type)
+                .order_by(ReportJob.id.desc())
+                .limit(1)
+            )
+            return result.scalar_one_or_none()
+
+    async def cancel(self, user_id: int, report_type: str) -> int:
+        """Отменить активную задачу; воркер узнает об этом при следующем heartbeat"""
+        async with session_scope() as session:
+            result = await session.execute(
+                update(ReportJob)
+                .where(
+                    ReportJob.user_id == user_id,
+                    ReportJob.report_type == report_type,
+                    ReportJob.status.in_(ACTIVE_STATUSES),
+                )
+                .values(status=JobStatus.CANCELLED, finished_at=datetime.utcnow(), lease_owner=None)
+            )
+            await commit(session)
+            return result.rowcount or 0
+
+    async def report_status(self, user_id: int, report_type: str) -> dict:
+        """Статус отчёта (как get_report_generation_status) + состояние последней задачи"""
+        info = await db_service.get_report_generation_status(user_id, report_type)
+        job = await self.latest(user_id, report_type)
+        if job is None:
+            return info
+        if job.status in ACTIVE_STATUSES:
+            info["status"] = ReportGenerationStatus.PROCESSING.value
+        info["job"] = {
+            "id": job.id,
+            "status": job.status.value,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "next_attempt_at": job.run_after if job.status == JobStatus.QUEUED else None,
+            "heartbeat_at": job.heartbeat_at,
+            "error": job.error,
+            "pages_done": await report_pages.progress(user_id, report_type),
+            "pages_total": PAGES_TOTAL.get(report_type),
+        }
+        if job.status == JobStatus.QUEUED:
+            position, wait_seconds = await self.estimate_wait(job)
+            info["job"]["queue_position"] = position
+            info["job"]["estimated_wait_seconds"] = wait_seconds
+        return info
+
+    async def _avg_durations(self, session) -> dict:
+        """Средняя длительность последних завершённых задач по типам отчёта"""
+        durations = dict(DEFAULT_DURATION_SECONDS)
+        for report_type in durations:
+            recent = (
+                select(ReportJob.started_at, ReportJob.finished_at)
+                .where(ReportJob.report_type == report_type, ReportJob.status == JobStatus.COMPLETED,
+                       ReportJob.started_at.isnot(None))
+                .order_by(ReportJob.id.desc())
+                .limit(20)
+            )
+            rows = (await session.execute(recent)).all()
+            if rows:
+                durations[report_type] = sum((r.finished_at - r.started_at).total_seconds() for r in rows) / len(rows)
+        return durations
+
+    async def _active_counts(self, session) -> dict:
+        """{(status, report_type): count} для активных задач"""
+        result = await session.execute(
+            select(ReportJob.status, ReportJob.report_type, func.count())
+            .where(ReportJob.status.in_(ACTIVE_STATUSES))
+            .group_by(ReportJob.status, ReportJob.report_type)
+        )
+        return {(status, report_type): count for status, report_type, count in result.all()}
+
+    async def estimate_wait(self, job: ReportJob) -> Tuple[int, float]:
+        """Место в очереди (0 — следующая) и оценка ожидания до старта, сек"""
+        async with session_scope() as session:
+            ahead = await session.execute(
+                select(ReportJob.report_type, func.count())
+                .where(
+                    ReportJob.status == JobStatus.QUEUED,
+                    or_(ReportJob.priority < job.priority,
+                        and_(ReportJob.priority == job.priority, ReportJob.id < job.id)),
+                )
+                .group_by(ReportJob.report_type)
+            )
+            ahead_counts = dict(ahead.all())
+            counts = await self._active_counts(session)
+            durations = await self._avg_durations(session)
+        running = {rt: c for (st, rt), c in counts.items() if st == JobStatus.RUNNING}
+        # Впереди: задачи из очереди целиком и выполняемые — в среднем наполовину
+        work = sum(durations.get(rt, 0.0) * c for rt, c in ahead_counts.items())
+        work += sum(durations.get(rt, 0.0) * c / 2 for rt, c in running.items())
+        if sum(running.values()) + sum(ahead_counts.values()) < self.max_running:
+            return sum(ahead_counts.values()), 0.0
+        return sum(ahead_counts.values()), round(work / max(self.max_running, 1), 1)
+
+    async def stats(self) -> dict:
+        """Глубина очереди, выполняемые задачи и средняя длительность по типам"""
+        async with session_scope() as session:
+            counts = await self._active_counts(session)
+            durations = await self._avg_durations(session)
+        by_type = {}
+        for report_type in sorted({rt for _, rt in counts} | set(PRIORITIES)):
+            by_type[report_type] = {
+                "queued": counts.get((JobStatus.QUEUED, report_type), 0),
+                "running": counts.get((JobStatus.RUNNING, report_type), 0),
+                "avg_duration_seconds": round(durations.get(report_type, 0.0), 1),
+            }
+        return {
+            "max_running": self.max_running,
+            "max_running_premium": self.max_running_premium,
+            "queue_depth": sum(v["queued"] for v in by_type.values()),
+            "running": sum(v["running"] for v in by_type.values()),
+            "by_type": by_type,
+        }
+
+    # --- сторона воркера ---
+
+    def notify(self):
+        """Разбудить воркеры этого процесса (новая задача)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_for_work(self, timeout: float):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _running_live(self, now: datetime, report_type: Optional[str] = None):
+        running = aliased(ReportJob)
+        stmt = select(func.count()).select_from(running).where(
+            running.status == JobStatus.RUNNING, running.lease_expires_at >= now
+        )
+        if report_type is not None:
+            stmt = stmt.where(running.report_type == report_type)
+        return stmt.scalar_subquery()
+
+    async def claim(self, worker_id: str) -> Optional[ReportJob]:
+        """Взять в аренду следующую задачу: по приоритету, затем по времени готовности.
+
+        Задача с истёкшей арендой снова доступна. Новая задача не берётся, если
+        по всем воркерам уже выполняется REPORT_MAX_RUNNING_JOBS задач, а премиум —
+        если выполняется REPORT_MAX_RUNNING_PREMIUM премиум-задач.
+        """
+        now = datetime.utcnow()
+        claimable = and_(
+            or_(
+                and_(ReportJob.status == JobStatus.QUEUED, ReportJob.run_after <= now),
+                and_(ReportJob.status == JobStatus.RUNNING, ReportJob.lease_expires_at < now),
+            ),
+            ReportJob.attempts < ReportJob.max_attempts,
+            self._running_live(now) < self.max_running,
+            or_(
+                ReportJob.report_type != "premium",
+                self._running_live(now, "premium") < self.max_running_premium,
+            ),
+        )
+        candidate = (
+            select(ReportJob.id)
+            .where(claimable)
+            .order_by(ReportJob.priority, ReportJob.run_after, ReportJob.id)
+            .limit(1)
+        ).scalar_subquery()
+        stmt = (
+            update(ReportJob)
+            .where(ReportJob.id == candidate, claimable)
+            .values(
+                status=JobStatus.RUNNING,
+                attempts=ReportJob.attempts + 1,
+                lease_owner=worker_id,
+                lease_expires_at=now + self.lease,
+                heartbeat_at=now,
+                started_at=now,
+                error=None,
+            )
+            .returning(ReportJob)
+        )
+        async with session_scope() as session:
+            result = await session.execute(stmt)
+            job = result.scalar_one_or_none()
+            await commit(session)
+            return job
+
+    async def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """Продлить аренду; False — задача отменена или перехвачена другим воркером"""
+        now = datetime.utcnow()
+        async with session_scope() as session:
+            result = await session.execute(
+                update(ReportJob)
+                .where(
+                    ReportJob.id == job_id,
+                    ReportJob.lease_owner == worker_id,
+                    ReportJob.status == JobStatus.RUNNING,
+                )
+                .values(heartbeat_at=now, lease_expires_at=now + self.lease)
+            )
+            await commit(session)
+            return result.rowcount == 1
+
+    async def complete(self, job: ReportJob, worker_id: str, result_path: str) -> bool:
+        """Завершить задачу и в той же транзакции выставить пользователю COMPLETED.
+        False — аренда потеряна (задачу отменили или перехватили): статус пользователя не меняется"""
+        async with session_scope() as session:
+            result = await session.execute(
+                update(ReportJob)
+                .where(
+                    ReportJob.id == job.id,
+                    ReportJob.lease_owner == worker_id,
+                    ReportJob.status == JobStatus.RUNNING,
+                )
+                .values(lease_owner=None, lease_expires_at=None, status=JobStatus.COMPLETED,
+                        result_path=result_path, finished_at=datetime.utcnow())
+            )
+            if result.rowcount != 1:
+                return False
+            await db_service.mark_report_completed(session, job.user_id, job.report_type, result_path)
+            await commit(session)
+            return True
+
+    async def release(self, job_id: int, worker_id: str) -> bool:
+        """Вернуть задачу в очередь без штрафа (остановка воркера)"""
+        return await self._finish(
+            job_id, worker_id,
+            status=JobStatus.QUEUED, run_after=datetime.utcnow(), attempts=ReportJob.attempts - 1, finished_at=None,
+        )
+
+    async def fail(self, job: ReportJob, worker_id: str, error: str) -> bool:
+        """Записать ошибку попытки. True — будет повтор, False — попытки исчерпаны (FAILED)"""
+        if job.attempts >= job.max_attempts:
+            await self._finish(job.id, worker_id, status=JobStatus.FAILED, error=error)
+            return False
+        await self._finish(
+            job.id, worker_id,
+            status=JobStatus.QUEUED, run_after=datetime.utcnow() + self.backoff(job.attempts),
+            error=error, finished_at=None,
+        )
+        return True
+
+    @staticmethod
+    def backoff(attempts: int) -> timedelta:
+        return timedelta(seconds=min(REPORT_JOB_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0),
+                                     REPORT_JOB_RETRY_MAX_SECONDS))
+
+    async def fail_abandoned(self) -> List[Tuple[int, str]]:
+        """Задачи с истёкшей арендой и исчерпанными попытками -> FAILED; вернуть (user_id, report_type)"""
+        now = datetime.utcnow()
+        async with session_scope() as session:
+            result = await session.execute(
+                update(ReportJob)
+                .where(
+                    ReportJob.status == JobStatus.RUNNING,
+                    ReportJob.lease_expires_at < now,
+                    ReportJob.attempts >= ReportJob.max_attempts,
+                )
+                .values(status=JobStatus.FAILED, finished_at=now, lease_owner=None,
+                        error="Аренда истекла: воркер не завершил задачу")
+                .returning(ReportJob.user_id, ReportJob.report_type)
+            )
+            rows = [(row.user_id, row.report_type) for row in result.all()]
+            await commit(session)
+            return rows
+
+    async def _finish(self, job_id: int, worker_id: str, **values) -> bool:
+        values.setdefault("finished_at", datetime.utcnow())
+        async with session_scope() as session:
+            result = await session.execute(
+                update(ReportJob)
+                .where(
+                    ReportJob.id == job_id,
+                    ReportJob.lease_owner == worker_id,
+                    ReportJob.status == JobStatus.RUNNING,
+                )
+                .values(lease_owner=None, lease_expires_at=None, **values)
+            )
+            await commit(session)
+            return result.rowcount == 1
+
+
+report_jobs = ReportJobQueue()
@@ -0,0 +1,104 @@
+"""
+Воркер очереди отчётов: до REPORT_WORKER_CONCURRENCY задач одновременно.
+
+Запускается в процессе API (REPORT_WORKER_IN_PROCESS=true) или отдельно:
+python -m app.jobs. Несколько воркеров/процессов безопасно делят одну очередь.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from typing import Optional, Set
+
+from loguru import logger
+
+from app.config import REPORT_WORKER_CONCURRENCY, REPORT_JOB_HEARTBEAT_SECONDS, REPORT_JOB_POLL_SECONDS
+from app.database.models import ReportJob
+from app.jobs.queue import ReportJobQueue, report_jobs
+from app.services.report_generation import generate_report, notify_report_failed, notify_report_ready
+
+
+class ReportWorker:
+    def __init__(self, concurrency: int = REPORT_WORKER_CONCURRENCY, queue: ReportJobQueue = report_jobs,
+                 worker_id: Optional[str] = None):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    async def run(self):
+        logger.info(f"Воркер отчётов {self.worker_id} запущен, параллельно задач: {self.concurrency}")
+        slots = asyncio.Semaphore(self.concurrency)
+        while not self._stopping.is_set():
+            await slots.acquire()
+            if self._stopping.is_set():
+                break
+            job = None
+            try:
+                await self._fail_abandoned()
+                job = await self.queue.claim(self.worker_id)
+            except Exception as e:
+                logger.error(f"❌ Очередь отчётов недоступна: {e}")
+            if job is None:
+                slots.release()
+                await self.queue.wait_for_work(REPORT_JOB_POLL_SECONDS)
+                continue
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: (self._tasks.discard(t), slots.release()))
+
+    async def stop(self):
+        """Остановить приём задач; выполняемые вернуть в очередь"""
+        self._stopping.set()
+        self.queue.notify()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _fail_abandoned(self):
+        for user_id, report_type in await self.queue.fail_abandoned():
+            logger.error(f"❌ Отчёт {report_type} для user_id={user_id}: попытки исчерпаны")
+            await notify_report_failed(user_id, report_type, "Ошибка генерации")
+
+    async def _run_job(self, job: ReportJob):
+        logger.info(f"Задача {job.id}: отчёт {job.report_type} для user_id={job.user_id}, попытка {job.attempts}/{job.max_attempts}")
+        heartbeat = asyncio.create_task(self._heartbeat(job, asyncio.current_task()))
+        completed_path = None
+        try:
+            report_path = await generate_report(job.user_id, job.report_type, job)
+            if await self.queue.complete(job, self.worker_id, report_path):
+                completed_path = report_path
+                logger.info(f"✅ Задача {job.id} выполнена: {report_path}")
+            else:
+                logger.warning(f"Задача {job.id}: аренда потеряна (отменена или перехвачена), отчёт {report_path} не зафиксирован")
+        except asyncio.CancelledError:
+            if self._stopping.is_set():
+                await self.queue.release(job.id, self.worker_id)
+                logger.info(f"Задача {job.id} возвращена в очередь (остановка воркера)")
+            else:
+                logger.info(f"Задача {job.id} прервана: отменена или перехвачена")
+        except Exception as e:
+            logger.error(f"Report generation error (задача {job.id}): {e}")
+            if await self.queue.fail(job, self.worker_id, str(e)):
+                logger.info(f"Задача {job.id}: повтор через {self.queue.backoff(job.attempts)}")
+            else:
+                await notify_report_failed(job.user_id, job.report_type, str(e))
+        finally:
+            heartbeat.cancel()
+        if completed_path:
+            # Вне try: задача уже выполнена, ошибка рассылки не должна вести к повтору
+            await notify_report_ready(job.user_id, job.report_type, completed_path)
+
+    async def _heartbeat(self, job: ReportJob, runner: asyncio.Task):
+        while True:
+            await asyncio.sleep(REPORT_JOB_HEARTBEAT_SECONDS)
+            try:
+                alive = await self.queue.heartbeat(job.id, self.worker_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat задачи {job.id} не записан: {e}")
+                continue
+            if not alive:
+                runner.cancel()
+                return
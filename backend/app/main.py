@@ -13,25 +13,28 @@ from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Response, Cookie, Body
+from fastapi import FastAPI, HTTPException, Depends, Response, Cookie, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.exc import IntegrityError
 from fastapi.responses import RedirectResponse, FileResponse
 
 from app.auth.auth import (
     get_current_user,
-    hash_password,
-    verify_password,
+    get_current_user_fresh,
+    hash_password_async,
+    verify_password_async,
     create_session,
     delete_session,
     verify_telegram_auth,
+    require_metrics_token,
 )
+from app.auth.passwords import hash_pool_metrics, shutdown_hash_pool
+from app.auth.sessions import session_store
 from app.config import (
     BASE_DIR,
     FRONTEND_URL,
     VAPID_PUBLIC_KEY,
     TELEGRAM_BOT_TOKEN,
-    FREE_QUESTIONS_LIMIT,
     PREMIUM_PRICE_ORIGINAL,
     PREMIUM_PRICE_DISCOUNT,
     ROBOKASSA_LOGIN,
@@ -39,12 +42,18 @@ from app.config import (
     ROBOKASSA_PASSWORD_2,
     ROBOKASSA_TEST,
     SESSION_COOKIE_NAME,
+    SESSION_STORE,
+    SESSION_TTL_SECONDS,
+    REPORT_WORKER_IN_PROCESS,
+    BACKGROUND_TASKS_IN_PROCESS,
     PERPLEXITY_ENABLED,
 )
-from app.database.database import init_db
+from app.database.database import init_db, close_db, get_pool_metrics
+from app.database.unit_of_work import UnitOfWorkRoute
 from app.database.models import User, ReportGenerationStatus, PaymentStatus
 from app.models.api_models import (
     AnswerRequest,
+    AnswerBatchRequest,
     UserProfileUpdate,
     RegisterRequest,
     LoginRequest,
@@ -58,7 +67,20 @@ from app.models.api_models import (
     UserProfileResponse,
 )
 from app.services.database_service import db_service
+from app.services.question_catalog import question_catalog
+from app.services.user_cache import user_cache
+from app.services.test_state import TestState, test_state_service
 from app.services.oplata import RobokassaService
+from app.services.report_generation import generate_simple_report
+from app.services.rate_limiter import perplexity_slots, perplexity_rate
+from app.services.llm_cache import llm_cache
+from app.services.llm_usage import SUMMARY_MAX_DAYS, llm_usage
+from app.services.http_client import perplexity_http
+from app.services.pdf_templates import template_cache
+from app.services.pdf_render import pdf_render_pool
+from app.jobs.queue import report_jobs
+from app.jobs.worker import ReportWorker
+from app.jobs.background import check_and_send_timer_notifications, start_background_tasks, stop_background_tasks
 from loguru import logger
 
 app = FastAPI(
@@ -68,56 +90,42 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
 )
-
-async def _background_timer_checker():
-    """Фоновая проверка таймеров и отправка уведомлений (TG + email)"""
-    from sqlalchemy import select
-    from app.database.database import async_session
-    while True:
-        try:
-            logger.info("🔄 Запуск фоновой проверки таймеров спецпредложений...")
-            async with async_session() as session:
-                stmt = select(User).where(User.special_offer_started_at.isnot(None))
-                result = await session.execute(stmt)
-                users = result.scalars().all()
-                logger.info(f"📊 Найдено {len(users)} пользователей с активными таймерами")
-                for user in users:
-                    try:
-                        end = user.special_offer_started_at + timedelta(hours=12)
-                        remaining_time = max(0, (end - datetime.utcnow()).total_seconds())
-                        await check_and_send_timer_notifications(user, int(remaining_time))
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка при обработке пользователя {user.id}: {e}")
-            logger.info("✅ Фоновая проверка таймеров завершена")
-        except Exception as e:
-            logger.error(f"❌ Критическая ошибка в фоновой задаче таймеров: {e}")
-        await asyncio.sleep(300)  # 5 минут
-
+# Каждый обработчик (и его зависимости) работает в одной сессии/транзакции
+app.router.route_class = UnitOfWorkRoute
 
 @app.on_event("startup")
 async def startup():
     await init_db()
     logger.info("Database initialized")
-    asyncio.create_task(_background_timer_checker())
-    logger.info("Background timer checker started")
+    await question_catalog.load()
+    logger.info(f"Session store: {SESSION_STORE}")
+    # Бот, таймеры и очистка сессий — один экземпляр на приложение: при WEB_WORKERS > 1
+    # их запускает python -m app.jobs, а не каждый воркер uvicorn
+    if BACKGROUND_TASKS_IN_PROCESS:
+        app.state.background_tasks = start_background_tasks()
+    else:
+        logger.info("Фоновые задачи (бот, таймеры, очистка сессий) — в процессе python -m app.jobs")
+    if REPORT_WORKER_IN_PROCESS:
+        app.state.report_worker = ReportWorker()
+        app.state.report_worker_task = asyncio.create_task(app.state.report_worker.run())
 
-    # Запуск Telegram-бота (polling) в фоне
-    try:
-        from app.bot.bot_setup import start_polling
-        asyncio.create_task(start_polling())
-        logger.info("Telegram bot polling started")
-    except Exception as e:
-        logger.warning(f"Telegram bot polling not started: {e}")
 
 @app.on_event("shutdown")
 async def shutdown():
-    """Остановить бота при завершении приложения"""
-    try:
-        from app.bot.bot_setup import stop_polling, close_bot
-        await stop_polling()
-        await close_bot()
-    except Exception as e:
-        logger.debug(f"Bot shutdown: {e}")
+    """Остановить бота и фоновые задачи при завершении приложения"""
+    tasks = getattr(app.state, "background_tasks", None)
+    if tasks is not None:
+        await stop_background_tasks(tasks)
+    worker = getattr(app.state, "report_worker", None)
+    if worker is not None:
+        await worker.stop()
+        app.state.report_worker_task.cancel()
+    await perplexity_http.aclose()
+    await llm_cache.close()
+    await session_store.close()
+    shutdown_hash_pool()
+    pdf_render_pool.shutdown()
+    await close_db()
 
 app.add_middleware(
     CORSMiddleware,
@@ -149,15 +157,7 @@ async def serve_offerta():
 
 
 async def update_current_question(user_id: int, question_id: int):
-    from sqlalchemy import update as sql_update
-    from app.database.database import async_session
-    async with async_session() as session:
-        stmt = sql_update(User).where(User.id == user_id).values(
-            current_question_id=question_id,
-            updated_at=datetime.utcnow()
-        )
-        await session.execute(stmt)
-        await session.commit()
+    await db_service.update_user(user_id, {"current_question_id": question_id})
 
 
 # --- Auth ---
@@ -170,19 +170,19 @@ async def register(data: RegisterRequest):
     try:
         user = await db_service.create_user(
             email=data.email,
-            password_hash=hash_password(data.password),
+            password_hash=await hash_password_async(data.password),
             name=data.name
         )
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
-    sid = create_session(user.id)
+    sid = await create_session(user.id)
     response = Response(status_code=201)
     response.set_cookie(
         key=SESSION_COOKIE_NAME,
         value=sid,
         httponly=True,
         samesite="lax",
-        max_age=86400 * 30,
+        max_age=SESSION_TTL_SECONDS,
     )
     return {"status": "ok", "user": {"id": user.id, "email": user.email, "name": user.name}}
 
@@ -190,15 +190,15 @@ async def register(data: RegisterRequest):
 @app.post("/api/auth/login")
 async def login(data: LoginRequest, response: Response):
     user = await db_service.get_user_by_email(data.email)
-    if not user or not verify_password(data.password, user.password_hash):
+    if not user or not await verify_password_async(data.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Неверный email или пароль")
-    sid = create_session(user.id)
+    sid = await create_session(user.id)
     response.set_cookie(
         key=SESSION_COOKIE_NAME,
         value=sid,
         httponly=True,
         samesite="lax",
-        max_age=86400 * 30,
+        max_age=SESSION_TTL_SECONDS,
     )
     return {"status": "ok", "user": {"id": user.id, "email": user.email, "name": user.name}}
 
@@ -233,13 +233,13 @@ async def login_telegram(data: dict, response: Response):
             last_name=data.get("last_name"),
             username=data.get("username"),
         )
-    sid = create_session(user.id)
+    sid = await create_session(user.id)
     response.set_cookie(
         key=SESSION_COOKIE_NAME,
         value=sid,
         httponly=True,
         samesite="lax",
-        max_age=86400 * 30,
+        max_age=SESSION_TTL_SECONDS,
     )
     return {"status": "ok", "user": {"id": user.id, "email": user.email, "name": user.name}}
 
@@ -247,7 +247,7 @@ async def login_telegram(data: dict, response: Response):
 @app.post("/api/auth/logout")
 async def logout(response: Response, session_id: Optional[str] = Cookie(None, alias=SESSION_COOKIE_NAME)):
     if session_id:
-        delete_session(session_id)
+        await delete_session(session_id)
     response.delete_cookie(SESSION_COOKIE_NAME)
     return {"status": "ok"}
 
@@ -333,8 +333,7 @@ async def send_test_push(user: User = Depends(get_current_user)):
 
 @app.post("/api/me/profile", response_model=UserProfileResponse)
 async def update_profile(data: UserProfileUpdate, user: User = Depends(get_current_user)):
-    await db_service.update_user_profile(user.id, name=data.name, age=data.age, gender=data.gender)
-    u = await db_service.get_user_by_id(user.id)
+    u = await db_service.update_user_profile(user.id, name=data.name, age=data.age, gender=data.gender)
     return UserProfileResponse(
         status="ok",
         user={
@@ -347,95 +346,126 @@ async def update_profile(data: UserProfileUpdate, user: User = Depends(get_curre
     )
 
 
+def _question_response(question) -> QuestionResponse:
+    return QuestionResponse(
+        id=question.id,
+        text=question.text,
+        order_number=question.order_number,
+        type=question.type.value,
+        allow_voice=question.allow_voice,
+        max_length=question.max_length,
+    )
+
+
+def _progress_response(state: TestState) -> ProgressResponse:
+    return ProgressResponse(current=state.current, total=state.total, answered=state.answered)
+
+
 @app.get("/api/me/current-question", response_model=CurrentQuestionResponse)
-async def get_current_question(user: User = Depends(get_current_user)):
-    user = await db_service.get_user_by_id(user.id)  # свежая версия
-    if not user.current_question_id:
-        if user.is_paid and user.free_test_completed:
-            first_premium = await db_service.get_first_question("premium")
-            await db_service.update_user(user.id, {"current_question_id": first_premium.id})
-            user = await db_service.get_user_by_id(user.id)
-        else:
-            user = await db_service.start_test(user.id)
-    else:
-        current_q = await db_service.get_question(user.current_question_id)
-        if current_q and current_q.test_version == "free" and user.is_paid:
-            first_premium = await db_service.get_first_question("premium")
-            await db_service.update_user(user.id, {"current_question_id": first_premium.id})
-            user = await db_service.get_user_by_id(user.id)
+async def get_current_question(user: User = Depends(get_current_user_fresh)):
+    state = await test_state_service.current(user)
+    user = state.user
     if user.test_completed and not user.is_paid:
         raise HTTPException(status_code=400, detail="Тест уже завершен")
-    if user.test_completed and user.is_paid:
-        user.test_completed = False
-        user.test_completed_at = None
-        await db_service.update_user_test_status(user.id, False)
-
-    question = await db_service.get_question(user.current_question_id)
-    if not question:
+    if not state.question:
         raise HTTPException(status_code=404, detail="Question not found")
 
-    test_version = "premium" if user.is_paid else "free"
-    total = await db_service.get_total_questions(test_version)
-    answers = await db_service.get_user_answers_by_test_version(user.id, test_version)
-    display_current = (
-        question.order_number - FREE_QUESTIONS_LIMIT if test_version == "premium" else question.order_number
-    )
-
     return CurrentQuestionResponse(
-        question=QuestionResponse(
-            id=question.id,
-            text=question.text,
-            order_number=question.order_number,
-            type=question.type.value,
-            allow_voice=question.allow_voice,
-            max_length=question.max_length,
-        ),
-        progress=ProgressResponse(current=display_current, total=total, answered=len(answers)),
+        question=_question_response(state.question),
+        progress=_progress_response(state),
         user=UserStatusResponse(is_paid=user.is_paid, test_completed=user.test_completed),
     )
 
 
-@app.post("/api/me/answer", response_model=NextQuestionResponse)
-async def save_answer(data: AnswerRequest, background_tasks: BackgroundTasks, user: User = Depends(get_current_user)):
-    if not user.current_question_id:
-        raise HTTPException(status_code=400, detail="No active question")
-    current_q = await db_service.get_question(user.current_question_id)
-    if not current_q:
-        raise HTTPException(status_code=404, detail="Question not found")
-
-    await db_service.save_answer(user.id, current_q.id, text_answer=data.text_answer, answer_type=data.answer_type)
-
-    test_version = "premium" if user.is_paid else "free"
-    next_q = await db_service.get_next_question(current_q.id, test_version)
+async def _advance_after_answer(user: User, answered_q, test_version: str) -> NextQuestionResponse:
+    """Перейти к вопросу после answered_q или завершить тест и поставить отчёт в очередь"""
+    next_q = await db_service.get_next_question(answered_q.id, test_version)
 
     if next_q:
         await update_current_question(user.id, next_q.id)
-        total = await db_service.get_total_questions(test_version)
-        answers = await db_service.get_user_answers_by_test_version(user.id, test_version)
-        display = next_q.order_number - FREE_QUESTIONS_LIMIT if test_version == "premium" else next_q.order_number
+        state = await test_state_service.at_question(user, next_q, test_version)
         return NextQuestionResponse(
             status="next_question",
-            next_question=QuestionResponse(
-                id=next_q.id,
-                text=next_q.text,
-                order_number=next_q.order_number,
-                type=next_q.type.value,
-                allow_voice=next_q.allow_voice,
-                max_length=next_q.max_length,
-            ),
-            progress=ProgressResponse(current=display, total=total, answered=len(answers)),
+            next_question=_question_response(next_q),
+            progress=_progress_response(state),
         )
     else:
         await db_service.complete_test(user.id, test_version)
         if not user.is_paid and not user.special_offer_started_at:
             await db_service.update_user(user.id, {"special_offer_started_at": datetime.utcnow()})
         if not user.is_paid:
-            background_tasks.add_task(_generate_report_bg, user.id, "free")
+            await report_jobs.enqueue(user.id, "free")
         elif user.is_paid:
-            background_tasks.add_task(_generate_report_bg, user.id, "premium")
+            await report_jobs.enqueue(user.id, "premium")
         return NextQuestionResponse(status="test_completed", message="Тест завершен", is_paid=user.is_paid)
 
 
+@app.post("/api/me/answer", response_model=NextQuestionResponse)
+async def save_answer(data: AnswerRequest, user: User = Depends(get_current_user_fresh)):
+    if not user.current_question_id:
+        raise HTTPException(status_code=400, detail="No active question")
+    current_q = await db_service.get_question(user.current_question_id)
+    if not current_q:
+        raise HTTPException(status_code=404, detail="Question not found")
+
+    await db_service.save_answer(user.id, current_q.id, text_answer=data.text_answer, answer_type=data.answer_type)
+
+    test_version = test_state_service.version_for(user)
+    return await _advance_after_answer(user, current_q, test_version)
+
+
+@app.post("/api/me/answers/batch", response_model=NextQuestionResponse)
+async def save_answers_batch(data: AnswerBatchRequest, user: User = Depends(get_current_user_fresh)):
+    """Сохранить ответы, накопленные офлайн, одним запросом (повторная отправка не создаёт дублей).
+
+    Принимаются ответы на уже пройденные вопросы и на непрерывную цепочку вопросов,
+    начиная с текущего; вопрос дальше текущего без ответов на все вопросы перед ним —
+    ошибка. Позиция в тесте сдвигается к последнему вопросу этой цепочки.
+    """
+    if not user.current_question_id:
+        raise HTTPException(status_code=400, detail="No active question")
+    test_version = test_state_service.version_for(user)
+    current_q = await db_service.get_question(user.current_question_id)
+    if not current_q:
+        raise HTTPException(status_code=404, detail="Question not found")
+    questions = []
+    for item in data.answers:
+        q = await db_service.get_question(item.question_id)
+        if not q or not q.is_active or q.test_version != test_version:
+            raise HTTPException(status_code=400, detail=f"Вопрос {item.question_id} недоступен")
+        questions.append(q)
+
+    # Цепочка отвеченных подряд вопросов от текущего
+    answered_ids = {q.id for q in questions}
+    last_q = None
+    q = current_q
+    while q is not None and q.id in answered_ids:
+        last_q = q
+        q = await db_service.get_next_question(q.id, test_version)
+    reachable_order = last_q.order_number if last_q else current_q.order_number - 1
+    for q in questions:
+        if q.order_number > reachable_order:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Вопрос {q.id} идёт после неотвеченных вопросов: ответы нужно отправлять по порядку",
+            )
+
+    saved = await db_service.save_answers(user.id, [item.model_dump() for item in data.answers])
+
+    if last_q is None:
+        # Досланы ответы на уже пройденные вопросы — позицию в тесте не сдвигаем
+        state = await test_state_service.at_question(user, current_q, test_version)
+        return NextQuestionResponse(
+            status="next_question",
+            next_question=_question_response(current_q),
+            progress=_progress_response(state),
+            saved=saved,
+        )
+    result = await _advance_after_answer(user, last_q, test_version)
+    result.saved = saved
+    return result
+
+
 @app.get("/api/me/progress", response_model=UserProgressResponse)
 async def get_progress(user: User = Depends(get_current_user)):
     answers = await db_service.get_user_answers(user.id)
@@ -460,109 +490,16 @@ async def get_progress(user: User = Depends(get_current_user)):
 
 # --- Reports ---
 
-async def _generate_simple_report_async(user_id: int, report_type: str) -> str:
-    """Простая генерация отчета (без Perplexity) - текст по Q&A"""
-    reports_dir = BASE_DIR / "reports"
-    reports_dir.mkdir(exist_ok=True)
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    prefix = f"prizma_premium_report_{user_id}" if report_type == "premium" else f"prizma_report_{user_id}"
-    out_path = reports_dir / f"{prefix}_{ts}.txt"
-    questions = await db_service.get_questions_by_version(report_type)
-    answers = await db_service.get_user_answers_by_test_version(user_id, report_type)
-    qa = {}
-    for a in answers:
-        if a.question:
-            qa[a.question.order_number] = (a.question.text, a.text_answer or "")
-    lines = ["PRIZMA - Психологический отчет\n", "=" * 60]
-    for order in sorted(qa.keys()):
-        qtext, atext = qa[order]
-        lines.append(f"\nВопрос {order}: {qtext}")
-        lines.append(f"Ответ: {atext}")
-    out_path.write_text("\n".join(lines), encoding="utf-8")
-    return str(out_path)
-
-
-async def _generate_report_bg(user_id: int, report_type: str):
-    """Фоновая генерация отчета"""
-    try:
-        await db_service.update_report_generation_status(user_id, report_type, ReportGenerationStatus.PROCESSING)
-        user = await db_service.get_user_by_id(user_id)
-        questions = await db_service.get_questions_by_version(report_type)
-        answers = await db_service.get_user_answers_by_test_version(user_id, report_type)
-
-        if PERPLEXITY_ENABLED:
-            logger.info(f"Генерация отчёта через Perplexity AI для user_id={user_id} (report_type={report_type})")
-            try:
-                from app.services.perplexity import AIAnalysisService
-                ai = AIAnalysisService()
-                if report_type == "premium":
-                    result = await ai.generate_premium_report(user, questions, answers)
-                else:
-                    result = await ai.generate_psychological_report(user, questions, answers)
-                if result.get("success"):
-                    report_path = result["report_file"]
-                else:
-                    raise Exception(result.get("error", "AI error"))
-            except Exception as e:
-                logger.warning(f"Perplexity failed: {e}, falling back to simple report")
-                report_path = await _generate_simple_report_async(user_id, report_type)
-        else:
-            report_path = await _generate_simple_report_async(user_id, report_type)
-
-        if report_path:
-            await db_service.update_report_generation_status(
-                user_id, report_type, ReportGenerationStatus.COMPLETED, report_path=report_path
-            )
-            if not user.special_offer_started_at:
-                await db_service.update_user(user_id, {"special_offer_started_at": datetime.utcnow()})
-            # Обновляем user перед отправкой — он мог привязать Telegram во время генерации
-            user = await db_service.get_user_by_id(user_id)
-            is_premium = report_type == "premium"
-            if user and user.email:
-                from app.services.email_service import email_service
-                await email_service.send_report_ready_notification(
-                    user.email, report_path, is_premium, user.telegram_id, user.id
-                )
-                if not is_premium:
-                    await email_service.send_premium_offer(user.email)
-            if user and not is_premium:
-                from app.services.push_service import push_service
-                subs = await db_service.get_push_subscriptions(user.id)
-                for sub in subs:
-                    await push_service.send_premium_offer(sub.endpoint, sub.p256dh, sub.auth)
-        else:
-            await db_service.update_report_generation_status(
-                user_id, report_type, ReportGenerationStatus.FAILED, error="Ошибка генерации"
-            )
-            user = await db_service.get_user_by_id(user_id)
-            if user and user.email:
-                from app.services.email_service import email_service
-                await email_service.send_error_notification(user.email, "Ошибка генерации")
-    except Exception as e:
-        logger.error(f"Report generation error: {e}")
-        await db_service.update_report_generation_status(
-            user_id, report_type, ReportGenerationStatus.FAILED, error=str(e)
-        )
-        user = await db_service.get_user_by_id(user_id)
-        if user and user.email:
-            from app.services.email_service import email_service
-            await email_service.send_error_notification(user.email, str(e))
-
-
-async def _generate_simple_report(user_id: int, report_type: str) -> str:
-    return await _generate_simple_report_async(user_id, report_type)
-
-
 @app.post("/api/me/generate-report")
-async def start_report_generation(background_tasks: BackgroundTasks, user: User = Depends(get_current_user)):
+async def start_report_generation(user: User = Depends(get_current_user_fresh)):
     if not user.test_completed and not user.is_paid:
         raise HTTPException(status_code=400, detail="Завершите тест")
     if user.is_premium_paid:
         return {"status": "premium_paid", "message": "Используется премиум отчет"}
 
-    await db_service.reset_stuck_reports(user.id)
-    if await db_service.is_report_generating(user.id, "free"):
+    if await report_jobs.active(user.id, "free"):
         return {"status": "already_processing", "message": "Отчет уже генерируется"}
+    await db_service.reset_stuck_reports(user.id)
 
     reports_dir = BASE_DIR / "reports"
     for pattern in [f"prizma_report_{user.id}_*.pdf", f"prizma_report_{user.id}_*.txt"]:
@@ -571,20 +508,19 @@ async def start_report_generation(background_tasks: BackgroundTasks, user: User
             latest = max(existing, key=lambda x: Path(x).stat().st_mtime)
             return {"status": "already_exists", "message": "Отчет готов", "report_path": latest}
 
-    await db_service.update_report_generation_status(user.id, "free", ReportGenerationStatus.PROCESSING)
-    background_tasks.add_task(_generate_report_bg, user.id, "free")
+    await report_jobs.enqueue(user.id, "free")
     return {"status": "processing", "message": "Генерация запущена"}
 
 
 @app.get("/api/me/report-status")
 async def check_report_status(user: User = Depends(get_current_user)):
-    return await db_service.get_report_generation_status(user.id, "free")
+    return await report_jobs.report_status(user.id, "free")
 
 
 @app.get("/api/me/reports-status")
 async def get_reports_status(user: User = Depends(get_current_user)):
-    free = await db_service.get_report_generation_status(user.id, "free")
-    premium = await db_service.get_report_generation_status(user.id, "premium")
+    free = await report_jobs.report_status(user.id, "free")
+    premium = await report_jobs.report_status(user.id, "premium")
     return {"free": free, "premium": premium}
 
 
@@ -601,7 +537,7 @@ async def download_report(user: User = Depends(get_current_user)):
         raise HTTPException(status_code=202, detail="Отчет генерируется")
     if PERPLEXITY_ENABLED:
         raise HTTPException(status_code=404, detail="Отчет еще не готов. Обновите страницу и дождитесь завершения генерации.")
-    report_path = await _generate_simple_report(user.id, "free")
+    report_path = await generate_simple_report(user.id, "free")
     return FileResponse(report_path, filename=f"prizma-report-{user.id}.txt")
 
 
@@ -655,30 +591,30 @@ async def download_premium_report_by_telegram_id(telegram_id: int):
 
 
 @app.post("/api/me/generate-premium-report")
-async def start_premium_report(background_tasks: BackgroundTasks, user: User = Depends(get_current_user)):
+async def start_premium_report(user: User = Depends(get_current_user_fresh)):
     if not user.is_premium_paid:
         raise HTTPException(status_code=400, detail="Оплатите премиум")
-    await db_service.reset_stuck_reports(user.id)
-    if await db_service.is_report_generating(user.id, "premium"):
+    if await report_jobs.active(user.id, "premium"):
         return {"status": "already_processing"}
-    await db_service.update_report_generation_status(user.id, "premium", ReportGenerationStatus.PROCESSING)
-    background_tasks.add_task(_generate_report_bg, user.id, "premium")
+    await db_service.reset_stuck_reports(user.id)
+    await report_jobs.enqueue(user.id, "premium")
     return {"status": "processing"}
 
 
 @app.get("/api/me/premium-report-status")
 async def premium_report_status(user: User = Depends(get_current_user)):
-    return await db_service.get_report_generation_status(user.id, "premium")
+    return await report_jobs.report_status(user.id, "premium")
 
 
 @app.post("/api/me/stop-report-generation")
-async def stop_report(user: User = Depends(get_current_user)):
+async def stop_report(user: User = Depends(get_current_user_fresh)):
+    await report_jobs.cancel(user.id, "premium")
     await db_service.update_report_generation_status(user.id, "premium", ReportGenerationStatus.PENDING)
     return {"status": "ok"}
 
 
 @app.post("/api/me/reset-test")
-async def reset_test(user: User = Depends(get_current_user)):
+async def reset_test(user: User = Depends(get_current_user_fresh)):
     await db_service.clear_user_answers(user.id)
     await db_service.update_user(user.id, {
         "current_question_id": None,
@@ -692,57 +628,6 @@ async def reset_test(user: User = Depends(get_current_user)):
 
 # --- Special offer timer ---
 
-async def check_and_send_timer_notifications(user: User, remaining_seconds: int):
-    """Проверить и отправить уведомления по таймеру спецпредложения (TG + email)"""
-    try:
-        if not user:
-            return
-        hours = int(remaining_seconds // 3600)
-        minutes = int((remaining_seconds % 3600) // 60)
-        logger.info(f"⏱️ Пользователь {user.id}: осталось {hours:02d}:{minutes:02d}:00, флаги: 6ч={getattr(user, 'notification_6_hours_sent', False)}, 1ч={getattr(user, 'notification_1_hour_sent', False)}, 10м={getattr(user, 'notification_10_minutes_sent', False)}")
-        from app.services.telegram_service import telegram_service
-        from app.services.email_service import email_service
-
-        from app.services.push_service import push_service
-        push_subs = await db_service.get_push_subscriptions(user.id)
-
-        def _push_any_sent(results: list) -> bool:
-            return any(results) if results else False
-
-        if 6 <= hours < 7 and not getattr(user, "notification_6_hours_sent", False):
-            logger.info(f"⏰ Отправляем уведомление за 6 часов до конца акции пользователю {user.id}")
-            tg_ok = await telegram_service.send_special_offer_6_hours_left(user.telegram_id) if user.telegram_id else False
-            email_ok = await email_service.send_special_offer_6_hours_left(user.email) if user.email else False
-            push_ok = _push_any_sent([
-                await push_service.send_special_offer_6_hours_left(s.endpoint, s.p256dh, s.auth)
-                for s in push_subs
-            ])
-            if tg_ok or email_ok or push_ok:
-                await db_service.update_user(user.id, {"notification_6_hours_sent": True})
-        elif 1 <= hours < 2 and not getattr(user, "notification_1_hour_sent", False):
-            logger.info(f"⏰ Отправляем уведомление за 1 час до конца акции пользователю {user.id}")
-            tg_ok = await telegram_service.send_special_offer_1_hour_left(user.telegram_id) if user.telegram_id else False
-            email_ok = await email_service.send_special_offer_1_hour_left(user.email) if user.email else False
-            push_ok = _push_any_sent([
-                await push_service.send_special_offer_1_hour_left(s.endpoint, s.p256dh, s.auth)
-                for s in push_subs
-            ])
-            if tg_ok or email_ok or push_ok:
-                await db_service.update_user(user.id, {"notification_1_hour_sent": True})
-        elif hours == 0 and 10 <= minutes < 20 and not getattr(user, "notification_10_minutes_sent", False):
-            logger.info(f"⏰ Отправляем уведомление за 10 минут до конца акции пользователю {user.id}")
-            tg_ok = await telegram_service.send_special_offer_10_minutes_left(user.telegram_id) if user.telegram_id else False
-            email_ok = await email_service.send_special_offer_10_minutes_left(user.email) if user.email else False
-            push_ok = _push_any_sent([
-                await push_service.send_special_offer_10_minutes_left(s.endpoint, s.p256dh, s.auth)
-                for s in push_subs
-            ])
-            if tg_ok or email_ok or push_ok:
-                await db_service.update_user(user.id, {"notification_10_minutes_sent": True})
-    except Exception as e:
-        logger.error(f"❌ Ошибка при проверке таймера для пользователя {user.id if user else '?'}: {e}")
-
-
 def _get_special_offer_remaining(user: User) -> tuple[bool, int]:
     """Возвращает (active, remaining_seconds)"""
     if not user.special_offer_started_at:
@@ -761,7 +646,7 @@ async def get_public_pricing():
 
 
 @app.get("/api/me/special-offer-timer")
-async def get_special_offer_timer(user: User = Depends(get_current_user)):
+async def get_special_offer_timer(user: User = Depends(get_current_user_fresh)):
     if not user.special_offer_started_at:
         return {
             "active": False,
@@ -890,7 +775,7 @@ async def _payment_for_robokassa_inv(inv_id_raw: Optional[str]):
 
 
 @app.post("/api/me/start-premium-payment")
-async def start_premium_payment(user: User = Depends(get_current_user)):
+async def start_premium_payment(user: User = Depends(get_current_user_fresh)):
     timer_info = await get_special_offer_timer(user)
     if timer_info.get("active"):
         amount_decimal = decimal.Decimal(str(PREMIUM_PRICE_DISCOUNT))
@@ -1018,6 +903,36 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/api/metrics/db", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def db_metrics():
+    """Метрики пула соединений БД (выдачи, ожидание, пик занятых), кэша пользователей и пула bcrypt"""
+    return {
+        **get_pool_metrics(),
+        "user_cache": user_cache.metrics(),
+        "password_hashing": hash_pool_metrics.snapshot(),
+    }
+
+
+@app.get("/api/metrics/reports", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def report_queue_metrics():
+    """Очередь отчётов (глубина, выполняются, средняя длительность), слоты и квота запросов к Perplexity, кэши LLM и шаблонов PDF, пул сборки PDF"""
+    return {
+        **await report_jobs.stats(),
+        "upstream": perplexity_slots.metrics(),
+        "upstream_rate": perplexity_rate.metrics(),
+        "llm_cache": await llm_cache.metrics(),
+        "upstream_connections": perplexity_http.metrics(),
+        "pdf_templates": template_cache.metrics(),
+        "pdf_render": pdf_render_pool.metrics(),
+    }
+
+
+@app.get("/api/metrics/llm", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def llm_usage_metrics(days: float = Query(30, gt=0, le=SUMMARY_MAX_DAYS)):
+    """Вызовы LLM за days дней (не больше SUMMARY_MAX_DAYS): p50/p95 длительности и токенов на вызов и на отчёт по типам"""
+    return await llm_usage.summary(days)
+
+
 @app.get("/api/info")
 async def info():
     return {"name": "PRIZMA API", "version": "1.0.0"}
@@ -1,10 +1,19 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 
 class AnswerRequest(BaseModel):
     text_answer: str = Field(..., min_length=350, max_length=5000)
     answer_type: str = Field(default="text")
 
+class AnswerBatchItem(BaseModel):
+    question_id: int
+    text_answer: str = Field(..., min_length=350, max_length=5000)
+    answer_type: str = Field(default="text")
+
+class AnswerBatchRequest(BaseModel):
+    """Ответы, накопленные офлайн (PWA), отправляются одним запросом"""
+    answers: List[AnswerBatchItem] = Field(..., min_length=1, max_length=100)
+
 class UserProfileUpdate(BaseModel):
     name: Optional[str] = Field(None, max_length=100)
     age: Optional[int] = Field(None, ge=1, le=120)
@@ -58,6 +67,7 @@ class NextQuestionResponse(BaseModel):
     progress: Optional[ProgressResponse] = None
     message: Optional[str] = None
     is_paid: Optional[bool] = None  # для status=test_completed — куда редиректить
+    saved: Optional[int] = None  # для /api/me/answers/batch — сколько ответов сохранено
 
 class UserProgressResponse(BaseModel):
     user: dict
@@ -6,4 +6,10 @@
 
 from .psychology import PsychologyPrompts
 
-__all__ = ['PsychologyPrompts'] 
\ No newline at end of file
+# Версия сообщений модели, которые собираются вне этого пакета (шаблоны страниц и вводных
+# разделов в services/perplexity.py, сжатие контекста). Входит в ключ чекпоинта report_pages:
+# увеличьте при изменении этих текстов, чтобы страницы сгенерировались заново.
+# Тексты промптов отсюда учитываются в ключе сами (report_pages.prompts_fingerprint).
+PROMPT_VERSION = 1
+
+__all__ = ['PsychologyPrompts', 'PROMPT_VERSION'] 
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""
+Сжатие контекста диалога при постраничной генерации премиум-отчёта.
+
+Внутри раздела каждая готовая страница остаётся в conversation, чтобы модель
+не повторялась, и весь диалог уходит в каждый следующий запрос. Когда оценка
+контекста превышает PERPLEXITY_CONTEXT_BUDGET_TOKENS, тексты старых страниц
+(кроме PERPLEXITY_COMPACT_KEEP_PAGES последних) заменяются короткой сводкой
+«темы уже раскрыты»: заголовки и первые фразы абзацев. Этого хватает, чтобы
+не повторяться, а размер запроса перестаёт расти квадратично.
+Сжимается копия для отправки — полный текст страниц не теряется.
+"""
+import re
+from typing import Dict, List, Tuple
+
+from app.config import PERPLEXITY_CONTEXT_BUDGET_TOKENS, PERPLEXITY_COMPACT_KEEP_PAGES
+
+DIGEST_MAX_CHARS = 600
+PROMPT_MAX_CHARS = 200
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s")
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """Оценка токенов: для кириллицы ~1 символ ≈ 1.5-2 токена в BPE"""
+    total_bytes = sum(len(m.get("content", "").encode("utf-8")) for m in messages)
+    return total_bytes // 3
+
+
+def page_digest(content: str, max_chars: int = DIGEST_MAX_CHARS) -> str:
+    """Сводка страницы: заголовки, а если их нет — первые фразы абзацев"""
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    topics = [
+        line.strip("#* ").strip()
+        for line in lines
+        if line.startswith("#") or (line.startswith("**") and line.endswith("**"))
+    ]
+    if not topics:
+        topics = [_SENTENCE_END.split(line, 1)[0] for line in lines]
+    digest = ""
+    for topic in topics:
+        if not topic:
+            continue
+        candidate = f"{digest}; {topic}" if digest else topic
+        if len(candidate) > max_chars:
+            break
+        digest = candidate
+    return f"[Страница уже написана, не повторяйте её. Раскрытые темы: {digest or content[:max_chars]}]"
+
+
+def _short_prompt(content: str) -> str:
+    first_line = content.strip().split("\n", 1)[0]
+    return first_line[:PROMPT_MAX_CHARS]
+
+
+class ConversationCompactor:
+    def __init__(self, budget_tokens: int = PERPLEXITY_CONTEXT_BUDGET_TOKENS,
+                 keep_pages: int = PERPLEXITY_COMPACT_KEEP_PAGES):
+        self.budget_tokens = budget_tokens
+        self.keep_pages = keep_pages
+
+    def compact(self, conversation: List[Dict], prefix_len: int) -> Tuple[List[Dict], int]:
+        """Копия conversation для отправки и сэкономленные токены.
+
+        conversation[:prefix_len] (system, ответы, вводная раздела) не трогается;
+        дальше идут пары «промпт страницы — текст страницы» и промпт текущей страницы.
+        Пары сжимаются от самых старых, пока контекст больше бюджета.
+        """
+        full_tokens = estimate_tokens(conversation)
+        if self.budget_tokens <= 0 or full_tokens <= self.budget_tokens:
+            return conversation, 0
+        messages = list(conversation)
+        tokens = full_tokens
+        # Последнее сообщение — промпт текущей страницы, перед ним пары (user, assistant)
+        pairs = (len(messages) - 1 - prefix_len) // 2
+        for pair in range(max(pairs - self.keep_pages, 0)):
+            if tokens <= self.budget_tokens:
+                break
+            prompt_idx = prefix_len + pair * 2
+            page_idx = prompt_idx + 1
+            old = estimate_tokens(messages[prompt_idx:page_idx + 1])
+            messages[prompt_idx] = {"role": "user", "content": _short_prompt(messages[prompt_idx]["content"])}
+            messages[page_idx] = {"role": "assistant", "content": page_digest(messages[page_idx]["content"])}
+            tokens -= old - estimate_tokens(messages[prompt_idx:page_idx + 1])
+        return messages, full_tokens - tokens
+
+
+conversation_compactor = ConversationCompactor()
@@ -1,48 +1,139 @@
-from typing import Optional, List
-from sqlalchemy import select, delete
+from typing import Optional, List, TypedDict
+from sqlalchemy import select, delete, func, update, inspect as sa_inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
 import glob
 from pathlib import Path
 
 from app.database.models import User, Question, Answer, Payment, Report, PushSubscription, QuestionType, PaymentStatus, ReportGenerationStatus
-from app.database.database import async_session
+from app.database.database import engine
+from app.database.unit_of_work import session_scope, commit, current_unit_of_work, savepoint
+from app.services.question_catalog import question_catalog
+from app.services.user_cache import user_cache
 from app.config import FREE_QUESTIONS_LIMIT, PREMIUM_QUESTIONS_COUNT
 from loguru import logger
 
 
+class UserUpdate(TypedDict, total=False):
+    """Поля пользователя, которые можно менять через update_user (частичное обновление)"""
+    name: Optional[str]
+    age: Optional[int]
+    gender: Optional[str]
+    telegram_id: Optional[int]
+    telegram_username: Optional[str]
+    is_paid: bool
+    is_premium_paid: bool
+    is_active: bool
+    current_question_id: Optional[int]
+    test_completed: bool
+    free_test_completed: bool
+    premium_test_completed: bool
+    current_free_question_id: Optional[int]
+    current_premium_question_id: Optional[int]
+    free_report_status: ReportGenerationStatus
+    premium_report_status: ReportGenerationStatus
+    free_report_path: Optional[str]
+    premium_report_path: Optional[str]
+    report_generation_error: Optional[str]
+    test_started_at: Optional[datetime]
+    test_completed_at: Optional[datetime]
+    report_generation_started_at: Optional[datetime]
+    report_generation_completed_at: Optional[datetime]
+    special_offer_started_at: Optional[datetime]
+    notification_6_hours_sent: bool
+    notification_1_hour_sent: bool
+    notification_10_minutes_sent: bool
+
+
+# Колонки users проверяются один раз при импорте: UserUpdate не должен расходиться с моделью
+_USER_COLUMNS = frozenset(attr.key for attr in sa_inspect(User).column_attrs)
+_UPDATABLE_USER_FIELDS = frozenset(UserUpdate.__annotations__)
+if not _UPDATABLE_USER_FIELDS <= _USER_COLUMNS:
+    raise RuntimeError(f"UserUpdate содержит поля не из users: {sorted(_UPDATABLE_USER_FIELDS - _USER_COLUMNS)}")
+
+
 class DatabaseService:
+    @staticmethod
+    def _user_changed(user: User):
+        """Сбросить кэш пользователя; внутри UoW — удерживать до конца транзакции.
+        updated_at записанной строки не даёт закэшировать более старое чтение"""
+        user_id, version = user.id, user.updated_at
+        user_cache.hold(user_id)
+        uow = current_unit_of_work()
+        if uow is not None:
+            uow.after_close.append(lambda: user_cache.release(user_id, version))
+        else:
+            user_cache.release(user_id, version)
+
+    async def _update_user_fields(self, user_id: int, values: UserUpdate) -> User:
+        """Один UPDATE users SET ... WHERE id=? (с RETURNING, если СУБД умеет), без предварительного SELECT"""
+        unknown = set(values) - _UPDATABLE_USER_FIELDS
+        if unknown:
+            raise ValueError(f"Неизвестные поля пользователя: {', '.join(sorted(unknown))}")
+        stmt = (
+            update(User)
+            .where(User.id == user_id)
+            .values(**values, updated_at=datetime.utcnow())
+            .execution_options(populate_existing=True)
+        )
+        async with session_scope() as session:
+            if engine.dialect.update_returning:
+                result = await session.execute(stmt.returning(User))
+                user = result.scalar_one()
+            else:
+                await session.execute(stmt)
+                result = await session.execute(
+                    select(User).where(User.id == user_id).execution_options(populate_existing=True)
+                )
+                user = result.scalar_one()
+            await commit(session)
+        self._user_changed(user)
+        return user
+
     async def get_user_by_email(self, email: str) -> Optional[User]:
         """Получить пользователя по email"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(User).where(User.email == email)
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
-    async def get_user_by_id(self, user_id: int) -> Optional[User]:
-        """Получить пользователя по ID"""
-        async with async_session() as session:
+    async def get_user_by_id(self, user_id: int, fresh: bool = True) -> Optional[User]:
+        """Получить пользователя по ID.
+
+        fresh=False — допускается копия из user_cache (не старше USER_CACHE_TTL_SECONDS,
+        без несохранённых изменений этого процесса); такой объект отсоединён от сессии.
+        """
+        if not fresh:
+            cached = user_cache.get(user_id)
+            if cached is not None:
+                return cached
+        async with session_scope() as session:
             stmt = select(User).where(User.id == user_id)
             result = await session.execute(stmt)
-            return result.scalar_one_or_none()
+            user = result.scalar_one_or_none()
+        if user is not None:
+            user_cache.put(user)
+        return user
 
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         """Получить пользователя по Telegram ID"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(User).where(User.telegram_id == telegram_id)
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
     async def create_user(self, email: str, password_hash: str, name: Optional[str] = None) -> User:
         """Создать нового пользователя"""
-        async with async_session() as session:
+        async with session_scope() as session:
             user = User(
                 email=email,
                 password_hash=password_hash,
                 name=name
             )
-            session.add(user)
-            await session.commit()
+            async with savepoint(session):
+                session.add(user)
+                await commit(session)
             await session.refresh(user)
             return user
 
@@ -54,54 +145,41 @@ class DatabaseService:
         username: Optional[str] = None,
     ) -> User:
         """Создать пользователя при первом входе через Telegram"""
-        from app.auth.auth import hash_password
+        from app.auth.passwords import UNUSABLE_PASSWORD
         email = f"tg_{telegram_id}@prizma.telegram"
         name = f"{first_name} {last_name or ''}".strip() or first_name
-        async with async_session() as session:
+        async with session_scope() as session:
             user = User(
                 email=email,
-                password_hash=hash_password(str(telegram_id)),  # placeholder, не используется
+                password_hash=UNUSABLE_PASSWORD,  # вход только через Telegram
                 name=name,
                 telegram_id=telegram_id,
                 telegram_username=username,
             )
-            session.add(user)
-            await session.commit()
+            async with savepoint(session):
+                session.add(user)
+                await commit(session)
             await session.refresh(user)
             return user
 
     async def update_user_profile(self, user_id: int, name: Optional[str] = None, age: Optional[int] = None, gender: Optional[str] = None) -> User:
         """Обновить профиль пользователя"""
-        async with async_session() as session:
-            stmt = select(User).where(User.id == user_id)
-            result = await session.execute(stmt)
-            user = result.scalar_one()
-            if name is not None:
-                user.name = name
-            if age is not None:
-                user.age = age
-            if gender is not None:
-                user.gender = gender
-            user.updated_at = datetime.utcnow()
-            await session.commit()
-            return user
-
-    async def update_user(self, user_id: int, update_data: dict) -> User:
-        """Обновить пользователя с произвольными полями"""
-        async with async_session() as session:
-            stmt = select(User).where(User.id == user_id)
-            result = await session.execute(stmt)
-            user = result.scalar_one()
-            for field, value in update_data.items():
-                if hasattr(user, field):
-                    setattr(user, field, value)
-            user.updated_at = datetime.utcnow()
-            await session.commit()
-            return user
+        values: UserUpdate = {}
+        if name is not None:
+            values["name"] = name
+        if age is not None:
+            values["age"] = age
+        if gender is not None:
+            values["gender"] = gender
+        return await self._update_user_fields(user_id, values)
+
+    async def update_user(self, user_id: int, update_data: UserUpdate) -> User:
+        """Обновить пользователя с произвольными полями (ValueError на неизвестное поле)"""
+        return await self._update_user_fields(user_id, update_data)
 
     async def start_test(self, user_id: int) -> User:
         """Начать тест для пользователя"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(User).where(User.id == user_id)
             result = await session.execute(stmt)
             user = result.scalar_one()
@@ -114,44 +192,31 @@ class DatabaseService:
             user.test_started_at = datetime.utcnow()
             user.test_completed = False
             user.test_completed_at = None
-            await session.commit()
-            return user
+            await commit(session)
+        self._user_changed(user)
+        return user
 
     async def complete_test(self, user_id: int, test_version: str = "free") -> User:
         """Завершить тест для пользователя"""
-        async with async_session() as session:
-            stmt = select(User).where(User.id == user_id)
-            result = await session.execute(stmt)
-            user = result.scalar_one()
-            reports_dir = Path("reports")
-            reports_dir.mkdir(exist_ok=True)
-            if test_version == "free":
-                pattern = str(reports_dir / f"prizma_report_{user_id}_*.pdf")
-                for old_report in glob.glob(pattern):
-                    try:
-                        Path(old_report).unlink()
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить старый отчет {old_report}: {e}")
-                user.free_test_completed = True
-                user.current_free_question_id = None
-            else:
-                pattern = str(reports_dir / f"prizma_premium_report_{user_id}_*.pdf")
-                for old_report in glob.glob(pattern):
-                    try:
-                        Path(old_report).unlink()
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить старый отчет {old_report}: {e}")
-                user.premium_test_completed = True
-                user.current_premium_question_id = None
-            user.test_completed = True
-            user.test_completed_at = datetime.utcnow()
-            user.current_question_id = None
-            await session.commit()
-            return user
+        reports_dir = Path("reports")
+        reports_dir.mkdir(exist_ok=True)
+        if test_version == "free":
+            pattern = str(reports_dir / f"prizma_report_{user_id}_*.pdf")
+            values: UserUpdate = {"free_test_completed": True, "current_free_question_id": None}
+        else:
+            pattern = str(reports_dir / f"prizma_premium_report_{user_id}_*.pdf")
+            values = {"premium_test_completed": True, "current_premium_question_id": None}
+        for old_report in glob.glob(pattern):
+            try:
+                Path(old_report).unlink()
+            except Exception as e:
+                logger.warning(f"Не удалось удалить старый отчет {old_report}: {e}")
+        values.update(test_completed=True, test_completed_at=datetime.utcnow(), current_question_id=None)
+        return await self._update_user_fields(user_id, values)
 
     async def upgrade_to_premium_and_continue_test(self, user_id: int) -> User:
         """Обновить до премиум и продолжить тест"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(User).where(User.id == user_id)
             result = await session.execute(stmt)
             user = result.scalar_one()
@@ -171,22 +236,22 @@ class DatabaseService:
                         user.test_completed = True
                         user.test_completed_at = datetime.utcnow()
             user.updated_at = datetime.utcnow()
-            await session.commit()
-            return user
+            await commit(session)
+        self._user_changed(user)
+        return user
 
     async def update_user_test_status(self, user_id: int, test_completed: bool) -> User:
-        async with async_session() as session:
-            stmt = select(User).where(User.id == user_id)
-            result = await session.execute(stmt)
-            user = result.scalar_one()
-            user.test_completed = test_completed
-            user.test_completed_at = datetime.utcnow() if test_completed else None
-            user.updated_at = datetime.utcnow()
-            await session.commit()
-            return user
+        return await self._update_user_fields(user_id, {
+            "test_completed": test_completed,
+            "test_completed_at": datetime.utcnow() if test_completed else None,
+        })
 
     async def get_first_question(self, test_version: str = "free") -> Question:
-        async with async_session() as session:
+        await question_catalog.refresh_if_changed()
+        question = question_catalog.first(test_version)
+        if question is not None:
+            return question
+        async with session_scope() as session:
             from sqlalchemy import and_
             stmt = select(Question).where(
                 and_(Question.is_active == True, Question.test_version == test_version)
@@ -195,13 +260,20 @@ class DatabaseService:
             return result.scalar_one()
 
     async def get_question(self, question_id: int) -> Optional[Question]:
-        async with async_session() as session:
+        await question_catalog.refresh_if_changed()
+        question = question_catalog.get(question_id)
+        if question is not None:
+            return question
+        async with session_scope() as session:
             stmt = select(Question).where(Question.id == question_id)
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
     async def get_next_question(self, current_question_id: int, test_version: str = "free") -> Optional[Question]:
-        async with async_session() as session:
+        await question_catalog.refresh_if_changed()
+        if question_catalog.get(current_question_id) is not None:
+            return question_catalog.next(current_question_id, test_version)
+        async with session_scope() as session:
             from sqlalchemy import and_
             curr = await self.get_question(current_question_id)
             if not curr:
@@ -219,31 +291,69 @@ class DatabaseService:
     async def get_total_questions(self, test_version: str = "free") -> int:
         return FREE_QUESTIONS_LIMIT if test_version == "free" else PREMIUM_QUESTIONS_COUNT
 
+    @staticmethod
+    def _answer_upsert(rows: List[dict]):
+        """INSERT ... ON CONFLICT (user_id, question_id) DO UPDATE — повторный ответ заменяет прежний"""
+        stmt = sqlite_insert(Answer).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[Answer.user_id, Answer.question_id],
+            set_={
+                "text_answer": stmt.excluded.text_answer,
+                "voice_file_id": stmt.excluded.voice_file_id,
+                "answer_type": stmt.excluded.answer_type,
+                "ai_analysis": None,
+                "analysis_status": "pending",
+                "analyzed_at": None,
+            },
+        )
+
     async def save_answer(self, user_id: int, question_id: int, text_answer: str = None,
                          voice_file_id: str = None, answer_type: str = "text") -> Answer:
-        async with async_session() as session:
-            answer = Answer(
-                user_id=user_id,
-                question_id=question_id,
-                text_answer=text_answer,
-                voice_file_id=voice_file_id,
-                answer_type=answer_type
-            )
-            session.add(answer)
-            await session.commit()
-            await session.refresh(answer)
+        stmt = self._answer_upsert([{
+            "user_id": user_id,
+            "question_id": question_id,
+            "text_answer": text_answer,
+            "voice_file_id": voice_file_id,
+            "answer_type": answer_type,
+        }]).returning(Answer).execution_options(populate_existing=True)
+        async with session_scope() as session:
+            result = await session.execute(stmt)
+            answer = result.scalar_one()
+            await commit(session)
             return answer
 
+    async def save_answers(self, user_id: int, answers: List[dict]) -> int:
+        """Сохранить пачку ответов одним запросом и одной транзакцией.
+
+        answers: [{"question_id", "text_answer", "answer_type"?, "voice_file_id"?}];
+        при нескольких ответах на один вопрос остаётся последний.
+        """
+        rows = {}
+        for item in answers:
+            rows[item["question_id"]] = {
+                "user_id": user_id,
+                "question_id": item["question_id"],
+                "text_answer": item.get("text_answer"),
+                "voice_file_id": item.get("voice_file_id"),
+                "answer_type": item.get("answer_type") or "text",
+            }
+        if not rows:
+            return 0
+        async with session_scope() as session:
+            await session.execute(self._answer_upsert(list(rows.values())))
+            await commit(session)
+        return len(rows)
+
     async def clear_user_answers(self, user_id: int) -> int:
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = delete(Answer).where(Answer.user_id == user_id)
             result = await session.execute(stmt)
             deleted = result.rowcount
-            await session.commit()
+            await commit(session)
             return deleted
 
     async def get_user_answers(self, user_id: int) -> List[Answer]:
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(Answer).options(selectinload(Answer.question)).where(
                 Answer.user_id == user_id
             ).order_by(Answer.created_at)
@@ -251,7 +361,7 @@ class DatabaseService:
             return list(result.scalars().all())
 
     async def get_user_answers_by_test_version(self, user_id: int, test_version: str) -> List[Answer]:
-        async with async_session() as session:
+        async with session_scope() as session:
             from sqlalchemy import and_
             stmt = (
                 select(Answer)
@@ -270,7 +380,7 @@ class DatabaseService:
     async def create_payment(self, uid: int, amount: int, currency: str, description: str,
                              invoice_id: str, status: PaymentStatus) -> Payment:
         """amount - сумма в копейках (int)"""
-        async with async_session() as session:
+        async with session_scope() as session:
             payment = Payment(
                 user_id=uid,
                 amount=amount,
@@ -279,26 +389,27 @@ class DatabaseService:
                 invoice_id=invoice_id,
                 status=status
             )
-            session.add(payment)
-            await session.commit()
+            async with savepoint(session):
+                session.add(payment)
+                await commit(session)
             await session.refresh(payment)
             return payment
 
     async def get_payment_by_invoice_id(self, invoice_id: str) -> Optional[Payment]:
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(Payment).where(Payment.invoice_id == invoice_id)
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
     async def get_payment_by_id(self, payment_id: int) -> Optional[Payment]:
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(Payment).where(Payment.id == payment_id)
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
     async def update_payment_status(self, payment_id: int, status: PaymentStatus,
                                     robokassa_payment_id: str = None) -> Payment:
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(Payment).where(Payment.id == payment_id)
             result = await session.execute(stmt)
             payment = result.scalar_one()
@@ -307,33 +418,52 @@ class DatabaseService:
                 payment.robokassa_payment_id = robokassa_payment_id
             if status == PaymentStatus.COMPLETED:
                 payment.paid_at = datetime.utcnow()
-            await session.commit()
+            await commit(session)
             return payment
 
     async def update_report_generation_status(self, user_id: int, report_type: str,
                                              status: ReportGenerationStatus,
                                              report_path: str = None, error: str = None) -> User:
-        async with async_session() as session:
-            stmt = select(User).where(User.id == user_id)
-            result = await session.execute(stmt)
-            user = result.scalar_one()
-            if report_type == "free":
-                user.free_report_status = status
-                if report_path:
-                    user.free_report_path = report_path
-            elif report_type == "premium":
-                user.premium_report_status = status
-                if report_path:
-                    user.premium_report_path = report_path
-            if error:
-                user.report_generation_error = error
-            if status == ReportGenerationStatus.PROCESSING:
-                user.report_generation_started_at = datetime.utcnow()
-            elif status in (ReportGenerationStatus.COMPLETED, ReportGenerationStatus.FAILED):
-                user.report_generation_completed_at = datetime.utcnow()
-            user.updated_at = datetime.utcnow()
-            await session.commit()
-            return user
+        values = self.report_status_values(report_type, status, report_path, error)
+        return await self._update_user_fields(user_id, values)
+
+    async def mark_report_completed(self, session, user_id: int, report_type: str, report_path: str) -> None:
+        """COMPLETED и путь к отчёту в транзакции вызывающего (вместе с завершением задачи очереди);
+        заодно запускает таймер спецпредложения, если он ещё не запущен"""
+        now = datetime.utcnow()
+        values = self.report_status_values(report_type, ReportGenerationStatus.COMPLETED, report_path)
+        await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(**values, updated_at=now,
+                    special_offer_started_at=func.coalesce(User.special_offer_started_at, now))
+        )
+        result = await session.execute(
+            select(User).where(User.id == user_id).execution_options(populate_existing=True)
+        )
+        user = result.scalar_one_or_none()
+        if user is not None:
+            self._user_changed(user)
+
+    @staticmethod
+    def report_status_values(report_type: str, status: ReportGenerationStatus,
+                             report_path: str = None, error: str = None) -> UserUpdate:
+        values: UserUpdate = {}
+        if report_type == "free":
+            values["free_report_status"] = status
+            if report_path:
+                values["free_report_path"] = report_path
+        elif report_type == "premium":
+            values["premium_report_status"] = status
+            if report_path:
+                values["premium_report_path"] = report_path
+        if error:
+            values["report_generation_error"] = error
+        if status == ReportGenerationStatus.PROCESSING:
+            values["report_generation_started_at"] = datetime.utcnow()
+        elif status in (ReportGenerationStatus.COMPLETED, ReportGenerationStatus.FAILED):
+            values["report_generation_completed_at"] = datetime.utcnow()
+        return values
 
     async def get_report_generation_status(self, user_id: int, report_type: str) -> dict:
         user = await self.get_user_by_id(user_id)
@@ -382,7 +512,10 @@ class DatabaseService:
         return True
 
     async def get_questions_by_version(self, test_version: str) -> List[Question]:
-        async with async_session() as session:
+        await question_catalog.refresh_if_changed()
+        if question_catalog.loaded:
+            return question_catalog.by_version(test_version)
+        async with session_scope() as session:
             from sqlalchemy import and_
             stmt = select(Question).where(
                 and_(Question.is_active == True, Question.test_version == test_version)
@@ -392,7 +525,7 @@ class DatabaseService:
 
     async def save_push_subscription(self, user_id: int, endpoint: str, p256dh: str, auth: str) -> PushSubscription:
         """Сохранить или обновить push-подписку (по endpoint — одно устройство может переподписываться)"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(PushSubscription).where(
                 PushSubscription.user_id == user_id,
                 PushSubscription.endpoint == endpoint,
@@ -410,26 +543,26 @@ class DatabaseService:
                     auth=auth,
                 )
                 session.add(sub)
-            await session.commit()
+            await commit(session)
             await session.refresh(sub)
             return sub
 
     async def get_push_subscriptions(self, user_id: int) -> List[PushSubscription]:
         """Получить все push-подписки пользователя"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(PushSubscription).where(PushSubscription.user_id == user_id)
             result = await session.execute(stmt)
             return list(result.scalars().all())
 
     async def delete_push_subscription(self, user_id: int, endpoint: str) -> bool:
         """Удалить push-подписку по endpoint"""
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = delete(PushSubscription).where(
                 PushSubscription.user_id == user_id,
                 PushSubscription.endpoint == endpoint,
             )
             result = await session.execute(stmt)
-            await session.commit()
+            await commit(session)
             return result.rowcount > 0
 
 
@@ -0,0 +1,107 @@
+"""
+Долгоживущий пул HTTP-соединений для внешних API (Perplexity).
+
+Один httpx.AsyncClient на процесс: TCP/TLS-соединения переиспользуются между
+запросами и между задачами генерации. Закрывается в shutdown приложения/воркера.
+Счётчики (через trace-расширение httpcore) показывают, сколько запросов ушло
+по уже открытому соединению.
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from loguru import logger
+
+from app.config import (
+    PERPLEXITY_HTTP2,
+    PERPLEXITY_MAX_CONNECTIONS,
+    PERPLEXITY_MAX_KEEPALIVE,
+    PERPLEXITY_KEEPALIVE_EXPIRY,
+    PERPLEXITY_CONNECT_TIMEOUT,
+    PERPLEXITY_READ_TIMEOUT,
+)
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    async def trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def snapshot(self) -> dict:
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+        }
+
+
+class PooledHttpClient:
+    """Ленивый общий httpx.AsyncClient с настраиваемым пулом и таймаутами"""
+
+    def __init__(self, http2: bool = PERPLEXITY_HTTP2):
+        self.http2 = http2
+        self.stats = ConnectionStats()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _build(self) -> httpx.AsyncClient:
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("PERPLEXITY_HTTP2=true, но пакет h2 не установлен (pip install httpx[http2]) — HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=PERPLEXITY_MAX_CONNECTIONS,
+                max_keepalive_connections=PERPLEXITY_MAX_KEEPALIVE,
+                keepalive_expiry=PERPLEXITY_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=PERPLEXITY_CONNECT_TIMEOUT,
+                read=PERPLEXITY_READ_TIMEOUT,
+                write=PERPLEXITY_CONNECT_TIMEOUT,
+                pool=PERPLEXITY_READ_TIMEOUT,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build()
+        return self._client
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        self.stats.requests += 1
+        extensions = {**kwargs.pop("extensions", {}), "trace": self.stats.trace}
+        return await self.client.post(url, extensions=extensions, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Потоковый запрос (SSE): тело читается по мере поступления"""
+        self.stats.requests += 1
+        extensions = {**kwargs.pop("extensions", {}), "trace": self.stats.trace}
+        async with self.client.stream(method, url, extensions=extensions, **kwargs) as response:
+            yield response
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    def metrics(self) -> dict:
+        return {"http2": self.http2, **self.stats.snapshot()}
+
+
+perplexity_http = PooledHttpClient()
@@ -0,0 +1,170 @@
+"""
+Кэш ответов LLM по содержимому запроса (опционально, LLM_CACHE_ENABLED).
+
+Ключ — sha256 от модели, temperature, max_tokens и messages: одинаковый запрос
+(повторная генерация, test_full_premium.py, повтор после сбоя) берёт ответ из
+кэша без обращения к Perplexity. Хранилище — отдельный файл SQLite; записи
+живут LLM_CACHE_TTL_SECONDS, при превышении LLM_CACHE_MAX_MB вытесняются
+давно не читанные (LRU). Запросы к SQLite — в одном отдельном потоке.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_MB
+
+
+def cache_key(model: str, temperature: float, max_tokens: int, messages: List[Dict]) -> str:
+    payload = json.dumps(
+        {"model": model, "temperature": temperature, "max_tokens": max_tokens, "messages": messages},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LlmResponseCache:
+    def __init__(self, path: Path = LLM_CACHE_PATH, enabled: bool = LLM_CACHE_ENABLED,
+                 ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+        self.evicted = 0
+
+    # --- синхронная часть (поток кэша) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _get_sync(self, key: str) -> Optional[Dict]:
+        conn = self._connect()
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl_seconds > 0 and row[1] + self.ttl_seconds < now:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            conn.commit()
+            self.expired += 1
+            return None
+        conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return json.loads(row[0])
+
+    def _put_sync(self, key: str, response: Dict):
+        conn = self._connect()
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data.encode("utf-8")), now, now),
+        )
+        self.evicted += self._evict(conn)
+        conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        """Удалить давно не читанные записи, пока размер больше max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        return len(victims)
+
+    def _stats_sync(self) -> Dict:
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def _clear_sync(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM llm_cache")
+        conn.commit()
+
+    # --- async API ---
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        try:
+            response = await self._run(self._get_sync, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Кэш LLM недоступен: {e}")
+            response = None
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def put(self, key: str, response: Dict):
+        if not self.enabled:
+            return
+        try:
+            await self._run(self._put_sync, key, response)
+            self.stores += 1
+        except sqlite3.Error as e:
+            logger.warning(f"Ответ не записан в кэш LLM: {e}")
+
+    async def clear(self):
+        await self._run(self._clear_sync)
+
+    async def close(self):
+        if self._executor is not None:
+            if self._conn is not None:
+                await self._run(self._conn.close)
+                self._conn = None
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def metrics(self) -> Dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "max_bytes": self.max_bytes,
+        }
+        if self.enabled:
+            stats.update(await self._run(self._stats_sync))
+        return stats
+
+
+llm_cache = LlmResponseCache()
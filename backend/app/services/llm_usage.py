@@ -0,0 +1,185 @@
+"""
+Учёт вызовов LLM (таблица llm_calls): токены, длительность, повторы, итог.
+
+Контекст вызова (задача очереди, пользователь, тип отчёта) задаётся через
+llm_call_context и доходит до _make_api_request через ContextVar — в том числе
+в задачи параллельных разделов. Сводка — p50/p95 по вызовам и по отчётам
+(GET /api/metrics/llm, python -m scripts.llm_usage).
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from loguru import logger
+from sqlalchemy import case, func, select
+
+from app.database.models import LlmCall
+from app.database.unit_of_work import session_scope, commit
+
+
+@dataclass
+class LlmCallContext:
+    job_id: Optional[int] = None
+    user_id: Optional[int] = None
+    report_type: Optional[str] = None
+    totals: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def usage(self) -> Dict[str, int]:
+        return dict(self.totals)
+
+
+_current_context: ContextVar[Optional[LlmCallContext]] = ContextVar("llm_call_context", default=None)
+
+
+@contextmanager
+def llm_call_context(job_id: Optional[int] = None, user_id: Optional[int] = None,
+                     report_type: Optional[str] = None) -> Iterator[LlmCallContext]:
+    """Контекст для вызовов внутри блока; незаданные поля берутся из внешнего контекста"""
+    parent = _current_context.get()
+    ctx = LlmCallContext(
+        job_id=job_id if job_id is not None else (parent.job_id if parent else None),
+        user_id=user_id if user_id is not None else (parent.user_id if parent else None),
+        report_type=report_type or (parent.report_type if parent else None),
+    )
+    token = _current_context.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current_context.reset(token)
+        if parent is not None:
+            for key, value in ctx.totals.items():
+                parent.totals[key] += value
+
+
+def current_usage() -> Dict[str, int]:
+    """Токены и вызовы, накопленные в текущем контексте (пусто вне llm_call_context)"""
+    ctx = _current_context.get()
+    return ctx.usage() if ctx is not None else {}
+
+
+# Окно сводки: за больший период выборка для перцентилей слишком велика для запроса API
+SUMMARY_MAX_DAYS = 90
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[idx], 2)
+
+
+def _distribution(values: List[float]) -> dict:
+    return {
+        "p50": _percentile(values, 0.5),
+        "p95": _percentile(values, 0.95),
+        "avg": round(sum(values) / len(values), 2) if values else None,
+    }
+
+
+class LlmUsageRecorder:
+    async def record(self, model: str, usage: Dict, latency: float = 0.0, queue_seconds: float = 0.0,
+                     retries: int = 0, status: str = "ok", error: Optional[str] = None):
+        ctx = _current_context.get()
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        if ctx is not None:
+            ctx.totals["calls"] += 1
+            ctx.totals[f"calls_{status}"] += 1
+            ctx.totals["prompt_tokens"] += prompt_tokens
+            ctx.totals["completion_tokens"] += completion_tokens
+        try:
+            async with session_scope() as session:
+                session.add(LlmCall(
+                    job_id=ctx.job_id if ctx else None,
+                    user_id=ctx.user_id if ctx else None,
+                    report_type=ctx.report_type if ctx else None,
+                    model=model,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    latency_ms=int(latency * 1000),
+                    queue_ms=int(queue_seconds * 1000),
+                    retries=retries,
+                    status=status,
+                    error=error[:2000] if error else None,
+                    created_at=datetime.utcnow(),
+                ))
+                await commit(session)
+        except Exception as e:
+            # Учёт не должен ронять генерацию отчёта
+            logger.warning(f"Вызов LLM не записан в llm_calls: {e}")
+
+    async def summary(self, days: float = 30) -> dict:
+        """p50/p95 по вызовам (длительность, токены) и по отчётам (сумма на задачу) за days дней.
+
+        Счётчики и суммы по задачам считаются в SQL (GROUP BY); для перцентилей
+        читаются только четыре числовые колонки отправленных вызовов, без error и ORM-объектов.
+        days ограничен SUMMARY_MAX_DAYS.
+        """
+        days = min(days, SUMMARY_MAX_DAYS)
+        since = datetime.utcnow() - timedelta(days=days)
+        report_type = func.coalesce(LlmCall.report_type, "other").label("report_type")
+        in_window = LlmCall.created_at >= since
+        totals_stmt = (
+            select(
+                report_type,
+                func.count(),
+                func.sum(case((LlmCall.status == "error", 1), else_=0)),
+                func.sum(case((LlmCall.status == "cached", 1), else_=0)),
+                func.coalesce(func.sum(LlmCall.retries), 0),
+            )
+            .where(in_window)
+            .group_by(report_type)
+        )
+        sent_stmt = (
+            select(report_type, LlmCall.latency_ms, LlmCall.queue_ms, LlmCall.prompt_tokens, LlmCall.completion_tokens)
+            .where(in_window, LlmCall.status != "cached")
+        )
+        jobs_stmt = (
+            select(
+                report_type,
+                func.count(),
+                func.sum(LlmCall.prompt_tokens),
+                func.sum(LlmCall.completion_tokens),
+                func.sum(LlmCall.latency_ms),
+            )
+            .where(in_window, LlmCall.job_id.isnot(None))
+            .group_by(report_type, LlmCall.job_id)
+        )
+        async with session_scope() as session:
+            totals = (await session.execute(totals_stmt)).all()
+            sent_rows = (await session.execute(sent_stmt)).all()
+            job_rows = (await session.execute(jobs_stmt)).all()
+
+        sent: Dict[str, List[tuple]] = defaultdict(list)
+        for row in sent_rows:
+            sent[row[0]].append(row[1:])
+        jobs: Dict[str, List[tuple]] = defaultdict(list)
+        for row in job_rows:
+            jobs[row[0]].append(row[1:])
+
+        by_type: Dict[str, dict] = {}
+        for name, calls, errors, cached, retries in sorted(totals):
+            typed_sent, typed_jobs = sent[name], jobs[name]
+            by_type[name] = {
+                "calls": calls,
+                "errors": int(errors or 0),
+                "cached": int(cached or 0),
+                "retries": int(retries),
+                "call_latency_ms": _distribution([c[0] for c in typed_sent]),
+                "call_queue_ms": _distribution([c[1] for c in typed_sent]),
+                "call_prompt_tokens": _distribution([c[2] for c in typed_sent]),
+                "call_completion_tokens": _distribution([c[3] for c in typed_sent]),
+                "reports": len(typed_jobs),
+                "report_calls": _distribution([float(j[0]) for j in typed_jobs]),
+                "report_prompt_tokens": _distribution([float(j[1]) for j in typed_jobs]),
+                "report_completion_tokens": _distribution([float(j[2]) for j in typed_jobs]),
+                "report_llm_seconds": _distribution([j[3] / 1000 for j in typed_jobs]),
+            }
+        return {"days": days, "by_type": by_type}
+
+
+llm_usage = LlmUsageRecorder()
@@ -0,0 +1,173 @@
+"""
+Рендеринг PDF-отчётов вне event loop.
+
+reportlab и PyPDF2 — чистый Python под GIL: премиум-отчёт собирается секунды, и в потоке
+того же процесса он всё равно тормозил бы API. Поэтому сборка идёт в отдельных процессах
+(ProcessPoolExecutor на PDF_RENDER_WORKERS процессов, запуск через spawn — без копирования
+потоков и блокировок event loop). PDF_RENDER_WORKERS=0 — в потоке текущего процесса.
+
+Задача получает только простые данные — id и имя пользователя и dict результата анализа —
+и возвращает путь к файлу отчёта. Кэш шаблонов (template_cache) в каждом процессе свой.
+
+Премиум-отчёт при нескольких процессах и нескольких CPU собирается в два шага: текст
+разделов верстается параллельно (не больше min(PDF_RENDER_WORKERS, CPU) задач разом),
+затем один процесс накладывает его на шаблоны и собирает PDF в порядке PREMIUM_SECTIONS.
+На одном CPU разбиение только добавляет передачу данных между процессами, и отчёт
+собирается одной задачей.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import PDF_RENDER_WORKERS
+from app.services.pdf_service import ReportGenerator, ReportOwner, group_premium_pages
+
+# Тип отчёта -> метод ReportGenerator
+REPORT_RENDERERS = {
+    "full": "create_pdf_report",
+    "free_basic": "create_free_basic_pdf_report",
+    "premium": "create_premium_pdf_report",
+}
+
+_generator: Optional[ReportGenerator] = None
+
+
+def _get_generator() -> ReportGenerator:
+    global _generator
+    if _generator is None:
+        _generator = ReportGenerator()
+    return _generator
+
+
+def render_report(kind: str, owner: Dict, analysis_result: Dict) -> str:
+    """Собрать отчёт (в процессе пула); owner — {"id", "name"}"""
+    method = getattr(_get_generator(), REPORT_RENDERERS[kind])
+    return method(ReportOwner(**owner), analysis_result)
+
+
+def render_premium_section(section_pages: List[Dict]) -> List[List[bytes]]:
+    """Свёрстать текст одного раздела премиум-отчёта (в процессе пула)"""
+    return _get_generator().render_premium_section_overlays(section_pages)
+
+
+def render_premium_report(owner: Dict, analysis_result: Dict, section_overlays: Dict[str, List[List[bytes]]]) -> str:
+    """Собрать премиум-отчёт из заранее свёрстанных разделов (в процессе пула)"""
+    return _get_generator().create_premium_pdf_report(ReportOwner(**owner), analysis_result, section_overlays)
+
+
+def report_owner(user) -> Dict:
+    """Данные пользователя, нужные для PDF, без ORM-объекта"""
+    return {"id": getattr(user, "id", None) or getattr(user, "telegram_id", 0), "name": getattr(user, "name", None)}
+
+
+class PdfRenderPool:
+    """Пул процессов сборки PDF; создаётся при первом отчёте"""
+
+    def __init__(self, workers: int = PDF_RENDER_WORKERS):
+        self.workers = workers
+        # Сколько разделов премиум-отчёта верстать одновременно; 1 — сборка одной задачей
+        self.section_parallelism = min(workers, os.cpu_count() or 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.render_seconds_total = 0.0
+        self.max_render_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_get_generator,
+                )
+            return self._executor
+
+    async def render(self, kind: str, user, analysis_result: Dict) -> str:
+        """Путь к готовому отчёту; user — ORM User или dict {"id", "name"}"""
+        owner = user if isinstance(user, dict) else report_owner(user)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        self.submitted += 1
+        try:
+            if self.workers > 0:
+                executor = self._get_executor()
+                try:
+                    if kind == "premium" and self.section_parallelism > 1 and analysis_result.get("individual_pages"):
+                        path = await self._render_premium_by_sections(executor, owner, analysis_result)
+                    else:
+                        path = await loop.run_in_executor(executor, render_report, kind, owner, analysis_result)
+                except BrokenProcessPool:
+                    # Процесс пула упал (OOM и т.п.) — следующий отчёт получит новый пул
+                    self._reset(executor)
+                    raise
+            else:
+                path = await asyncio.to_thread(render_report, kind, owner, analysis_result)
+        except BaseException:
+            self.failed += 1
+            raise
+        elapsed = time.perf_counter() - started
+        self.completed += 1
+        self.render_seconds_total += elapsed
+        self.max_render_seconds = max(self.max_render_seconds, elapsed)
+        logger.debug(f"PDF ({kind}) собран за {elapsed:.2f} с: {path}")
+        return path
+
+    async def _render_premium_by_sections(self, executor: ProcessPoolExecutor, owner: Dict,
+                                          analysis_result: Dict) -> str:
+        loop = asyncio.get_running_loop()
+        sections = group_premium_pages(analysis_result["individual_pages"])
+        keys = list(sections)
+        semaphore = asyncio.Semaphore(self.section_parallelism)
+
+        async def render_section(key: str) -> List[List[bytes]]:
+            async with semaphore:
+                return await loop.run_in_executor(executor, render_premium_section, sections[key])
+
+        try:
+            results = await asyncio.gather(*(render_section(key) for key in keys))
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            # Как и при сборке одним процессом: ошибка вёрстки не должна терять отчёт
+            logger.warning(f"Параллельная вёрстка разделов не удалась ({e}), сборка одним процессом")
+            return await loop.run_in_executor(executor, render_report, "premium", owner, analysis_result)
+        section_overlays = dict(zip(keys, results))
+        return await loop.run_in_executor(executor, render_premium_report, owner, analysis_result, section_overlays)
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "section_parallelism": self.section_parallelism,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "running": self.submitted - self.completed - self.failed,
+            "avg_render_ms": round(self.render_seconds_total / done * 1000, 2),
+            "max_render_ms": round(self.max_render_seconds * 1000, 2),
+        }
+
+
+pdf_render_pool = PdfRenderPool()
@@ -2,12 +2,12 @@
 Сервис генерации PDF-отчётов. Адаптирован из perplexy_bot для PWA (user.id вместо telegram_id).
 """
 import re
-from typing import List, Dict
+from typing import List, Dict, NamedTuple, Optional
 from datetime import datetime
 from pathlib import Path
 from io import BytesIO
 
-from PyPDF2 import PdfWriter, PdfReader
+from PyPDF2 import PageObject, PdfWriter, PdfReader
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
@@ -15,11 +15,32 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.colors import Color
 
 from app.database.models import User
+from app.services.pdf_templates import template_cache
+from app.services.text_layout import LayoutStyle, TextLayoutEngine
 
 # Пути относительно backend/
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
 
+# Порядок разделов премиум-отчёта в PDF
+PREMIUM_SECTIONS = ["premium_analysis", "premium_strengths", "premium_growth_zones", "premium_compensation",
+    "premium_interaction", "premium_prognosis", "premium_practical", "premium_conclusion", "premium_appendix"]
+
+
+def group_premium_pages(individual_pages: dict) -> Dict[str, List[dict]]:
+    """Страницы премиум-отчёта по разделам, внутри раздела — по page_num"""
+    pages_by_section = {}
+    for page_data in individual_pages.values():
+        pages_by_section.setdefault(page_data["section_key"], []).append(page_data)
+    return {key: sorted(pages, key=lambda p: p["page_num"]) for key, pages in pages_by_section.items()}
+
+
+class ReportOwner(NamedTuple):
+    """Данные пользователя для отчёта без ORM (сборка PDF в отдельном процессе)"""
+    id: int
+    name: Optional[str] = None
+
+
 class PDFGenerator:
     """Генератор PDF страниц с текстом"""
 
@@ -28,6 +49,7 @@ class PDFGenerator:
         self.fonts_dir = BASE_DIR / "fonts"
         self.fallback_fonts_dir = BASE_DIR.parent / "frontend" / "public" / "fonts"
         self._setup_fonts()
+        self._layout_engines: Dict[tuple, TextLayoutEngine] = {}
 
     def clean_markdown_text(self, text: str) -> str:
         """Очистка текста от markdown разметки и форматирование для PDF"""
@@ -93,71 +115,55 @@ class PDFGenerator:
             self.bold_font = 'Helvetica-Bold'
 
     def _wrap_line(self, text_canvas, text, font_name, font_size, max_width):
-        from reportlab.pdfbase.pdfmetrics import stringWidth
-        if stringWidth(text, font_name, font_size) <= max_width:
-            return [text]
-        words = text.split(' ')
-        lines = []
-        current = ''
-        for word in words:
-            test = (current + ' ' + word).strip() if current else word
-            if stringWidth(test, font_name, font_size) > max_width:
-                if current:
-                    lines.append(current)
-                current = word
-            else:
-                current = test
-        if current:
-            lines.append(current)
-        return lines
+        return self._layout_engine().wrap(text, font_name, font_size, max_width)
+
+    def _layout_engine(self, page_width: float = A4[0], page_height: float = A4[1]) -> TextLayoutEngine:
+        """Движок вёрстки для размеров страницы (поля 75/100 pt, стили заголовков и текста)"""
+        key = (page_width, page_height)
+        engine = self._layout_engines.get(key)
+        if engine is None:
+            styles = {
+                'h1': LayoutStyle(self.bold_font, 18, 24),
+                'h2': LayoutStyle(self.bold_font, 14, 18),
+                'text': LayoutStyle(self.default_font, 11, 14),
+            }
+            engine = self._layout_engines[key] = TextLayoutEngine(styles, page_width - 75 - 75, page_height - 100 - 100)
+        return engine
 
     def create_text_pages(self, text: str, template_path: Path, page_width: float = A4[0], page_height: float = A4[1]) -> list:
-        """Создание PDF страниц с текстом на основе шаблона"""
+        """Создание PDF страниц с текстом на основе шаблона (каждая — отдельный PDF в BytesIO)"""
+        return [self._single_page_pdf(page) for page in self.render_text_pages(text, template_path, page_width, page_height)]
+
+    def render_text_pages(self, text: str, template_path: Path, page_width: float = A4[0], page_height: float = A4[1]) -> List[PageObject]:
+        """Страницы шаблона с наложенным текстом — для сборки в один PdfWriter"""
         if not template_path.exists():
             raise FileNotFoundError(f"Шаблон не найден: {template_path}")
+        return self.overlay_pages(self.render_text_overlays(text, page_width, page_height), template_path)
+
+    def overlay_pages(self, overlays: List[bytes], template_path: Path) -> List[PageObject]:
+        """Наложить готовые страницы текста (render_text_overlays) на шаблон"""
+        return [self._overlay(template_path, BytesIO(overlay)) for overlay in overlays]
+
+    def render_text_overlays(self, text: str, page_width: float = A4[0], page_height: float = A4[1]) -> List[bytes]:
+        """Вёрстка текста: по одному PDF (только текст, без шаблона) на страницу"""
         text = self.clean_markdown_text(text)
         if not text or not text.strip():
             return []
-        lines = [l for l in text.strip().split('\n') if l.strip()]
-        if not lines:
-            return []
-        left_margin, right_margin = 75, 75
-        top_margin, bottom_margin = 100, 100
-        text_width = page_width - left_margin - right_margin
-        text_height = page_height - top_margin - bottom_margin
+        layout = self._layout_engine(page_width, page_height).layout(text)
+        left_margin = 75
+        top_margin = 100
         line_height, h1_height, h2_height = 14, 24, 18
         main_color = Color(1/255, 28/255, 92/255)
         h1_color = Color(218/255, 5/255, 52/255)
         h2_color = Color(2/255, 88/255, 185/255)
-        h1_keywords = ['как вы мыслите', 'кто вы по типу', 'какие паттерны', 'как вы воспринимаете']
-        h2_keywords = ['подкрепляющая цитата', 'практические рекомендации', 'техники работы']
-        pages, current_lines, current_height = [], [], 0
-        for line in lines:
-            l = line.strip()
-            kind = 'text'
-            h = line_height
-            if len(l) < 120 and any(k in l.lower() for k in h1_keywords):
-                kind, h = 'h1', h1_height
-            elif any(k in l.lower() for k in h2_keywords) or (l.endswith(':') and len(l) < 100):
-                kind, h = 'h2', h2_height
-            wrapped = self._wrap_line(None, l, self.bold_font if kind != 'text' else self.default_font, 18 if kind == 'h1' else 14 if kind == 'h2' else 11, text_width)
-            for wline in wrapped:
-                wh = h1_height if kind == 'h1' else h2_height if kind == 'h2' else line_height
-                if current_height + wh > text_height - 50 and current_lines:
-                    pages.append(current_lines)
-                    current_lines, current_height = [], 0
-                current_lines.append((wline, kind, 'h1' if kind == 'h1' else 'h2' if kind == 'h2' else None))
-                current_height += wh
-        if current_lines:
-            pages.append(current_lines)
-        result_buffers = []
-        for page_lines in pages:
+        result_overlays = []
+        for page_lines in layout.pages:
             text_buffer = BytesIO()
             text_canvas = canvas.Canvas(text_buffer, pagesize=A4)
             text_canvas.setFont(self.default_font, 11)
             text_canvas.setFillColor(main_color)
             y_position = page_height - top_margin
-            for line, kind, _ in page_lines:
+            for line, kind in page_lines:
                 l = line.strip()
                 if kind == 'h1':
                     y_position -= 10
@@ -179,39 +185,40 @@ class PDFGenerator:
                 text_canvas.setFont(self.default_font, 11)
                 text_canvas.setFillColor(main_color)
             text_canvas.save()
-            text_buffer.seek(0)
-            template_reader = PdfReader(str(template_path))
-            template_page = template_reader.pages[0]
-            text_reader = PdfReader(text_buffer)
-            text_page = text_reader.pages[0]
-            template_page.merge_page(text_page)
-            result_buffer = BytesIO()
-            writer = PdfWriter()
-            writer.add_page(template_page)
-            writer.write(result_buffer)
-            result_buffer.seek(0)
-            result_buffers.append(result_buffer)
-        return result_buffers
+            result_overlays.append(text_buffer.getvalue())
+        return result_overlays
+
+    def _overlay(self, template_path: Path, text_buffer: BytesIO) -> PageObject:
+        """Страница шаблона (из template_cache) с наложенным текстом"""
+        text_buffer.seek(0)
+        text_page = PdfReader(text_buffer).pages[0]
+        return template_cache.get(template_path).overlay(text_page)
+
+    def _single_page_pdf(self, page: PageObject) -> BytesIO:
+        result_buffer = BytesIO()
+        writer = PdfWriter()
+        writer.add_page(page)
+        writer.write(result_buffer)
+        result_buffer.seek(0)
+        return result_buffer
 
     def combine_pdfs(self, pdf_parts: List[Path], output_path: Path) -> bool:
-        """Объединение PDF файлов в один"""
+        """Объединение PDF-шаблонов в один файл"""
         try:
-            writer = PdfWriter()
+            assembler = PdfAssembler()
             for pdf_path in pdf_parts:
-                if pdf_path.exists():
-                    reader = PdfReader(str(pdf_path))
-                    for page in reader.pages:
-                        writer.add_page(page)
-                else:
-                    return False
-            with open(output_path, 'wb') as f:
-                writer.write(f)
+                assembler.add_template(pdf_path)
+            assembler.write(output_path)
             return True
         except Exception:
             return False
 
     def create_custom_title_page(self, template_path: Path, user_name: str, completion_date: str) -> BytesIO:
         """Создание титульной страницы с данными пользователя"""
+        return self._single_page_pdf(self.render_title_page(template_path, user_name, completion_date))
+
+    def render_title_page(self, template_path: Path, user_name: str, completion_date: str) -> PageObject:
+        """Титульная страница с данными пользователя — для сборки в один PdfWriter"""
         if not template_path.exists():
             raise FileNotFoundError(f"Шаблон титульной страницы не найден: {template_path}")
         user_info_text = f"Создано для {user_name}\n{completion_date}"
@@ -231,18 +238,42 @@ class PDFGenerator:
             text_canvas.drawString(centered_x, y_position, line)
             y_position -= 25
         text_canvas.save()
-        text_buffer.seek(0)
-        template_reader = PdfReader(str(template_path))
-        template_page = template_reader.pages[0]
-        text_reader = PdfReader(text_buffer)
-        text_page = text_reader.pages[0]
-        template_page.merge_page(text_page)
-        result_buffer = BytesIO()
-        writer = PdfWriter()
-        writer.add_page(template_page)
-        writer.write(result_buffer)
-        result_buffer.seek(0)
-        return result_buffer
+        return self._overlay(template_path, text_buffer)
+
+
+class PdfAssembler:
+    """Сборка отчёта в памяти: страницы шаблонов и наложения сразу добавляются в один PdfWriter.
+
+    Страницы шаблонов берутся из template_cache, поэтому общие объекты (фон, шрифты)
+    одного шаблона попадают в итоговый файл один раз, сколько бы страниц на нём ни было.
+    """
+
+    def __init__(self):
+        self.writer = PdfWriter()
+
+    def add_template(self, path: Path):
+        """Все страницы PDF-шаблона как есть"""
+        if not path.exists():
+            raise FileNotFoundError(f"Шаблон не найден: {path}")
+        for template_page in template_cache.pages(path):
+            self.writer.add_page(template_page.page)
+
+    def add_pages(self, pages: List[PageObject]):
+        for page in pages:
+            self.writer.add_page(page)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.writer.pages)
+
+    def write(self, output_path: Path):
+        """Записать отчёт одним проходом; недописанный файл удаляется"""
+        try:
+            with open(output_path, 'wb') as f:
+                self.writer.write(f)
+        except BaseException:
+            output_path.unlink(missing_ok=True)
+            raise
 
 
 class ReportGenerator:
@@ -276,29 +307,16 @@ class ReportGenerator:
         ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         output_path = self.reports_dir / f"prizma_report_{uid}_{ts}.pdf"
         try:
-            temp_dir = self.reports_dir / "temp"
-            temp_dir.mkdir(exist_ok=True)
-            temp_files = []
+            assembler = PdfAssembler()
+            assembler.add_template(self.template_dir / "1.pdf")
+            assembler.add_template(self.template_dir / "2.pdf")
             for key, tpl in [('page3_analysis', "3.pdf"), ('page4_analysis', "4.pdf"), ('page5_analysis', "5.pdf")]:
                 if analysis_result.get(key):
-                    tpath = self.template_dir / tpl
-                    buffers = self.pdf_generator.create_text_pages(analysis_result[key], tpath)
-                    for i, buf in enumerate(buffers):
-                        page_path = temp_dir / f"page_{key}_{i+1}.pdf"
-                        page_path.write_bytes(buf.getvalue())
-                        temp_files.append(page_path)
-            pdf_parts = [self.template_dir / "1.pdf", self.template_dir / "2.pdf"]
-            pdf_parts.extend(temp_files)
-            pdf_parts.extend([self.template_dir / "6.pdf", self.template_dir / "7.pdf"])
-            success = self.pdf_generator.combine_pdfs(pdf_parts, output_path)
-            for f in temp_files:
-                if f.exists():
-                    f.unlink()
-            if temp_dir.exists() and not list(temp_dir.iterdir()):
-                temp_dir.rmdir()
-            if success:
-                return str(output_path)
-            raise Exception("Ошибка объединения PDF")
+                    assembler.add_pages(self.pdf_generator.render_text_pages(analysis_result[key], self.template_dir / tpl))
+            assembler.add_template(self.template_dir / "6.pdf")
+            assembler.add_template(self.template_dir / "7.pdf")
+            assembler.write(output_path)
+            return str(output_path)
         except Exception:
             return self.create_text_report(user, analysis_result)
 
@@ -308,30 +326,18 @@ class ReportGenerator:
         ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         output_path = self.reports_dir / f"prizma_report_{uid}_{ts}.pdf"
         try:
-            temp_dir = self.reports_dir / "temp_free"
-            temp_dir.mkdir(exist_ok=True)
-            temp_files = []
+            assembler = PdfAssembler()
+            assembler.add_template(self.template_dir / "1.pdf")
             t3 = self.template_dir / "3.pdf"
             t4 = self.template_dir / "4.pdf"
             t5 = self.template_dir / "5.pdf"
             for key, tpl in [('personality_type', t3), ('uniqueness', t4), ('key_insight', t5)]:
                 if analysis_result.get(key):
-                    for i, buf in enumerate(self.pdf_generator.create_text_pages(analysis_result[key], tpl)):
-                        p = temp_dir / f"{key}_{i+1}.pdf"
-                        p.write_bytes(buf.getvalue())
-                        temp_files.append(p)
-            pdf_parts = [self.template_dir / "1.pdf"]
-            pdf_parts.extend(temp_files)
-            pdf_parts.extend([self.template_dir / "6.pdf", self.template_dir / "7.pdf"])
-            success = self.pdf_generator.combine_pdfs(pdf_parts, output_path)
-            for f in temp_files:
-                if f.exists():
-                    f.unlink()
-            if temp_dir.exists() and not list(temp_dir.iterdir()):
-                temp_dir.rmdir()
-            if success:
-                return str(output_path)
-            raise Exception("Ошибка объединения PDF")
+                    assembler.add_pages(self.pdf_generator.render_text_pages(analysis_result[key], tpl))
+            assembler.add_template(self.template_dir / "6.pdf")
+            assembler.add_template(self.template_dir / "7.pdf")
+            assembler.write(output_path)
+            return str(output_path)
         except Exception:
             return self.create_text_report(user, analysis_result)
 
@@ -344,101 +350,83 @@ class ReportGenerator:
             "premium_appendix": "block-9",
         }
 
-    def _generate_premium_pdf_by_blocks(self, individual_pages: dict, temp_dir: Path, temp_files: list, user: User) -> list:
-        pdf_parts = []
+    def render_premium_section_overlays(self, section_pages: List[dict]) -> List[List[bytes]]:
+        """Вёрстка текста раздела (независимо от остальных разделов): для каждой страницы
+        раздела — её PDF-страницы текста без шаблона"""
+        overlays = []
+        for page_data in section_pages:
+            content = page_data.get("content", "")
+            overlays.append(self.pdf_generator.render_text_overlays(content) if content and content.strip() else [])
+        return overlays
+
+    def _generate_premium_pdf_by_blocks(self, individual_pages: dict, assembler: PdfAssembler, user: User,
+                                        section_overlays: Optional[Dict[str, List[List[bytes]]]] = None):
+        """section_overlays — заранее свёрстанный текст разделов (параллельная сборка в пуле процессов);
+        разделов, которых там нет, верстаются здесь"""
         premium_templates_dir = self.template_premium_dir
         ai_template_path = self.template_dir / "3.pdf"
         block_mapping = self._get_premium_block_template_mapping()
-        pages_by_section = {}
-        for page_key, page_data in individual_pages.items():
-            section_key = page_data["section_key"]
-            if section_key not in pages_by_section:
-                pages_by_section[section_key] = []
-            pages_by_section[section_key].append((page_key, page_data))
-        ordered_sections = ["premium_analysis", "premium_strengths", "premium_growth_zones", "premium_compensation",
-            "premium_interaction", "premium_prognosis", "premium_practical", "premium_conclusion", "premium_appendix"]
+        pages_by_section = group_premium_pages(individual_pages)
+        section_overlays = section_overlays or {}
         block1_dir = premium_templates_dir / "block-1"
         title_pdf = block1_dir / "title.pdf"
         title2_pdf = block1_dir / "title-2.pdf"
         user_name = user.name or f"пользователя {self._user_id(user)}"
         completion_date = datetime.utcnow().strftime("%d.%m.%Y")
         if title_pdf.exists():
-            buf = self.pdf_generator.create_custom_title_page(title_pdf, user_name, completion_date)
-            p = temp_dir / "custom_title.pdf"
-            p.write_bytes(buf.getvalue())
-            temp_files.append(p)
-            pdf_parts.append(p)
+            assembler.add_pages([self.pdf_generator.render_title_page(title_pdf, user_name, completion_date)])
         if title2_pdf.exists():
-            pdf_parts.append(title2_pdf)
-        for section_key in ordered_sections:
+            assembler.add_template(title2_pdf)
+        for section_key in PREMIUM_SECTIONS:
             if section_key not in pages_by_section:
                 continue
             block_folder = block_mapping.get(section_key)
             block_templates_dir = premium_templates_dir / block_folder
             if not block_templates_dir.exists():
                 continue
-            section_pages = sorted(pages_by_section[section_key], key=lambda x: x[1]["page_num"])
+            section_pages = pages_by_section[section_key]
+            overlays = section_overlays.get(section_key)
+            if overlays is None:
+                overlays = self.render_premium_section_overlays(section_pages)
             block_title = block_templates_dir / "1.pdf"
             if block_title.exists():
-                pdf_parts.append(block_title)
-            for i, (_, page_data) in enumerate(section_pages, start=1):
-                content = page_data.get("content", "")
-                global_page = page_data["global_page"]
+                assembler.add_template(block_title)
+            for i, page_overlays in enumerate(overlays, start=1):
                 static_pdf = block_templates_dir / f"{i + 1}.pdf"
                 if static_pdf.exists():
-                    pdf_parts.append(static_pdf)
-                if content and content.strip():
-                    for idx, buf in enumerate(self.pdf_generator.create_text_pages(content, ai_template_path)):
-                        if buf and buf.getvalue():
-                            ap = temp_dir / f"ai_{global_page:02d}_{idx+1}.pdf"
-                            ap.write_bytes(buf.getvalue())
-                            temp_files.append(ap)
-                            pdf_parts.append(ap)
+                    assembler.add_template(static_pdf)
+                assembler.add_pages(self.pdf_generator.overlay_pages(page_overlays, ai_template_path))
             note_pdf = block_templates_dir / "note.pdf"
             if note_pdf.exists():
-                pdf_parts.append(note_pdf)
+                assembler.add_template(note_pdf)
         last_pdf = premium_templates_dir / "block-9" / "last.pdf"
         if last_pdf.exists():
-            pdf_parts.append(last_pdf)
-        return pdf_parts
+            assembler.add_template(last_pdf)
 
-    def create_premium_pdf_report(self, user: User, analysis_result: Dict) -> str:
+    def create_premium_pdf_report(self, user: User, analysis_result: Dict,
+                                  section_overlays: Optional[Dict[str, List[List[bytes]]]] = None) -> str:
         uid = self._user_id(user)
         ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         output_path = self.reports_dir / f"prizma_premium_report_{uid}_{ts}.pdf"
         try:
-            temp_dir = self.reports_dir / "temp_premium"
-            temp_dir.mkdir(exist_ok=True)
-            temp_files = []
+            assembler = PdfAssembler()
             individual_pages = analysis_result.get("individual_pages", {})
             if individual_pages:
-                pdf_parts = self._generate_premium_pdf_by_blocks(individual_pages, temp_dir, temp_files, user)
+                self._generate_premium_pdf_by_blocks(individual_pages, assembler, user, section_overlays)
             else:
                 blocks = ["premium_analysis", "premium_compensation", "premium_prognosis", "premium_practical", "premium_conclusion", "premium_appendix"]
                 tpl = self.template_dir / "3.pdf"
+                if (self.template_dir / "1.pdf").exists():
+                    assembler.add_template(self.template_dir / "1.pdf")
                 for key in blocks:
                     if analysis_result.get(key):
-                        for i, buf in enumerate(self.pdf_generator.create_text_pages(analysis_result[key], tpl)):
-                            p = temp_dir / f"{key}_{i+1}.pdf"
-                            p.write_bytes(buf.getvalue())
-                            temp_files.append(p)
-                pdf_parts = ([self.template_dir / "1.pdf"] if (self.template_dir / "1.pdf").exists() else [])
-                for key in blocks:
-                    for p in sorted(temp_dir.glob(f"{key}_*.pdf"), key=lambda x: int(x.stem.rsplit("_", 1)[-1]) if x.stem.rsplit("_", 1)[-1].isdigit() else 0):
-                        pdf_parts.append(p)
+                        assembler.add_pages(self.pdf_generator.render_text_pages(analysis_result[key], tpl))
                 if (self.template_dir / "6.pdf").exists():
-                    pdf_parts.append(self.template_dir / "6.pdf")
+                    assembler.add_template(self.template_dir / "6.pdf")
                 if (self.template_dir / "7.pdf").exists():
-                    pdf_parts.append(self.template_dir / "7.pdf")
-            success = self.pdf_generator.combine_pdfs(pdf_parts, output_path)
-            for f in temp_files:
-                if f.exists():
-                    f.unlink()
-            if temp_dir.exists() and not list(temp_dir.iterdir()):
-                temp_dir.rmdir()
-            if success:
-                return str(output_path)
-            raise Exception("Ошибка объединения PDF")
+                    assembler.add_template(self.template_dir / "7.pdf")
+            assembler.write(output_path)
+            return str(output_path)
         except Exception:
             return self.create_premium_text_report(user, analysis_result)
 
@@ -446,8 +434,6 @@ class ReportGenerator:
         uid = self._user_id(user)
         ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         fp = self.reports_dir / f"prizma_premium_report_{uid}_{ts}.txt"
-        section_keys = ["premium_analysis", "premium_strengths", "premium_growth_zones", "premium_compensation",
-            "premium_interaction", "premium_prognosis", "premium_practical", "premium_conclusion", "premium_appendix"]
-        parts = [self.pdf_generator.clean_markdown_text(analysis_result[k]) for k in section_keys if analysis_result.get(k)]
+        parts = [self.pdf_generator.clean_markdown_text(analysis_result[k]) for k in PREMIUM_SECTIONS if analysis_result.get(k)]
         fp.write_text("\n\n".join(parts) if parts else "Отчёт не доступен", encoding="utf-8")
         return str(fp)
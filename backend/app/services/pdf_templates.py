@@ -0,0 +1,142 @@
+"""
+Кэш PDF-шаблонов отчётов (на процесс).
+
+Каждый шаблон (template_pdf/3.pdf и т.п.) разбирается PdfReader один раз; страница,
+её ресурсы (фон, шрифты, цветовые пространства) и поток содержимого общие для всех
+наложений. Наложение текста — новая страница-словарь поверх тех же объектов: содержимое
+шаблона + текст как Form XObject со своими ресурсами, без разбора и склейки потоков
+(PageObject.merge_page разбирал бы содержимое шаблона заново на каждой странице).
+Запись инвалидируется по mtime и размеру файла.
+"""
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from loguru import logger
+from PyPDF2 import PageObject, PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    RectangleObject,
+)
+
+
+def _stream(data: bytes) -> DecodedStreamObject:
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    # PdfWriter.add_page клонирует новые потоки в косвенные объекты; без атрибута
+    # клонирование потока внутри массива /Contents падает (PyPDF2 3.x)
+    stream.indirect_reference = None
+    return stream
+
+
+def _resolve_all(obj, seen: set):
+    """Прочитать все объекты, на которые ссылается страница: дальше чтение идёт из кэша
+    PdfReader без обращения к его потоку (безопасно из нескольких потоков)"""
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            key = (item.idnum, item.generation)
+            if key in seen:
+                continue
+            seen.add(key)
+            item = item.get_object()
+        if isinstance(item, (DictionaryObject, ArrayObject)):
+            stack.extend(item.values() if isinstance(item, DictionaryObject) else item)
+
+
+class TemplatePage:
+    """Разобранная страница шаблона; overlay() строит страницу шаблон + текст"""
+
+    def __init__(self, reader: PdfReader, page_index: int = 0):
+        self.reader = reader
+        self.page = reader.pages[page_index]
+        seen: set = set()
+        for key, value in self.page.items():
+            if key != "/Parent":
+                _resolve_all(value, seen)
+        self._resources = self.page.get("/Resources", DictionaryObject()).get_object()
+        self._xobjects = self._resources.get("/XObject", DictionaryObject()).get_object()
+        contents = self.page.get("/Contents")
+        raw = contents.get_object() if contents is not None else None
+        self._contents: List = list(raw) if isinstance(raw, ArrayObject) else ([contents] if contents is not None else [])
+        self._overlay_name = NameObject("/PrizmaText")
+        while self._overlay_name in self._xobjects:
+            self._overlay_name = NameObject(self._overlay_name + "_")
+
+    def overlay(self, text_page: PageObject) -> PageObject:
+        """Новая страница: содержимое шаблона (в q/Q) и поверх — text_page как Form XObject.
+        Объекты шаблона не копируются и не изменяются"""
+        form = _stream(text_page.get_contents().get_data() if text_page.get_contents() else b"")
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): RectangleObject(text_page.mediabox),
+            NameObject("/Resources"): text_page.get("/Resources", DictionaryObject()),
+        })
+        xobjects = DictionaryObject(self._xobjects)
+        xobjects[self._overlay_name] = form
+        resources = DictionaryObject(self._resources)
+        resources[NameObject("/XObject")] = xobjects
+
+        page = PageObject(pdf=self.reader)
+        for key, value in self.page.items():
+            if key != "/Parent":
+                page[NameObject(key)] = value
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = ArrayObject(
+            [_stream(b"q\n"), *self._contents, _stream(b"\nQ\nq " + self._overlay_name.encode() + b" Do Q\n")]
+        )
+        return page
+
+
+class TemplateCache:
+    """Шаблоны по пути; запись перечитывается, если у файла сменились mtime или размер"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple[int, int], List[TemplatePage]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _load(self, path: Path) -> List[TemplatePage]:
+        reader = PdfReader(str(path))
+        return [TemplatePage(reader, i) for i in range(len(reader.pages))]
+
+    def pages(self, path: Path) -> List[TemplatePage]:
+        """Все страницы шаблона (разобраны один раз)"""
+        stat = path.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+        key = str(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            pages = self._load(path)
+            if entry is not None:
+                self.reloads += 1
+                logger.info(f"Шаблон PDF изменился, перечитан: {path}")
+            else:
+                self.misses += 1
+            self._entries[key] = (version, pages)
+            return pages
+
+    def get(self, path: Path) -> TemplatePage:
+        """Первая страница шаблона — основа для наложения текста"""
+        return self.pages(path)[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        return {"templates": len(self._entries), "hits": self.hits, "misses": self.misses, "reloads": self.reloads}
+
+
+template_cache = TemplateCache()
@@ -2,17 +2,29 @@
 Сервис Perplexity AI для психологического анализа. Адаптирован из perplexy_bot для PWA (user.id).
 """
 import asyncio
+import json
 import re
+import time
 import httpx
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime
 
-from app.config import PERPLEXITY_API_KEY, PERPLEXITY_MODEL, PERPLEXITY_ENABLED
+from app.config import (
+    PERPLEXITY_API_KEY, PERPLEXITY_MODEL, PERPLEXITY_ENABLED, PERPLEXITY_SECTION_CONCURRENCY, PERPLEXITY_STREAM,
+)
 from app.database.models import User, Answer, Question
 from app.prompts.base import BasePrompts
 from app.prompts.psychology import PsychologyPrompts
 from app.prompts.premium_new import PremiumPromptsNew
-from app.services.pdf_service import ReportGenerator
+from app.services.pdf_render import pdf_render_pool
+from app.services.rate_limiter import (
+    perplexity_slots, perplexity_rate, parse_retry_after, PRIORITY_FREE, PRIORITY_PREMIUM,
+)
+from app.services.http_client import perplexity_http
+from app.services.llm_cache import cache_key, llm_cache
+from app.services.llm_usage import current_usage, llm_usage
+from app.services.context_compaction import conversation_compactor, estimate_tokens
+from app.services.report_pages import Checkpoint, INITIAL_KEY, report_pages, section_key as section_ack_key
 
 from loguru import logger
 
@@ -28,6 +40,8 @@ class PerplexityAIService:
         self.api_key = PERPLEXITY_API_KEY
         self.model = PERPLEXITY_MODEL or "sonar-pro"
         self.api_url = "https://api.perplexity.ai/chat/completions"
+        self.http = perplexity_http
+        self.stream = PERPLEXITY_STREAM
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY не найден")
 
@@ -58,26 +72,61 @@ class PerplexityAIService:
             "messages": messages,
             "max_tokens": max_tokens,
             "temperature": 0.6,
-            "stream": False
+            "stream": self.stream
         }
+        key = cache_key(self.model, payload["temperature"], max_tokens, messages)
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            await llm_usage.record(self.model, cached["usage"], status="cached")
+            return cached
+        call = {"retries": 0, "queue_seconds": 0.0}
+        started = time.perf_counter()
+        try:
+            result = await self._send(headers, payload, retry_count, is_premium, call)
+        except Exception as e:
+            await llm_usage.record(self.model, {}, latency=time.perf_counter() - started, status="error",
+                                   error=str(e), **call)
+            raise
+        await llm_usage.record(self.model, result["usage"], latency=time.perf_counter() - started, **call)
+        await llm_cache.put(key, result)
+        return result
+
+    async def _send(self, headers: Dict, payload: Dict, retry_count: int, is_premium: bool, call: Dict) -> Dict:
+        """Запрос к Perplexity с квотой, слотом и повторами; в call — число повторов и ожидание квоты/слота"""
+        messages = payload["messages"]
+        priority = PRIORITY_PREMIUM if is_premium else PRIORITY_FREE
+        estimated_tokens = self._estimate_tokens(messages)
         for attempt in range(retry_count):
+            call["retries"] = attempt
             try:
-                async with httpx.AsyncClient(timeout=120.0) as client:
-                    response = await client.post(self.api_url, headers=headers, json=payload)
+                # Квота ждётся до занятия слота, чтобы не держать его во время паузы
+                waiting_since = time.perf_counter()
+                await perplexity_rate.acquire(estimated_tokens)
+                async with perplexity_slots.slot(priority):
+                    call["queue_seconds"] += time.perf_counter() - waiting_since
+                    if self.stream:
+                        async with self.http.stream("POST", self.api_url, headers=headers, json=payload) as response:
+                            if response.status_code == 200:
+                                result = await self._read_stream(response)
+                            else:
+                                await response.aread()
+                    else:
+                        response = await self.http.post(self.api_url, headers=headers, json=payload)
+                        if response.status_code == 200:
+                            result = self._parse_response(response.json())
                 if response.status_code != 200:
                     if response.status_code == 429:
-                        wait_time = (2 ** attempt) * 10
-                        logger.warning(f"Rate limit, ждем {wait_time}с")
-                        await asyncio.sleep(wait_time)
+                        wait_time = parse_retry_after(response.headers.get("Retry-After"))
+                        if wait_time is None:
+                            wait_time = (2 ** attempt) * 10
+                        logger.warning(f"Rate limit, ждем {wait_time:.1f}с")
+                        perplexity_rate.throttled(wait_time)
                         continue
                     raise Exception(f"API Error {response.status_code}: {response.text}")
-                result = response.json()
-                if "choices" in result and len(result["choices"]) > 0:
-                    content = result["choices"][0]["message"]["content"]
-                    usage = result.get("usage", {})
-                    return {"content": content, "usage": usage}
-                raise Exception("Неожиданный формат ответа от API")
-            except (httpx.RemoteProtocolError, httpx.ReadTimeout, httpx.ConnectError) as e:
+                perplexity_rate.record_usage(estimated_tokens, result["usage"].get("total_tokens", 0))
+                return result
+            except (httpx.RemoteProtocolError, httpx.ReadError, httpx.ReadTimeout, httpx.ConnectError,
+                    httpx.ConnectTimeout, httpx.PoolTimeout) as e:
                 wait_time = (2 ** attempt) * 5
                 logger.warning(f"Попытка {attempt + 1}/{retry_count} неудачна: {e}")
                 if attempt < retry_count - 1:
@@ -86,8 +135,65 @@ class PerplexityAIService:
                     raise
         raise Exception("Все попытки исчерпаны")
 
-    async def analyze_user_responses(self, user: User, questions: List[Question], answers: List[Answer]) -> Dict:
-        """Анализ ответов пользователя через Perplexity AI"""
+    @staticmethod
+    def _parse_response(result: Dict) -> Dict:
+        if "choices" in result and len(result["choices"]) > 0:
+            return {"content": result["choices"][0]["message"]["content"], "usage": result.get("usage", {})}
+        raise Exception("Неожиданный формат ответа от API")
+
+    @staticmethod
+    async def _read_stream(response: httpx.Response) -> Dict:
+        """Собрать ответ из SSE-чанков (data: {...} с choices[].delta, в конце data: [DONE])"""
+        parts = []
+        usage = {}
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices", []):
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    parts.append(delta["content"])
+        if not parts:
+            raise Exception("Пустой потоковый ответ от API")
+        return {"content": "".join(parts), "usage": usage}
+
+    async def _checkpointed_request(self, messages: List[Dict], checkpoint: Optional[Checkpoint],
+                                    done: Dict[str, Dict], page_key: str, is_premium: bool = False, **meta) -> str:
+        """Ответ модели из чекпоинта или новый запрос с записью в чекпоинт"""
+        if page_key in done:
+            return done[page_key]["content"]
+        response = await self._make_api_request(messages, is_premium=is_premium)
+        if checkpoint is not None:
+            # shield: отмена соседних разделов при ошибке не должна прерывать запись готового ответа
+            await asyncio.shield(report_pages.save(checkpoint, page_key, response["content"], **meta))
+        return response["content"]
+
+    async def _load_checkpoint(self, checkpoint: Optional[Checkpoint], pages_total: int) -> Dict[str, Dict]:
+        if checkpoint is None:
+            return {}
+        await report_pages.prune(checkpoint)
+        done = await report_pages.load(checkpoint)
+        pages_done = sum(1 for key in done if key.startswith("page"))
+        if done:
+            logger.info(f"Чекпоинт user_id={checkpoint.user_id} ({checkpoint.report_type}): "
+                        f"готово страниц {pages_done}/{pages_total}, продолжаем")
+        return done
+
+    async def analyze_user_responses(self, user: User, questions: List[Question], answers: List[Answer],
+                                     checkpoint: Optional[Checkpoint] = None) -> Dict:
+        """Анализ ответов пользователя через Perplexity AI.
+
+        С checkpoint каждый ответ модели сохраняется в report_pages сразу после получения;
+        для того же набора ответов готовые страницы повторно не запрашиваются.
+        """
+        page_types = ["page3", "page4", "page5"]
+        done = await self._load_checkpoint(checkpoint, len(page_types))
         user_data = self._prepare_user_data(user, questions, answers)
         uid = _user_id(user)
         logger.info(f"Запускаем AI анализ для пользователя {uid}")
@@ -107,27 +213,26 @@ class PerplexityAIService:
              }
         ]
 
-        initial_response = await self._make_api_request(conversation)
-        conversation.append({"role": "assistant", "content": initial_response["content"]})
+        if any(page_type not in done for page_type in page_types):
+            initial_content = await self._checkpointed_request(conversation, checkpoint, done, INITIAL_KEY)
+            conversation.append({"role": "assistant", "content": initial_content})
 
         results = {}
         page_names = {"page3": "Тип личности", "page4": "Мышление и решения", "page5": "Ограничивающие паттерны"}
 
-        for i, page_type in enumerate(["page3", "page4", "page5"]):
+        for page_type in page_types:
             page_prompt = self._get_page_specific_prompt(page_type)
             conversation.append({"role": "user", "content": page_prompt})
-            page_response = await self._make_api_request(conversation)
+            page_response = {"content": await self._checkpointed_request(conversation, checkpoint, done, page_type)}
             results[page_type] = page_response
             conversation.append({"role": "assistant", "content": page_response["content"]})
-            if i < 2:
-                await asyncio.sleep(3)
 
         return {
             "success": True,
             "page3_analysis": results["page3"]["content"],
             "page4_analysis": results["page4"]["content"],
             "page5_analysis": results["page5"]["content"],
-            "usage": {},
+            "usage": current_usage(),
             "timestamp": datetime.utcnow().isoformat()
         }
 
@@ -161,6 +266,7 @@ class PerplexityAIService:
                 return (float(match.group(1)) + float(match.group(2))) / 2
         return 1.0
 
+    # Тексты сообщений ниже и в _generate_premium_section входят в ключ чекпоинта через app.prompts.PROMPT_VERSION
     def _get_premium_page_prompt(self, section_key: str, page_num: int, total_pages: int):
         """Промпт для конкретной страницы премиум-анализа. Возвращает (промпт, expected_pages)."""
         section_subblocks = {
@@ -228,18 +334,83 @@ class PerplexityAIService:
         return prompt, expected_pages
 
     def _estimate_tokens(self, conversation: List[Dict]) -> int:
-        """Оценка токенов: для кириллицы ~1 символ ≈ 1.5-2 токена в BPE"""
-        total_bytes = sum(len(m.get("content", "").encode("utf-8")) for m in conversation)
-        return total_bytes // 3
+        return estimate_tokens(conversation)
+
+    async def _generate_premium_section(self, base_messages: List[Dict], section_key: str, section_name: str,
+                                        page_count: int, first_page: int, checkpoint: Optional[Checkpoint] = None,
+                                        done: Optional[Dict[str, Dict]] = None,
+                                        context_stats: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+        """Страницы одного раздела премиум-анализа (внутри раздела контекст накапливается).
+
+        Ответы из done (чекпоинт) не запрашиваются заново, а подставляются в контекст.
+        Сверх бюджета контекста старые страницы уходят в запрос сводкой (conversation_compactor);
+        в context_stats копятся отправленные и сэкономленные токены.
+        """
+        done = done or {}
+        if context_stats is None:
+            context_stats = {"sent": 0, "saved": 0}
+        keys = [f"page_{first_page + n:02d}" for n in range(page_count)]
+        if all(key in done for key in keys):
+            return {
+                key: {"content": done[key]["content"], "section": section_name, "section_key": section_key,
+                      "page_num": n + 1, "global_page": first_page + n}
+                for n, key in enumerate(keys)
+            }
+        conversation = list(base_messages)
+
+        section_prompt = self._get_section_prompt(section_key)
+        conversation.append({"role": "user", "content": f'Переходим к разделу "{section_name}". Инструкции:\n{section_prompt}\nИспользуйте эти инструкции для всех страниц данного раздела.'})
+        section_ack = await self._checkpointed_request(
+            conversation, checkpoint, done, section_ack_key(section_key), is_premium=True, section_key=section_key,
+        )
+        conversation.append({"role": "assistant", "content": section_ack})
+        prefix_len = len(conversation)
+
+        section_tokens = self._estimate_tokens(conversation)
+        logger.info(f"Раздел: {section_name} ({page_count} страниц), контекст ≈ {section_tokens} токенов")
+
+        pages = {}
+        for page_num in range(1, page_count + 1):
+            global_page = first_page + page_num - 1
+            page_key = f"page_{global_page:02d}"
+            page_prompt, _ = self._get_premium_page_prompt(section_key, page_num, page_count)
+            conversation.append({"role": "user", "content": page_prompt})
+            messages = conversation
+            if page_key not in done:
+                messages, saved = conversation_compactor.compact(conversation, prefix_len)
+                context_stats["sent"] += estimate_tokens(messages)
+                context_stats["saved"] += saved
+            content = await self._checkpointed_request(
+                messages, checkpoint, done, page_key, is_premium=True,
+                section_key=section_key, page_num=page_num, global_page=global_page,
+            )
+
+            pages[page_key] = {
+                "content": content,
+                "section": section_name,
+                "section_key": section_key,
+                "page_num": page_num,
+                "global_page": global_page
+            }
+            conversation.append({"role": "assistant", "content": content})
+
+        final_tokens = self._estimate_tokens(conversation)
+        logger.info(f"Раздел {section_name} завершён, финальный контекст ≈ {final_tokens} токенов")
+        return pages
 
-    async def analyze_premium_responses(self, user: User, questions: List[Question], answers: List[Answer]) -> Dict:
+    async def analyze_premium_responses(self, user: User, questions: List[Question], answers: List[Answer],
+                                        checkpoint: Optional[Checkpoint] = None) -> Dict:
         """Платный анализ (50 вопросов) — ПОСТРАНИЧНАЯ ГЕНЕРАЦИЯ 63 страниц.
 
         Архитектура контекста:
         - base_messages (system + Q&A + initial_ack) сохраняется для КАЖДОГО раздела
-        - Между разделами conversation сбрасывается до base_messages
+        - Между разделами conversation сбрасывается до base_messages, поэтому разделы
+          генерируются параллельно (до PERPLEXITY_SECTION_CONCURRENCY, общий лимит запросов — perplexity_slots)
         - Внутри раздела страницы накапливаются, чтобы AI не повторялся
-        - Модель 240k токенов — обрезка контекста не нужна
+        - Модель 240k токенов, но весь раздел уходит в каждый запрос: сверх PERPLEXITY_CONTEXT_BUDGET_TOKENS
+          старые страницы раздела отправляются сводкой тем (context_compaction)
+        - С checkpoint каждый ответ модели (первичный анализ, вводные разделов, страницы) сохраняется
+          в report_pages; для того же набора ответов сохранённое не запрашивается повторно
         """
         user_data = self._prepare_user_data(user, questions, answers)
         uid = _user_id(user)
@@ -259,12 +430,6 @@ class PerplexityAIService:
 - Если в ответах нет подходящей цитаты - НЕ создавайте пример
 - Обращайтесь к человеку через "ВЫ", "ВАШИ", "ВАМ" - НЕ используйте слова "пользователь" или "клиент"."""}
         ]
-        initial_response = await self._make_api_request(base_messages, is_premium=True)
-        base_messages.append({"role": "assistant", "content": initial_response["content"]})
-
-        base_tokens = self._estimate_tokens(base_messages)
-        logger.info(f"Первичный анализ получен: {len(initial_response['content'])} символов, base ≈ {base_tokens} токенов")
-
         page_structure = [
             ("premium_analysis", "Психологический портрет", 10),
             ("premium_strengths", "Сильные стороны и таланты", 5),
@@ -276,45 +441,54 @@ class PerplexityAIService:
             ("premium_conclusion", "Заключение", 6),
             ("premium_appendix", "Приложения", 6)
         ]
-        all_pages = {}
-        all_individual_pages = {}
+        # Разделы независимы (каждый начинается с base_messages) — генерируются параллельно,
+        # номера страниц считаются заранее, чтобы порядок не зависел от порядка завершения
+        first_pages = []
         page_counter = 1
+        for _, _, page_count in page_structure:
+            first_pages.append(page_counter)
+            page_counter += page_count
+
+        done = await self._load_checkpoint(checkpoint, page_counter - 1)
+        initial_content = done.get(INITIAL_KEY, {}).get("content", "")
+        if any(f"page_{n:02d}" not in done for n in range(1, page_counter)):
+            initial_content = await self._checkpointed_request(
+                base_messages, checkpoint, done, INITIAL_KEY, is_premium=True,
+            )
+            base_messages.append({"role": "assistant", "content": initial_content})
+
+            base_tokens = self._estimate_tokens(base_messages)
+            logger.info(f"Первичный анализ получен: {len(initial_content)} символов, base ≈ {base_tokens} токенов")
+
+        fan_out = asyncio.Semaphore(max(PERPLEXITY_SECTION_CONCURRENCY, 1))
+        context_stats = {"sent": 0, "saved": 0}
+
+        async def run_section(section, first_page):
+            async with fan_out:
+                return await self._generate_premium_section(base_messages, *section, first_page,
+                                                            checkpoint=checkpoint, done=done,
+                                                            context_stats=context_stats)
+
+        tasks = [asyncio.ensure_future(run_section(section, first_page))
+                 for section, first_page in zip(page_structure, first_pages)]
+        try:
+            section_results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
-        for section_key, section_name, page_count in page_structure:
-            conversation = list(base_messages)
-
-            section_prompt = self._get_section_prompt(section_key)
-            conversation.append({"role": "user", "content": f'Переходим к разделу "{section_name}". Инструкции:\n{section_prompt}\nИспользуйте эти инструкции для всех страниц данного раздела.'})
-            section_response = await self._make_api_request(conversation, is_premium=True)
-            conversation.append({"role": "assistant", "content": section_response["content"]})
-
-            section_tokens = self._estimate_tokens(conversation)
-            logger.info(f"Раздел: {section_name} ({page_count} страниц), контекст ≈ {section_tokens} токенов")
-
-            for page_num in range(1, page_count + 1):
-                page_prompt, _ = self._get_premium_page_prompt(section_key, page_num, page_count)
-                conversation.append({"role": "user", "content": page_prompt})
-                page_response = await self._make_api_request(conversation, is_premium=True)
-
-                all_individual_pages[f"page_{page_counter:02d}"] = {
-                    "content": page_response["content"],
-                    "section": section_name,
-                    "section_key": section_key,
-                    "page_num": page_num,
-                    "global_page": page_counter
-                }
-                conversation.append({"role": "assistant", "content": page_response["content"]})
-                page_counter += 1
-                await asyncio.sleep(1)
-
-            final_tokens = self._estimate_tokens(conversation)
-            logger.info(f"Раздел {section_name} завершён, финальный контекст ≈ {final_tokens} токенов")
-
-            section_pages = {k: v["content"] for k, v in all_individual_pages.items() if v["section_key"] == section_key}
-            all_pages[section_key] = "\n\n".join(section_pages.values())
+        all_individual_pages = {}
+        for section_pages in section_results:
+            all_individual_pages.update(section_pages)
+        all_individual_pages = dict(sorted(all_individual_pages.items()))
+        all_pages = {}
+        for (section_key, _, _), section_pages in zip(page_structure, section_results):
+            all_pages[section_key] = "\n\n".join(page["content"] for page in section_pages.values())
 
         total_length = sum(len(c) for c in all_pages.values())
-        logger.info(f"Премиум-анализ завершён: {total_length} символов, {page_counter - 1} страниц")
+        logger.info(f"Премиум-анализ завершён: {total_length} символов, {page_counter - 1} страниц; "
+                    f"контекст страниц ≈ {context_stats['sent']} токенов, сжатием сэкономлено ≈ {context_stats['saved']}")
 
         return {
             "success": True,
@@ -328,8 +502,13 @@ class PerplexityAIService:
             "premium_conclusion": all_pages.get("premium_conclusion", ""),
             "premium_appendix": all_pages.get("premium_appendix", ""),
             "individual_pages": all_individual_pages,
-            "initial_analysis": initial_response["content"],
-            "usage": {"pages_generated": page_counter - 1},
+            "initial_analysis": initial_content,
+            "usage": {
+                **current_usage(),
+                "pages_generated": page_counter - 1,
+                "context_tokens_sent": context_stats["sent"],
+                "context_tokens_saved": context_stats["saved"],
+            },
             "timestamp": datetime.utcnow().isoformat()
         }
 
@@ -354,21 +533,23 @@ class AIAnalysisService:
     def __init__(self):
         self.perplexity_enabled = PERPLEXITY_ENABLED
         self.ai_service = PerplexityAIService() if (PERPLEXITY_ENABLED and PERPLEXITY_API_KEY) else None
-        self.report_generator = ReportGenerator()
 
     async def generate_psychological_report(
-        self, user: User, questions: List[Question], answers: List[Answer]
+        self, user: User, questions: List[Question], answers: List[Answer],
+        checkpoint: Optional[Checkpoint] = None
     ) -> Dict:
         """Генерация полного психологического отчета (PDF)"""
         try:
             if self.perplexity_enabled and self.ai_service:
-                analysis_result = await self.ai_service.analyze_user_responses(user, questions, answers)
+                analysis_result = await self.ai_service.analyze_user_responses(
+                    user, questions, answers, checkpoint=checkpoint
+                )
                 if not analysis_result.get("success"):
                     analysis_result = _create_fallback_analysis()
             else:
                 analysis_result = _create_fallback_analysis()
 
-            report_filepath = self.report_generator.create_pdf_report(user, analysis_result)
+            report_filepath = await pdf_render_pool.render("full", user, analysis_result)
             logger.info(f"Отчет создан: {report_filepath}")
 
             return {
@@ -387,17 +568,20 @@ class AIAnalysisService:
             }
 
     async def generate_premium_report(
-        self, user: User, questions: List[Question], answers: List[Answer]
+        self, user: User, questions: List[Question], answers: List[Answer],
+        checkpoint: Optional[Checkpoint] = None
     ) -> Dict:
         """Генерация премиум-отчёта (template_pdf_premium)"""
         try:
             if self.perplexity_enabled and self.ai_service:
-                analysis_result = await self.ai_service.analyze_premium_responses(user, questions, answers)
+                analysis_result = await self.ai_service.analyze_premium_responses(
+                    user, questions, answers, checkpoint=checkpoint
+                )
                 if not analysis_result.get("success"):
                     raise Exception(analysis_result.get("error", "AI error"))
             else:
                 raise Exception("Премиум-отчёт требует PERPLEXITY_ENABLED")
-            report_filepath = self.report_generator.create_premium_pdf_report(user, analysis_result)
+            report_filepath = await pdf_render_pool.render("premium", user, analysis_result)
             logger.info(f"Премиум-отчёт создан: {report_filepath}")
             return {"success": True, "report_file": report_filepath}
         except Exception as e:
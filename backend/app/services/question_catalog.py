@@ -0,0 +1,120 @@
+"""
+Кэш вопросов теста в памяти.
+
+Набор вопросов меняется только перезаливкой (app/database/seed_data.py), поэтому читается
+из БД при старте, а первый/следующий вопрос вычисляются заранее. Перезаливку делает другой
+процесс, так что каталог не чаще раза в QUESTION_CATALOG_CHECK_SECONDS сверяет дешёвую
+сигнатуру таблицы (число строк, max(created_at), max(updated_at)) и перечитывается,
+если она изменилась.
+"""
+import asyncio
+import time
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import func, select
+
+from app.config import QUESTION_CATALOG_CHECK_SECONDS
+from app.database.database import async_session
+from app.database.models import Question
+
+
+class QuestionCatalog:
+    """Индексы вопросов по id, order_number и test_version + карта «следующий вопрос»"""
+
+    def __init__(self):
+        self._by_id: Dict[int, Question] = {}
+        self._by_order: Dict[int, Question] = {}
+        self._by_version: Dict[str, List[Question]] = {}
+        self._next: Dict[Tuple[int, str], Optional[Question]] = {}
+        self._signature: Optional[tuple] = None
+        self._checked_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._by_id)
+
+    @staticmethod
+    async def _read_signature(session) -> tuple:
+        # Перезаливка удаляет и вставляет строки заново (id в SQLite могут совпасть),
+        # поэтому сигнатура — по времени создания/изменения, а не по id
+        stmt = select(func.count(Question.id), func.max(Question.created_at), func.max(Question.updated_at))
+        return tuple((await session.execute(stmt)).one())
+
+    async def load(self) -> int:
+        """Прочитать все вопросы из БД и пересобрать индексы"""
+        async with async_session() as session:
+            signature = await self._read_signature(session)
+            result = await session.execute(select(Question).order_by(Question.order_number))
+            questions = list(result.scalars().all())
+        self._build(questions)
+        self._signature = signature
+        self._checked_at = time.monotonic()
+        logger.info(f"Каталог вопросов загружен: {len(questions)} вопросов")
+        return len(questions)
+
+    async def reload(self) -> int:
+        return await self.load()
+
+    async def refresh_if_changed(self) -> bool:
+        """Перечитать каталог, если вопросы в БД изменились (проверка не чаще раза в интервал)"""
+        if QUESTION_CATALOG_CHECK_SECONDS <= 0 or not self.loaded:
+            return False
+        if time.monotonic() - self._checked_at < QUESTION_CATALOG_CHECK_SECONDS:
+            return False
+        async with self._refresh_lock:
+            if time.monotonic() - self._checked_at < QUESTION_CATALOG_CHECK_SECONDS:
+                return False
+            try:
+                async with async_session() as session:
+                    signature = await self._read_signature(session)
+                self._checked_at = time.monotonic()
+                if signature == self._signature:
+                    return False
+                logger.info("Вопросы в БД изменились — перечитываем каталог")
+                await self.load()
+                return True
+            except Exception as e:
+                # Каталог остаётся прежним; следующая попытка — через интервал
+                self._checked_at = time.monotonic()
+                logger.error(f"❌ Ошибка проверки каталога вопросов: {e}")
+                return False
+
+    def _build(self, questions: List[Question]):
+        by_version: Dict[str, List[Question]] = {}
+        for q in questions:
+            if q.is_active:
+                by_version.setdefault(q.test_version, []).append(q)
+        next_map: Dict[Tuple[int, str], Optional[Question]] = {}
+        for version, active in by_version.items():
+            orders = [q.order_number for q in active]
+            for q in questions:
+                idx = bisect_right(orders, q.order_number)
+                next_map[(q.id, version)] = active[idx] if idx < len(active) else None
+        # Атомарная подмена индексов: читатели видят либо старый, либо новый набор
+        self._by_id = {q.id: q for q in questions}
+        self._by_order = {q.order_number: q for q in questions}
+        self._by_version = by_version
+        self._next = next_map
+
+    def get(self, question_id: int) -> Optional[Question]:
+        return self._by_id.get(question_id)
+
+    def get_by_order(self, order_number: int) -> Optional[Question]:
+        return self._by_order.get(order_number)
+
+    def first(self, test_version: str = "free") -> Optional[Question]:
+        questions = self._by_version.get(test_version)
+        return questions[0] if questions else None
+
+    def next(self, question_id: int, test_version: str = "free") -> Optional[Question]:
+        """Следующий активный вопрос версии после question_id (None — вопрос последний)"""
+        return self._next.get((question_id, test_version))
+
+    def by_version(self, test_version: str) -> List[Question]:
+        return list(self._by_version.get(test_version, []))
+
+
+question_catalog = QuestionCatalog()
@@ -0,0 +1,199 @@
+"""
+Ограничение одновременных запросов к внешнему API (Perplexity).
+
+PrioritySemaphore — семафор, который при освобождении слота отдаёт его
+ожидающему с наименьшим приоритетом (0 — бесплатные отчёты, пользователь ждёт;
+1 — премиум), при равном приоритете — по очереди прихода.
+
+RateLimiter — токен-бакеты по квоте Perplexity (запросов и токенов в минуту).
+Ожидание возникает только когда квота выбрана; после 429 все запросы процесса
+ждут Retry-After.
+
+Состояние лимитов — в памяти процесса, поэтому квота и лимит одновременных
+запросов делятся поровну между REPORT_WORKER_PROCESSES процессами (process_share):
+в сумме процессы не превышают квоту API.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+from app.config import PERPLEXITY_MAX_CONCURRENT_REQUESTS, PERPLEXITY_RPM, PERPLEXITY_TPM, REPORT_WORKER_PROCESSES
+
+PRIORITY_FREE = 0
+PRIORITY_PREMIUM = 1
+
+
+class PrioritySemaphore:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.acquired_total = 0
+        self.max_waiting = 0
+        self.wait_seconds_total = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: int = PRIORITY_FREE):
+        started = time.perf_counter()
+        if self.in_flight < self.limit and not self.waiting:
+            self.in_flight += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await fut  # слот передаётся в release(), in_flight уже учтён
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()  # слот успели выдать — вернуть
+                raise
+        self.acquired_total += 1
+        self.wait_seconds_total += time.perf_counter() - started
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_FREE):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "acquired_total": self.acquired_total,
+            "avg_wait_ms": round(self.wait_seconds_total / self.acquired_total * 1000, 2) if self.acquired_total else 0.0,
+        }
+
+
+class TokenBucket:
+    """Бакет на per_minute единиц в минуту, ёмкость — минутная квота.
+
+    reserve() списывает сразу и может увести баланс в минус: следующий запрос
+    ждёт, пока долг не погасится, так что ожидающие обслуживаются по очереди прихода.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Списать amount, вернуть сколько секунд ждать до разрешения"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """Поправка после ответа (фактический расход больше/меньше оценки)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def drain(self):
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число или HTTP-дата"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Квота внешнего API: запросы/мин и токены/мин (0 — без ограничения) + пауза после 429"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int = 0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._blocked_until = 0.0
+        self.acquired_total = 0
+        self.delayed_total = 0
+        self.throttled_total = 0
+        self.wait_seconds_total = 0.0
+
+    async def acquire(self, tokens: int = 0):
+        """Дождаться разрешения на запрос с оценкой tokens токенов"""
+        delay = max(0.0, self._blocked_until - time.monotonic())
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        self.acquired_total += 1
+        if delay > 0:
+            self.delayed_total += 1
+            self.wait_seconds_total += delay
+            await asyncio.sleep(delay)
+            # 429 мог прийти, пока ждали
+            blocked = self._blocked_until - time.monotonic()
+            if blocked > 0:
+                self.wait_seconds_total += blocked
+                await asyncio.sleep(blocked)
+
+    def record_usage(self, estimated: int, actual: int):
+        if self.tokens and actual:
+            self.tokens.adjust(actual - estimated)
+
+    def throttled(self, retry_after: float):
+        """Сервер ответил 429: приостановить все запросы на retry_after секунд"""
+        self.throttled_total += 1
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        if self.requests:
+            self.requests.drain()
+
+    def metrics(self) -> dict:
+        return {
+            "requests_per_minute": self.requests.capacity if self.requests else 0,
+            "tokens_per_minute": self.tokens.capacity if self.tokens else 0,
+            "acquired_total": self.acquired_total,
+            "delayed_total": self.delayed_total,
+            "throttled_total": self.throttled_total,
+            "wait_seconds_total": round(self.wait_seconds_total, 2),
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+        }
+
+
+def process_share(total: int, processes: int = REPORT_WORKER_PROCESSES) -> int:
+    """Доля лимита на один процесс (0 — без ограничения остаётся 0, иначе не меньше 1)"""
+    if total <= 0:
+        return total
+    return max(1, total // max(1, processes))
+
+
+# Доля этого процесса в лимитах запросов к Perplexity
+perplexity_slots = PrioritySemaphore(process_share(PERPLEXITY_MAX_CONCURRENT_REQUESTS))
+perplexity_rate = RateLimiter(process_share(PERPLEXITY_RPM), process_share(PERPLEXITY_TPM))
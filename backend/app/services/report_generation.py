@@ -0,0 +1,138 @@
+"""
+Генерация отчётов (бесплатный/премиум) и уведомления о результате.
+
+Вызывается воркером очереди (app/jobs); ошибки пробрасываются наружу,
+чтобы очередь могла повторить попытку. Статус FAILED и письмо об ошибке —
+только после последней попытки (notify_report_failed). Ошибка Perplexity
+тоже уходит на повтор (готовые страницы — в чекпоинте report_pages по хэшу
+ответов), и только на последней попытке отчёт собирается без AI.
+
+Уведомления о готовом отчёте (notify_report_ready) рассылаются после того, как
+задача зафиксирована как выполненная: их ошибки не приводят к повтору задачи,
+повторной генерации и повторной рассылке.
+"""
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+
+from app.config import BASE_DIR, PERPLEXITY_ENABLED
+from app.database.models import ReportGenerationStatus, ReportJob
+from app.services.database_service import db_service
+from app.services.llm_usage import llm_call_context
+from app.services.report_pages import Checkpoint, answers_hash
+
+
+async def generate_simple_report(user_id: int, report_type: str) -> str:
+    """Простая генерация отчета (без Perplexity) - текст по Q&A"""
+    reports_dir = BASE_DIR / "reports"
+    reports_dir.mkdir(exist_ok=True)
+    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    prefix = f"prizma_premium_report_{user_id}" if report_type == "premium" else f"prizma_report_{user_id}"
+    out_path = reports_dir / f"{prefix}_{ts}.txt"
+    answers = await db_service.get_user_answers_by_test_version(user_id, report_type)
+    qa = {}
+    for a in answers:
+        if a.question:
+            qa[a.question.order_number] = (a.question.text, a.text_answer or "")
+    lines = ["PRIZMA - Психологический отчет\n", "=" * 60]
+    for order in sorted(qa.keys()):
+        qtext, atext = qa[order]
+        lines.append(f"\nВопрос {order}: {qtext}")
+        lines.append(f"Ответ: {atext}")
+    out_path.write_text("\n".join(lines), encoding="utf-8")
+    return str(out_path)
+
+
+async def generate_report(user_id: int, report_type: str, job: Optional[ReportJob] = None) -> str:
+    """Сгенерировать отчёт и вернуть путь к файлу.
+
+    COMPLETED выставляет очередь вместе с завершением задачи (ReportJobQueue.complete),
+    только если аренда ещё у воркера; уведомления — notify_report_ready.
+    """
+    user = await db_service.get_user_by_id(user_id)
+    if not user:
+        raise ValueError(f"Пользователь {user_id} не найден")
+    questions = await db_service.get_questions_by_version(report_type)
+    answers = await db_service.get_user_answers_by_test_version(user_id, report_type)
+
+    if PERPLEXITY_ENABLED:
+        logger.info(f"Генерация отчёта через Perplexity AI для user_id={user_id} (report_type={report_type})")
+        try:
+            from app.services.perplexity import AIAnalysisService
+            ai = AIAnalysisService()
+            checkpoint = Checkpoint(user_id, report_type, answers_hash(answers))
+            with llm_call_context(job_id=job.id if job else None, user_id=user_id, report_type=report_type) as llm_ctx:
+                if report_type == "premium":
+                    result = await ai.generate_premium_report(user, questions, answers, checkpoint=checkpoint)
+                else:
+                    result = await ai.generate_psychological_report(user, questions, answers, checkpoint=checkpoint)
+            if llm_ctx.totals:
+                logger.info(f"LLM для user_id={user_id} ({report_type}): {llm_ctx.usage()}")
+            if result.get("success"):
+                report_path = result["report_file"]
+            else:
+                raise Exception(result.get("error", "AI error"))
+        except Exception as e:
+            if job is not None and job.attempts < job.max_attempts:
+                raise
+            logger.warning(f"Perplexity failed: {e}, falling back to simple report")
+            report_path = await generate_simple_report(user_id, report_type)
+    else:
+        report_path = await generate_simple_report(user_id, report_type)
+
+    if not report_path:
+        raise RuntimeError("Ошибка генерации")
+    return report_path
+
+
+async def notify_report_ready(user_id: int, report_type: str, report_path: str):
+    """Письмо о готовом отчёте и предложение премиума (email, push).
+
+    Вызывается один раз, после фиксации задачи; ошибки каналов только логируются.
+    """
+    try:
+        # Читаем user заново — он мог привязать Telegram во время генерации
+        user = await db_service.get_user_by_id(user_id)
+    except Exception as e:
+        logger.error(f"❌ Уведомление об отчёте для user_id={user_id} не отправлено: {e}")
+        return
+    if not user:
+        return
+    is_premium = report_type == "premium"
+    if user.email:
+        from app.services.email_service import email_service
+        try:
+            await email_service.send_report_ready_notification(
+                user.email, report_path, is_premium, user.telegram_id, user.id
+            )
+        except Exception as e:
+            logger.error(f"❌ Письмо о готовом отчёте для user_id={user_id} не отправлено: {e}")
+        if not is_premium:
+            try:
+                await email_service.send_premium_offer(user.email)
+            except Exception as e:
+                logger.error(f"❌ Письмо с предложением премиума для user_id={user_id} не отправлено: {e}")
+    if not is_premium:
+        from app.services.push_service import push_service
+        try:
+            subs = await db_service.get_push_subscriptions(user.id)
+        except Exception as e:
+            logger.error(f"❌ Push-подписки user_id={user_id} не прочитаны: {e}")
+            subs = []
+        for sub in subs:
+            try:
+                await push_service.send_premium_offer(sub.endpoint, sub.p256dh, sub.auth)
+            except Exception as e:
+                logger.error(f"❌ Push с предложением премиума для user_id={user_id} не отправлен: {e}")
+
+
+async def notify_report_failed(user_id: int, report_type: str, error: str):
+    """Окончательная ошибка: статус FAILED и письмо пользователю"""
+    await db_service.update_report_generation_status(
+        user_id, report_type, ReportGenerationStatus.FAILED, error=error
+    )
+    user = await db_service.get_user_by_id(user_id)
+    if user and user.email:
+        from app.services.email_service import email_service
+        await email_service.send_error_notification(user.email, error)
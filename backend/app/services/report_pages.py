@@ -0,0 +1,149 @@
+"""
+Чекпоинты AI-анализа (таблица report_pages).
+
+Каждая страница и каждый ответ-подтверждение модели (первичный анализ, вводная
+раздела) пишутся сразу после получения. Ключ — пользователь, тип отчёта и хэш
+ответов, поэтому повтор задачи или новая задача на тот же набор ответов
+продолжает с сохранённого, а не запрашивает 75 страниц заново.
+"""
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.config import PERPLEXITY_MODEL
+from app.database.models import Answer, ReportPage
+from app.database.unit_of_work import session_scope, commit
+from app.prompts import PROMPT_VERSION
+from app.prompts.base import BasePrompts
+from app.prompts.free_basic import FreeBasicPrompts
+from app.prompts.premium_new import PremiumPromptsNew
+from app.prompts.psychology import PsychologyPrompts
+
+# Страниц AI-анализа в отчёте (page3-page5 бесплатного, 63 страницы премиум)
+PAGES_TOTAL = {"free": 3, "premium": 63}
+INITIAL_KEY = "initial"
+
+# Классы промптов: в ключ чекпоинта входят тексты, которые возвращают их методы get_*
+PROMPT_CLASSES = (BasePrompts, PsychologyPrompts, FreeBasicPrompts, PremiumPromptsNew)
+
+
+def section_key(key: str) -> str:
+    """Ключ ответа модели на вводную раздела"""
+    return f"section:{key}"
+
+
+@lru_cache(maxsize=1)
+def prompts_fingerprint() -> str:
+    """Хэш текстов промптов (app/prompts) и PROMPT_VERSION; считается один раз на процесс.
+
+    Хэшируются сами тексты, а не исходники модулей: правки кода вокруг запросов
+    (повторы, стриминг, логирование) не сбрасывают сохранённые страницы.
+    """
+    digest = hashlib.sha256(f"v{PROMPT_VERSION}".encode("utf-8"))
+    for cls in PROMPT_CLASSES:
+        for name in sorted(n for n in dir(cls) if n.startswith("get_")):
+            text = getattr(cls, name)()
+            if isinstance(text, str):
+                digest.update(f"\x00{cls.__name__}.{name}\x00".encode("utf-8"))
+                digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def answers_hash(answers: Iterable[Answer]) -> str:
+    """Хэш набора ответов, модели и промптов: другой набор — другой чекпоинт"""
+    digest = hashlib.sha256(PERPLEXITY_MODEL.encode("utf-8"))
+    digest.update(prompts_fingerprint().encode("utf-8"))
+    for answer in sorted(answers, key=lambda a: a.question_id):
+        digest.update(f"\x00{answer.question_id}\x00".encode("utf-8"))
+        digest.update((answer.text_answer or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    user_id: int
+    report_type: str
+    answers_hash: str
+
+    def _where(self):
+        return (
+            ReportPage.user_id == self.user_id,
+            ReportPage.report_type == self.report_type,
+            ReportPage.answers_hash == self.answers_hash,
+        )
+
+
+class ReportPageStore:
+    async def load(self, checkpoint: Checkpoint) -> Dict[str, dict]:
+        """Сохранённое по чекпоинту: page_key -> {content, section_key, page_num, global_page}"""
+        async with session_scope() as session:
+            result = await session.execute(select(ReportPage).where(*checkpoint._where()))
+            return {
+                page.page_key: {
+                    "content": page.content,
+                    "section_key": page.section_key,
+                    "page_num": page.page_num,
+                    "global_page": page.global_page,
+                }
+                for page in result.scalars().all()
+            }
+
+    async def save(self, checkpoint: Checkpoint, page_key: str, content: str, section_key: Optional[str] = None,
+                   page_num: Optional[int] = None, global_page: Optional[int] = None):
+        stmt = sqlite_insert(ReportPage).values(
+            user_id=checkpoint.user_id,
+            report_type=checkpoint.report_type,
+            answers_hash=checkpoint.answers_hash,
+            page_key=page_key,
+            section_key=section_key,
+            page_num=page_num,
+            global_page=global_page,
+            content=content,
+            created_at=datetime.utcnow(),
+        ).on_conflict_do_nothing(
+            index_elements=[ReportPage.user_id, ReportPage.report_type, ReportPage.answers_hash, ReportPage.page_key]
+        )
+        async with session_scope() as session:
+            await session.execute(stmt)
+            await commit(session)
+
+    async def prune(self, checkpoint: Checkpoint) -> int:
+        """Удалить чекпоинты пользователя по этому отчёту для других наборов ответов"""
+        async with session_scope() as session:
+            result = await session.execute(
+                delete(ReportPage).where(
+                    ReportPage.user_id == checkpoint.user_id,
+                    ReportPage.report_type == checkpoint.report_type,
+                    ReportPage.answers_hash != checkpoint.answers_hash,
+                )
+            )
+            await commit(session)
+            return result.rowcount or 0
+
+    async def progress(self, user_id: int, report_type: str) -> int:
+        """Готовых страниц в последнем чекпоинте пользователя по отчёту"""
+        latest = (
+            select(ReportPage.answers_hash)
+            .where(ReportPage.user_id == user_id, ReportPage.report_type == report_type)
+            .order_by(ReportPage.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        async with session_scope() as session:
+            result = await session.execute(
+                select(func.count()).select_from(ReportPage).where(
+                    ReportPage.user_id == user_id,
+                    ReportPage.report_type == report_type,
+                    ReportPage.answers_hash == latest,
+                    ReportPage.page_key.like("page%"),
+                )
+            )
+            return result.scalar_one()
+
+
+report_pages = ReportPageStore()
@@ -0,0 +1,91 @@
+"""
+Состояние прохождения теста: текущий вопрос, номер для отображения, всего вопросов, отвечено.
+
+Вопросы берутся из question_catalog, число ответов — одним COUNT по индексу
+answers(user_id, question_id), без загрузки текстов ответов.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from app.config import FREE_QUESTIONS_LIMIT
+from app.database.models import Answer, Question, User
+from app.database.unit_of_work import session_scope
+from app.services.database_service import db_service
+from app.services.question_catalog import question_catalog
+
+
+@dataclass
+class TestState:
+    user: User
+    test_version: str
+    question: Optional[Question] = None
+    current: int = 0  # номер вопроса для отображения (в премиуме — с начала премиум-блока)
+    total: int = 0
+    answered: int = 0
+
+
+class TestStateService:
+    @staticmethod
+    def version_for(user: User) -> str:
+        return "premium" if user.is_paid else "free"
+
+    @staticmethod
+    def display_index(question: Question, test_version: str) -> int:
+        return question.order_number - FREE_QUESTIONS_LIMIT if test_version == "premium" else question.order_number
+
+    async def count_answered(self, user_id: int, test_version: str) -> int:
+        """Число ответов пользователя на активные вопросы версии"""
+        await question_catalog.refresh_if_changed()
+        stmt = select(func.count()).select_from(Answer).where(Answer.user_id == user_id)
+        if question_catalog.loaded:
+            stmt = stmt.where(Answer.question_id.in_([q.id for q in question_catalog.by_version(test_version)]))
+        else:
+            stmt = stmt.join(Question, Answer.question_id == Question.id).where(
+                Question.test_version == test_version, Question.is_active == True
+            )
+        async with session_scope() as session:
+            result = await session.execute(stmt)
+            return result.scalar_one()
+
+    async def at_question(self, user: User, question: Question, test_version: str) -> TestState:
+        """Прогресс пользователя, стоящего на вопросе question"""
+        return TestState(
+            user=user,
+            test_version=test_version,
+            question=question,
+            current=self.display_index(question, test_version),
+            total=await db_service.get_total_questions(test_version),
+            answered=await self.count_answered(user.id, test_version),
+        )
+
+    async def current(self, user: User) -> TestState:
+        """Текущий вопрос: при необходимости начинает тест или переводит оплатившего в премиум-блок.
+
+        Если тест завершён и не оплачен, question остаётся None (обработчик отвечает 400).
+        """
+        if not user.current_question_id:
+            if user.is_paid and user.free_test_completed:
+                first_premium = await db_service.get_first_question("premium")
+                user = await db_service.update_user(user.id, {"current_question_id": first_premium.id})
+            else:
+                user = await db_service.start_test(user.id)
+        else:
+            current_q = await db_service.get_question(user.current_question_id)
+            if current_q and current_q.test_version == "free" and user.is_paid:
+                first_premium = await db_service.get_first_question("premium")
+                user = await db_service.update_user(user.id, {"current_question_id": first_premium.id})
+        test_version = self.version_for(user)
+        if user.test_completed and not user.is_paid:
+            return TestState(user=user, test_version=test_version)
+        if user.test_completed and user.is_paid:
+            user = await db_service.update_user_test_status(user.id, False)
+
+        question = await db_service.get_question(user.current_question_id)
+        if not question:
+            return TestState(user=user, test_version=test_version)
+        return await self.at_question(user, question, test_version)
+
+
+test_state_service = TestStateService()
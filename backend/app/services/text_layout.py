@@ -0,0 +1,170 @@
+"""
+Вёрстка текста страниц отчёта: перенос строк и разбивка на страницы.
+
+Ширина строки при переносе не пересчитывается заново для каждого растущего префикса:
+ширины слов кэшируются по (шрифт, кегль), ширина строки — их сумма плюс пробелы
+(у TTF-шрифтов reportlab ширина строки аддитивна, кернинга нет), так что перенос
+линеен по числу слов. Заголовки определяются одним скомпилированным выражением
+по строке, приведённой к нижнему регистру один раз. Результат (TextLayout) неизменяем
+и кэшируется по тексту — повторная сборка того же отчёта вёрстку не повторяет.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+H1_KEYWORDS = ['как вы мыслите', 'кто вы по типу', 'какие паттерны', 'как вы воспринимаете']
+H2_KEYWORDS = ['подкрепляющая цитата', 'практические рекомендации', 'техники работы']
+
+
+class LayoutStyle(NamedTuple):
+    """Шрифты, кегли и интерлиньяж одного вида строк"""
+    font: str
+    size: float
+    height: float
+
+
+class LayoutLine(NamedTuple):
+    text: str
+    kind: str  # 'h1' | 'h2' | 'text'
+
+
+class TextLayout(NamedTuple):
+    """Свёрстанный текст: страницы со строками, готовыми к отрисовке"""
+    pages: Tuple[Tuple[LayoutLine, ...], ...]
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+
+class WordWidthCache:
+    """Ширины слов по (шрифт, кегль); при переполнении кэш шрифта сбрасывается"""
+
+    def __init__(self, max_words_per_font: int = 50000):
+        self.max_words_per_font = max_words_per_font
+        self._widths: Dict[Tuple[str, float], Dict[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def table(self, font: str, size: float) -> Dict[str, float]:
+        key = (font, size)
+        widths = self._widths.get(key)
+        if widths is None or len(widths) > self.max_words_per_font:
+            widths = self._widths[key] = {}
+        return widths
+
+    def width(self, widths: Dict[str, float], word: str, font: str, size: float) -> float:
+        value = widths.get(word)
+        if value is None:
+            self.misses += 1
+            value = widths[word] = stringWidth(word, font, size)
+        else:
+            self.hits += 1
+        return value
+
+    def metrics(self) -> dict:
+        return {"fonts": len(self._widths), "words": sum(map(len, self._widths.values())),
+                "hits": self.hits, "misses": self.misses}
+
+
+word_widths = WordWidthCache()
+
+
+class TextLayoutEngine:
+    """Перенос и разбивка на страницы для одного набора стилей и размеров области текста"""
+
+    def __init__(self, styles: Dict[str, LayoutStyle], text_width: float, text_height: float,
+                 widths: WordWidthCache = word_widths, max_cached_layouts: int = 256):
+        self.styles = styles
+        self.text_width = text_width
+        self.text_height = text_height
+        self.widths = widths
+        self.max_cached_layouts = max_cached_layouts
+        self._h1 = re.compile("|".join(map(re.escape, H1_KEYWORDS)))
+        self._h2 = re.compile("|".join(map(re.escape, H2_KEYWORDS)))
+        self._layouts: "OrderedDict[str, TextLayout]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def classify(self, line: str) -> str:
+        """'h1', 'h2' или 'text' для строки без крайних пробелов"""
+        lowered = line.lower()
+        if len(line) < 120 and self._h1.search(lowered):
+            return 'h1'
+        if self._h2.search(lowered) or (line.endswith(':') and len(line) < 100):
+            return 'h2'
+        return 'text'
+
+    def wrap(self, text: str, font: str, size: float, max_width: float) -> List[str]:
+        """Жадный перенос по словам (как раньше: слово шире строки остаётся целым)"""
+        widths = self.widths.table(font, size)
+        words = text.split(' ')
+        if len(words) == 1:
+            return [text]
+        space = self.widths.width(widths, ' ', font, size)
+        word_width = [self.widths.width(widths, word, font, size) for word in words]
+        if sum(word_width) + space * (len(words) - 1) <= max_width:
+            return [text]
+        lines = []
+        current, current_width = '', 0.0
+        for word, width in zip(words, word_width):
+            if current:
+                test = current + ' ' + word
+                stripped = test.strip()
+                if len(stripped) == len(test):
+                    test_width = current_width + space + width
+                else:
+                    # Пустое слово или пробельные символы по краям: строка как есть, ширина заново
+                    test, test_width = stripped, stringWidth(stripped, font, size)
+            else:
+                test, test_width = word, width
+            if test_width > max_width:
+                if current:
+                    lines.append(current)
+                current, current_width = word, width
+            else:
+                current, current_width = test, test_width
+        if current:
+            lines.append(current)
+        return lines
+
+    def layout(self, text: str) -> TextLayout:
+        """Строки текста (уже очищенного от markdown) по страницам"""
+        with self._lock:
+            cached = self._layouts.get(text)
+            if cached is not None:
+                self._layouts.move_to_end(text)
+                return cached
+        result = self._layout(text)
+        with self._lock:
+            self._layouts[text] = result
+            while len(self._layouts) > self.max_cached_layouts:
+                self._layouts.popitem(last=False)
+        return result
+
+    def _layout(self, text: str) -> TextLayout:
+        pages: List[Tuple[LayoutLine, ...]] = []
+        current_lines: List[LayoutLine] = []
+        current_height = 0.0
+        limit = self.text_height - 50
+        for raw in text.strip().split('\n'):
+            line = raw.strip()
+            if not line:
+                continue
+            kind = self.classify(line)
+            style = self.styles[kind]
+            for wrapped in self.wrap(line, style.font, style.size, self.text_width):
+                if current_height + style.height > limit and current_lines:
+                    pages.append(tuple(current_lines))
+                    current_lines, current_height = [], 0.0
+                current_lines.append(LayoutLine(wrapped, kind))
+                current_height += style.height
+        if current_lines:
+            pages.append(tuple(current_lines))
+        return TextLayout(tuple(pages))
+
+    def cached_layouts(self) -> int:
+        return len(self._layouts)
+
@@ -0,0 +1,119 @@
+"""
+Кэш пользователей в памяти процесса (по id) с коротким TTL.
+
+Хранятся значения колонок users, а не ORM-объекты: на каждое чтение собирается
+новый отсоединённый User, поэтому изменения в обработчике не попадают в кэш.
+Записи через DatabaseService сбрасывают запись; внутри UoW пользователь
+«удерживается» до конца транзакции, чтобы параллельный запрос не закэшировал
+незафиксированное старое состояние.
+
+Версия записи — users.updated_at. После записи release() оставляет «надгробие»
+с версией зафиксированной строки: put() с более старой версией (SELECT, начатый
+до коммита и завершившийся после release) отбрасывается.
+
+Сброс работает только внутри процесса: изменения из других воркеров uvicorn
+и из python -m app.jobs видны через USER_CACHE_TTL_SECONDS. Поэтому в такой
+конфигурации кэш по умолчанию выключен (см. config.py).
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.config import USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES
+from app.database.models import User
+
+_USER_COLUMN_KEYS = tuple(attr.key for attr in sa_inspect(User).column_attrs)
+
+
+class UserCache:
+    """TTL + LRU по user_id; ttl_seconds <= 0 отключает кэш"""
+
+    def __init__(self, ttl_seconds: float = USER_CACHE_TTL_SECONDS, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # user_id -> (колонки или None для «надгробия», expires_at, updated_at)
+        self._data: "OrderedDict[int, tuple[Optional[dict], float, Optional[datetime]]]" = OrderedDict()
+        self._held: Dict[int, int] = {}  # user_id -> число незавершённых транзакций с записью
+        self.hits = 0
+        self.misses = 0
+        self.stale_puts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get(self, user_id: int) -> Optional[User]:
+        item = self._data.get(user_id)
+        if item is None or item[0] is None or item[1] <= time.monotonic():
+            if item is not None and item[1] <= time.monotonic():
+                del self._data[user_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        user = User(**item[0])
+        make_transient_to_detached(user)
+        return user
+
+    def put(self, user: User) -> None:
+        if not self.enabled or user.id in self._held:
+            return
+        version = user.updated_at
+        current = self._data.get(user.id)
+        if current is not None and current[1] > time.monotonic() and self._is_older(version, current[2]):
+            self.stale_puts += 1
+            return
+        values = {key: getattr(user, key) for key in _USER_COLUMN_KEYS}
+        self._store(user.id, values, version)
+
+    @staticmethod
+    def _is_older(version: Optional[datetime], known: Optional[datetime]) -> bool:
+        return known is not None and (version is None or version < known)
+
+    def _store(self, user_id: int, values: Optional[dict], version: Optional[datetime]) -> None:
+        self._data[user_id] = (values, time.monotonic() + self.ttl_seconds, version)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    def hold(self, user_id: int) -> None:
+        """Сбросить запись и не кэшировать пользователя до release()"""
+        self._held[user_id] = self._held.get(user_id, 0) + 1
+        self.invalidate(user_id)
+
+    def release(self, user_id: int, version: Optional[datetime] = None) -> None:
+        """Конец транзакции с записью; version — updated_at зафиксированной строки"""
+        left = self._held.get(user_id, 0) - 1
+        if left > 0:
+            self._held[user_id] = left
+        else:
+            self._held.pop(user_id, None)
+        self.invalidate(user_id)
+        if self.enabled and version is not None:
+            # «Надгробие»: более старые версии не попадут в кэш, пока оно не истечёт
+            self._store(user_id, None, version)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def metrics(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl_seconds,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_puts": self.stale_puts,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+        }
+
+
+user_cache = UserCache()
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
+import sys
+
 import uvicorn
 
+from app.config import BACKGROUND_TASKS_IN_PROCESS, REPORT_WORKER_IN_PROCESS, SESSION_STORE, WEB_WORKERS
+
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8080,
-        reload=True,
-    )
+    if WEB_WORKERS > 1:
+        # Сессии в памяти у каждого воркера свои: вход в одном не виден в другом
+        if SESSION_STORE == "memory":
+            sys.exit("WEB_WORKERS > 1 требует общего хранилища сессий: SESSION_STORE=sqlite или redis")
+        # Иначе каждый воркер uvicorn запустит свой polling бота, таймеры и воркер отчётов
+        if BACKGROUND_TASKS_IN_PROCESS or REPORT_WORKER_IN_PROCESS:
+            sys.exit("При WEB_WORKERS > 1 выставьте BACKGROUND_TASKS_IN_PROCESS=false и REPORT_WORKER_IN_PROCESS=false "
+                     "и запустите фоновые задачи отдельно: python -m app.jobs")
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8080, reload=WEB_WORKERS == 1, workers=WEB_WORKERS)
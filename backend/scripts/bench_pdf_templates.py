@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кэша шаблонов PDF: страницы премиум-отчёта (по умолчанию 63 страницы текста
+на template_pdf/3.pdf) с разбором шаблона на каждую страницу, как раньше
+(PdfReader + merge_page), и через template_cache. Печатает время на отчёт и проверяет,
+что текст страниц совпадает.
+
+Запуск из backend/: python -m scripts.bench_pdf_templates [--pages 63] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PyPDF2 import PageObject, PdfReader  # noqa: E402
+
+from app.services.pdf_service import PDFGenerator  # noqa: E402
+from app.services.pdf_templates import template_cache  # noqa: E402
+
+SAMPLE_PAGE = (
+    "Кто вы по типу личности\n"
+    + "Вы склонны анализировать ситуацию, прежде чем действовать, и опираетесь на собственный опыт. " * 12
+    + "\nПрактические рекомендации:\n"
+    + "• Планируйте день блоками по 90 минут и оставляйте время на восстановление.\n" * 6
+)
+
+
+class LegacyPDFGenerator(PDFGenerator):
+    """Прежняя склейка: шаблон читается с диска и разбирается заново для каждой страницы"""
+
+    def _overlay(self, template_path: Path, text_buffer: BytesIO) -> PageObject:
+        text_buffer.seek(0)
+        template_page = PdfReader(str(template_path)).pages[0]
+        template_page.merge_page(PdfReader(text_buffer).pages[0])
+        return template_page
+
+
+def render_report(generator: PDFGenerator, template: Path, pages: int) -> list:
+    buffers = []
+    for _ in range(pages):
+        buffers.extend(generator.create_text_pages(SAMPLE_PAGE, template))
+    return buffers
+
+
+def page_texts(buffers: list) -> list:
+    return [PdfReader(BytesIO(buf.getvalue())).pages[0].extract_text() for buf in buffers]
+
+
+def measure(generator: PDFGenerator, template: Path, pages: int, repeat: int):
+    timings, buffers = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        buffers = render_report(generator, template, pages)
+        timings.append(time.perf_counter() - started)
+    return min(timings), buffers
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=63, help="страниц ИИ-текста в отчёте")
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов, берётся лучший")
+    args = parser.parse_args()
+
+    template = ROOT / "template_pdf" / "3.pdf"
+    legacy_time, legacy_buffers = measure(LegacyPDFGenerator(), template, args.pages, args.repeat)
+    template_cache.clear()
+    cached_time, cached_buffers = measure(PDFGenerator(), template, args.pages, args.repeat)
+
+    same = len(legacy_buffers) == len(cached_buffers) and page_texts(legacy_buffers) == page_texts(cached_buffers)
+    pdf_pages = len(cached_buffers)
+    print(f"Страниц PDF в отчёте: {pdf_pages}")
+    print(f"  без кэша:  {legacy_time:.2f} с на отчёт ({legacy_time / pdf_pages * 1000:.1f} мс/стр.)")
+    print(f"  с кэшем:   {cached_time:.2f} с на отчёт ({cached_time / pdf_pages * 1000:.1f} мс/стр.)")
+    print(f"  экономия:  {legacy_time - cached_time:.2f} с на отчёт (x{legacy_time / cached_time:.1f})")
+    print(f"  кэш:       {template_cache.metrics()}")
+    print(f"  текст страниц совпадает: {'да' if same else 'НЕТ'}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
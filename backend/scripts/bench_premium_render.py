@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сборки премиум-PDF в пуле процессов: время «от запроса до файла» в зависимости
+от числа процессов (PdfRenderPool). При 1 процессе или 1 CPU отчёт собирается одной задачей,
+иначе разделы верстаются параллельно (до min(процессов, CPU) разом) и собираются в порядке
+PREMIUM_SECTIONS.
+Проверяет, что число страниц и их текст не зависят от числа процессов.
+
+Запуск из backend/: python -m scripts.bench_premium_render [--workers 1,2,4] [--pages 63] [--repeat 2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PyPDF2 import PdfReader  # noqa: E402
+
+from app.services.pdf_render import PdfRenderPool  # noqa: E402
+from app.services.pdf_service import PREMIUM_SECTIONS  # noqa: E402
+
+SAMPLE_PAGE = (
+    "Кто вы по типу личности\n"
+    + "Вы склонны анализировать ситуацию, прежде чем действовать, и опираетесь на собственный опыт. " * 12
+    + "\nПрактические рекомендации:\n"
+    + "• Планируйте день блоками по 90 минут и оставляйте время на восстановление.\n" * 6
+)
+OWNER = {"id": 900100, "name": "Бенчмарк"}
+
+
+def premium_analysis(pages: int) -> dict:
+    """pages страниц ИИ-текста, разложенных по разделам поровну (как в 63-страничном отчёте — по 7)"""
+    individual_pages = {}
+    per_section = max(1, pages // len(PREMIUM_SECTIONS))
+    for n in range(pages):
+        section = PREMIUM_SECTIONS[min(n // per_section, len(PREMIUM_SECTIONS) - 1)]
+        individual_pages[f"page_{n + 1:02d}"] = {
+            "section_key": section, "page_num": n + 1, "global_page": n + 1,
+            "content": f"{SAMPLE_PAGE}\nСтраница {n + 1}",
+        }
+    return {"individual_pages": individual_pages}
+
+
+def pdf_fingerprint(path: str) -> tuple:
+    reader = PdfReader(path)
+    return len(reader.pages), tuple(page.extract_text() for page in reader.pages)
+
+
+async def measure(workers: int, analysis: dict, repeat: int):
+    pool = PdfRenderPool(workers=workers)
+    try:
+        # Прогрев: старт процессов и разбор шаблонов в каждом из них не входят в замер
+        warmup = [await pool.render("premium", OWNER, analysis) for _ in range(max(1, workers))]
+        for path in warmup:
+            os.remove(path)
+        timings, fingerprint = [], None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            path = await pool.render("premium", OWNER, analysis)
+            timings.append(time.perf_counter() - started)
+            fingerprint = pdf_fingerprint(path)
+            os.remove(path)
+        return min(timings), fingerprint
+    finally:
+        pool.shutdown()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="числа процессов через запятую")
+    parser.add_argument("--pages", type=int, default=63, help="страниц ИИ-текста в отчёте")
+    parser.add_argument("--repeat", type=int, default=2, help="прогонов, берётся лучший")
+    args = parser.parse_args()
+
+    analysis = premium_analysis(args.pages)
+    worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+    print(f"CPU: {os.cpu_count()}, страниц ИИ-текста: {args.pages}")
+    print(f"{'процессов':<10}{'время, с':>10}{'ускорение':>11}{'страниц PDF':>13}")
+    base_time, base_fingerprint, same = None, None, True
+    for workers in worker_counts:
+        elapsed, fingerprint = await measure(workers, analysis, args.repeat)
+        if base_time is None:
+            base_time, base_fingerprint = elapsed, fingerprint
+        same = same and fingerprint == base_fingerprint
+        print(f"{workers:<10}{elapsed:>10.2f}{base_time / elapsed:>10.2f}x{fingerprint[0]:>13}")
+    print("Страницы и их порядок совпадают:", "да" if same else "НЕТ")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
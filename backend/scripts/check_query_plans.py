@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов (EXPLAIN QUERY PLAN): answers и questions
+должны читаться по индексам, без полного сканирования таблиц.
+Создаёт временную БД, применяет схему и миграции. Код выхода 1 — есть full scan.
+
+Запуск из backend/: python -m scripts.check_query_plans
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+_tmp_dir = tempfile.mkdtemp(prefix="prizma_plans_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp_dir}/plans.db"
+
+from sqlalchemy import func, select, text, and_  # noqa: E402
+
+from app.database.database import engine, init_db, close_db  # noqa: E402
+from app.database.models import Answer, Question  # noqa: E402
+
+
+def hot_queries() -> dict:
+    """Те же запросы, что строят DatabaseService и TestStateService"""
+    return {
+        "answers_by_test_version": (
+            select(Answer)
+            .join(Question, Answer.question_id == Question.id)
+            .where(Answer.user_id == 1, Question.test_version == "premium", Question.is_active == True)
+            .order_by(Question.order_number)
+        ),
+        "answers_by_user": select(Answer).where(Answer.user_id == 1).order_by(Answer.created_at),
+        "answer_by_user_question": select(Answer).where(Answer.user_id == 1, Answer.question_id == 9),
+        "answered_count": (
+            select(func.count()).select_from(Answer)
+            .where(Answer.user_id == 1, Answer.question_id.in_([1, 2, 3, 4, 5, 6, 7, 8]))
+        ),
+        "questions_by_version": (
+            select(Question)
+            .where(and_(Question.is_active == True, Question.test_version == "free"))
+            .order_by(Question.order_number)
+        ),
+        "next_question": (
+            select(Question)
+            .where(and_(Question.order_number > 3, Question.is_active == True, Question.test_version == "free"))
+            .order_by(Question.order_number)
+            .limit(1)
+        ),
+    }
+
+
+def _full_scans(plan_rows: list) -> list:
+    scans = []
+    for detail in plan_rows:
+        if detail.startswith("SCAN ") and "USING" not in detail:
+            scans.append(detail)
+    return scans
+
+
+async def main() -> int:
+    await init_db()
+    failed = False
+    async with engine.connect() as conn:
+        for name, stmt in hot_queries().items():
+            sql = str(stmt.compile(engine.sync_engine, compile_kwargs={"literal_binds": True}))
+            result = await conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+            details = [row[3] for row in result.fetchall()]
+            scans = _full_scans(details)
+            status = "FAIL" if scans else "OK"
+            failed = failed or bool(scans)
+            print(f"[{status}] {name}")
+            for detail in details:
+                print(f"       {detail}")
+    await close_db()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
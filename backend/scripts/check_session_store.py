@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Проверка RedisSessionStore на fakeredis (без сервера Redis): set/get, продление срока
+при чтении (скользящий TTL), delete, истечение сессии и evict_expired, close.
+Код выхода 1 — хотя бы одна проверка не прошла.
+
+Нужен пакет fakeredis (pip install fakeredis).
+Запуск из backend/: python -m scripts.check_session_store
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.auth.sessions import RedisSessionStore  # noqa: E402
+
+TTL_SECONDS = 2
+
+
+async def check_set_get(store: RedisSessionStore) -> list:
+    session_id = await store.create(101)
+    errors = []
+    if await store.get(session_id) != 101:
+        errors.append("get после create не вернул user_id")
+    ttl = await store.client.ttl(store._key(session_id))
+    if not 0 < ttl <= TTL_SECONDS:
+        errors.append(f"TTL ключа {ttl}, ожидался 1..{TTL_SECONDS}")
+    await store.set(session_id, 102)
+    if await store.get(session_id) != 102:
+        errors.append("set не перезаписал сессию")
+    if await store.get("no-such-session") is not None:
+        errors.append("неизвестная сессия не вернула None")
+    return errors
+
+
+async def check_touch(store: RedisSessionStore) -> list:
+    session_id = await store.create(201)
+    key = store._key(session_id)
+    await store.client.expire(key, 1)
+    if await store.get(session_id) != 201:
+        return ["сессия не читается до истечения"]
+    ttl = await store.client.ttl(key)
+    if ttl <= 1:
+        return [f"get не продлил TTL (осталось {ttl} с)"]
+    return []
+
+
+async def check_delete(store: RedisSessionStore) -> list:
+    session_id = await store.create(301)
+    await store.delete(session_id)
+    errors = []
+    if await store.get(session_id) is not None:
+        errors.append("сессия читается после delete")
+    if await store.client.exists(store._key(session_id)):
+        errors.append("ключ остался после delete")
+    await store.delete(session_id)  # повторное удаление — без ошибки
+    return errors
+
+
+async def check_evict(store: RedisSessionStore) -> list:
+    expiring = await store.create(401)
+    alive = await store.create(402)
+    await store.client.expire(store._key(expiring), 1)
+    await asyncio.sleep(1.2)
+    errors = []
+    if await store.get(expiring) is not None:
+        errors.append("истёкшая сессия читается")
+    # Истечение — на стороне сервера (TTL ключа), evict_expired ничего не делает
+    evicted = await store.evict_expired()
+    if evicted != 0:
+        errors.append(f"evict_expired вернул {evicted}, ожидался 0")
+    if await store.get(alive) != 402:
+        errors.append("evict_expired задел активную сессию")
+    return errors
+
+
+async def main() -> int:
+    try:
+        from fakeredis import FakeServer
+        from fakeredis.aioredis import FakeRedis
+    except ImportError:
+        print("Нужен пакет fakeredis: pip install fakeredis")
+        return 1
+
+    checks = {
+        "set_get": check_set_get,
+        "touch": check_touch,
+        "delete": check_delete,
+        "evict": check_evict,
+    }
+    failed = False
+    # Как в from_url (decode_responses=True) и с ответами в bytes
+    for decode in (True, False):
+        server = FakeServer()
+        store = RedisSessionStore(FakeRedis(server=server, decode_responses=decode), ttl_seconds=TTL_SECONDS)
+        for name, check in checks.items():
+            errors = await check(store)
+            failed = failed or bool(errors)
+            print(f"[{'FAIL' if errors else 'OK'}] {name} (decode_responses={decode})")
+            for error in errors:
+                print(f"       {error}")
+        await store.close()
+        # Ключи — только под префиксом хранилища
+        other = FakeRedis(server=server)
+        foreign = [key for key in await other.keys("*") if not key.startswith(store.prefix.encode())]
+        await other.aclose()
+        status = "FAIL" if foreign else "OK"
+        failed = failed or bool(foreign)
+        print(f"[{status}] prefix (decode_responses={decode})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
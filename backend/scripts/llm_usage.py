@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Сводка по вызовам LLM из таблицы llm_calls: p50/p95 длительности и токенов
+на вызов и на отчёт (сумма по задаче очереди) по типам отчёта.
+
+Запуск из backend/: python -m scripts.llm_usage [--days 30] [--json]
+"""
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.database.database import init_db, close_db  # noqa: E402
+from app.services.llm_usage import llm_usage  # noqa: E402
+
+ROWS = [
+    ("call_latency_ms", "Вызов, мс"),
+    ("call_queue_ms", "Ожидание квоты/слота, мс"),
+    ("call_prompt_tokens", "Вызов, prompt-токены"),
+    ("call_completion_tokens", "Вызов, completion-токены"),
+    ("report_calls", "Отчёт, вызовов"),
+    ("report_prompt_tokens", "Отчёт, prompt-токены"),
+    ("report_completion_tokens", "Отчёт, completion-токены"),
+    ("report_llm_seconds", "Отчёт, сек LLM"),
+]
+
+
+def _fmt(value) -> str:
+    return "—" if value is None else f"{value:g}"
+
+
+async def main(days: float, as_json: bool) -> int:
+    await init_db()
+    summary = await llm_usage.summary(days)
+    await close_db()
+    if as_json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 0
+    if not summary["by_type"]:
+        print(f"Вызовов LLM за {days:g} дн. нет")
+        return 0
+    for report_type, stats in summary["by_type"].items():
+        print(f"\n[{report_type}] вызовов: {stats['calls']}, отчётов: {stats['reports']}, "
+              f"ошибок: {stats['errors']}, из кэша: {stats['cached']}, повторов: {stats['retries']}")
+        print(f"  {'':<28}{'p50':>12}{'p95':>12}{'avg':>12}")
+        for key, title in ROWS:
+            dist = stats[key]
+            print(f"  {title:<28}{_fmt(dist['p50']):>12}{_fmt(dist['p95']):>12}{_fmt(dist['avg']):>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сводка по вызовам LLM")
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.days, args.json)))
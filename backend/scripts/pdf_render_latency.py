@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Задержка API во время сборки PDF: клиент непрерывно запрашивает GET /api/info
+(ASGI-приложение в том же процессе и event loop), пока собираются премиум-отчёты.
+Три прогона: без отчётов, сборка прямо в event loop (как раньше), через pdf_render_pool.
+Печатает p50/p99/max задержки запросов. Код выхода 1 — p99 с пулом заметно хуже базового.
+
+Запуск из backend/: python -m scripts.pdf_render_latency [--reports 2] [--pages 20] [--workers 2]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.services.pdf_render import PdfRenderPool, render_report  # noqa: E402
+
+SAMPLE_PAGE = (
+    "Кто вы по типу личности\n"
+    + "Вы склонны анализировать ситуацию, прежде чем действовать, и опираетесь на собственный опыт. " * 12
+    + "\nПрактические рекомендации:\n"
+    + "• Планируйте день блоками по 90 минут и оставляйте время на восстановление.\n" * 6
+)
+SECTIONS = ["premium_analysis", "premium_strengths", "premium_growth_zones", "premium_compensation",
+            "premium_interaction", "premium_prognosis", "premium_practical", "premium_conclusion", "premium_appendix"]
+
+
+def premium_analysis(pages: int) -> dict:
+    individual_pages = {}
+    for n in range(pages):
+        section = SECTIONS[n * len(SECTIONS) // pages]
+        individual_pages[f"page_{n + 1:02d}"] = {
+            "section_key": section, "page_num": n + 1, "global_page": n + 1, "content": SAMPLE_PAGE,
+        }
+    return {"individual_pages": individual_pages}
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list, interval: float = 0.01):
+    """Запросы по расписанию раз в interval; задержка считается от запланированного момента,
+    поэтому время, когда event loop был занят и запрос не мог уйти, тоже учитывается"""
+    scheduled = time.perf_counter()
+    while not stop.is_set():
+        response = await client.get("/api/info")
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - scheduled) * 1000)
+        scheduled = max(scheduled + interval, time.perf_counter() - 1.0)
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+
+
+async def run(mode: str, reports: int, analysis: dict, pool: PdfRenderPool, duration: float) -> dict:
+    latencies: list = []
+    paths: list = []
+    stop = asyncio.Event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        prober = asyncio.create_task(probe(client, stop, latencies))
+        await asyncio.sleep(0.1)
+        started = time.perf_counter()
+        if mode == "baseline":
+            await asyncio.sleep(duration)
+        elif mode == "inline":
+            for i in range(reports):
+                paths.append(render_report("premium", {"id": 900000 + i, "name": "Бенчмарк"}, analysis))
+                await asyncio.sleep(0)
+        else:
+            paths = await asyncio.gather(*(
+                pool.render("premium", {"id": 900000 + i, "name": "Бенчмарк"}, analysis) for i in range(reports)
+            ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await prober
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+    return {
+        "mode": mode, "seconds": elapsed, "requests": len(latencies),
+        "p50": statistics.median(latencies), "p99": percentile(latencies, 0.99), "max": max(latencies),
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=2, help="премиум-отчётов за прогон")
+    parser.add_argument("--pages", type=int, default=20, help="страниц ИИ-текста в отчёте")
+    parser.add_argument("--workers", type=int, default=2, help="процессов в пуле сборки")
+    args = parser.parse_args()
+
+    analysis = premium_analysis(args.pages)
+    pool = PdfRenderPool(workers=args.workers)
+    # Пул запускается заранее: старт процессов (spawn) не относится к задержке API
+    await pool.render("premium", {"id": 900999, "name": "Прогрев"}, premium_analysis(1))
+    for path in (ROOT / "reports").glob("prizma_premium_report_900999_*"):
+        path.unlink()
+
+    inline = await run("inline", args.reports, analysis, pool, 0)
+    pooled = await run("pool", args.reports, analysis, pool, 0)
+    baseline = await run("baseline", args.reports, analysis, pool, max(2.0, pooled["seconds"]))
+    pool.shutdown()
+
+    print(f"{'режим':<10}{'отчёты, с':>11}{'запросов':>10}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for row in (baseline, inline, pooled):
+        print(f"{row['mode']:<10}{row['seconds']:>11.2f}{row['requests']:>10}"
+              f"{row['p50']:>10.1f}{row['p99']:>10.1f}{row['max']:>10.1f}")
+    # Допуск на шум: p99 с пулом не больше базового x3 + 20 мс
+    ok = pooled["p99"] <= baseline["p99"] * 3 + 20
+    print("p99 API с пулом сборки PDF:", "в норме" if ok else "ДЕГРАДАЦИЯ")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
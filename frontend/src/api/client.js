@@ -56,6 +56,13 @@ export const api = {
       body: JSON.stringify({ text_answer: textAnswer, answer_type: answerType }),
     }),
 
+  // answers: [{ question_id, text_answer, answer_type }] — ответы, накопленные офлайн
+  submitAnswersBatch: (answers) =>
+    fetchApi('/me/answers/batch', {
+      method: 'POST',
+      body: JSON.stringify({ answers }),
+    }),
+
   getProgress: () => fetchApi('/me/progress'),
 
   generateReport: () =>
@@ -18,6 +18,18 @@ export default function DownloadPage() {
     api.getReportsStatus().then(setStatus)
   }, [])
 
+  // Пока премиум генерируется — обновляем статус и прогресс страниц; интервал снимается
+  // при завершении генерации (premiumProcessing станет false) и при уходе со страницы
+  const premiumProcessing = status?.premium?.status === 'PROCESSING'
+  useEffect(() => {
+    if (!premiumProcessing) return
+    let mounted = true
+    const id = setInterval(() => {
+      api.getReportsStatus().then((res) => { if (mounted) setStatus(res) }).catch(() => {})
+    }, 3000)
+    return () => { mounted = false; clearInterval(id) }
+  }, [premiumProcessing])
+
   if (redirecting || !status) {
     return (
       <main className="main download">
@@ -31,7 +43,7 @@ export default function DownloadPage() {
 
   const freeReady = status.free?.status === 'COMPLETED'
   const premiumReady = status.premium?.status === 'COMPLETED'
-  const premiumProcessing = status.premium?.status === 'PROCESSING'
+  const premiumJob = status.premium?.job
 
   return (
     <main className="main download">
@@ -120,7 +132,7 @@ export default function DownloadPage() {
       )}
       {(premiumProcessing || (!freeReady && !premiumReady && !premiumProcessing)) && (
         <p style={{ textAlign: 'center', marginTop: 24 }}>
-          {premiumProcessing && <>Премиум отчёт генерируется...</>}
+          {premiumProcessing && <>Премиум отчёт генерируется...{premiumJob?.pages_done > 0 && <> ({premiumJob.pages_done} из {premiumJob.pages_total} страниц)</>}</>}
           {!freeReady && !premiumReady && !premiumProcessing && <>Отчёты пока не готовы. Проверьте страницу позже.</>}
         </p>
       )}